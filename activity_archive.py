@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from config import Config
+from models import db, ActivityLog
+
+COLUMNS = ('id', 'user_id', 'action', 'timestamp', 'details')
+
+def _owner_dir(archive_dir, user_id):
+    return os.path.join(archive_dir, f"user-{user_id}" if user_id is not None else 'system')
+
+def partition_path(archive_dir, timestamp, user_id=None):
+    """One archive file per user and calendar month: <dir>/user-7/2024/activity-2024-03.jsonl.gz"""
+    return os.path.join(_owner_dir(archive_dir, user_id), f"{timestamp:%Y}",
+                        f"activity-{timestamp:%Y-%m}.jsonl.gz")
+
+def _owner_dirs(archive_dir, user_id):
+    """
+    Directories holding the user's archives, or everyone's when user_id is None. Archives written
+    before they were split by user sit directly under archive_dir and are always included.
+    """
+    if user_id is not None:
+        return [_owner_dir(archive_dir, user_id), archive_dir]
+    owners = [name for name in os.listdir(archive_dir) if name.startswith('user-') or name == 'system']
+    return [os.path.join(archive_dir, name) for name in owners] + [archive_dir]
+
+def _partitions(archive_dir, start, end, user_id=None):
+    """Archive files of the user (or everyone) whose month overlaps [start, end], oldest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    paths = []
+    for owner_dir in _owner_dirs(archive_dir, user_id):
+        years = sorted(os.listdir(owner_dir)) if os.path.isdir(owner_dir) else []
+        for year in filter(str.isdigit, years):
+            year_dir = os.path.join(owner_dir, year)
+            for name in sorted(os.listdir(year_dir)) if os.path.isdir(year_dir) else []:
+                if not name.startswith('activity-') or not name.endswith('.jsonl.gz'):
+                    continue
+                month = datetime.strptime(name[len('activity-'):-len('.jsonl.gz')], '%Y-%m')
+                next_month = (month + timedelta(days=32)).replace(day=1)
+                if (start is None or next_month > start) and (end is None or month <= end):
+                    paths.append(os.path.join(year_dir, name))
+    # File names carry the month, so sorting on them interleaves the owners chronologically.
+    return sorted(paths, key=os.path.basename)
+
+def _append(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Appending opens a new gzip member; gzip readers treat concatenated members as one stream.
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                f.write((json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def archive_activity(now=None, hot_days=None, archive_dir=None, batch_size=None):
+    """
+    Move ActivityLog rows older than the hot window into the monthly archives, one batch at a
+    time: a batch is appended and synced to disk before its rows are deleted and committed, so
+    an interrupted run loses nothing (a rerun may archive a batch twice; readers drop repeats).
+    Returns the number of rows moved.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=hot_days if hot_days is not None else Config.ACTIVITY_HOT_DAYS)
+    archive_dir = archive_dir or Config.ACTIVITY_ARCHIVE_DIR
+    batch_size = batch_size or Config.ACTIVITY_ARCHIVE_BATCH
+    table = ActivityLog.__table__
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(select(*(table.c[name] for name in COLUMNS))
+                                  .where(table.c.timestamp < cutoff, table.c.id > last_id)
+                                  .order_by(table.c.id).limit(batch_size)).all()
+        if not rows:
+            return moved
+        partitions = {}
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record['timestamp'] = row.timestamp.isoformat()
+            partitions.setdefault(partition_path(archive_dir, row.timestamp, row.user_id), []).append(record)
+        for path, records in partitions.items():
+            _append(path, records)
+        ids = [row.id for row in rows]
+        db.session.execute(delete(table).where(table.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        last_id = ids[-1]
+
+def _matches(record, user_id, action, start, end):
+    return ((user_id is None or record['user_id'] == user_id)
+            and (action is None or record['action'] == action)
+            and (start is None or record['timestamp'] >= start)
+            and (end is None or record['timestamp'] < end))
+
+def query_activity(user_id=None, start=None, end=None, action=None, limit=None, archive_dir=None,
+                   include_archive=True):
+    """
+    Activity entries in [start, end), newest first, from the live table and any archive month
+    overlapping the range, so callers never need to know where the retention cut-off lies.
+    A user's query only opens that user's archives; include_archive=False reads the live table alone.
+    """
+    archive_dir = archive_dir or Config.ACTIVITY_ARCHIVE_DIR
+    query = ActivityLog.query
+    if user_id is not None:
+        query = query.filter(ActivityLog.user_id == user_id)
+    if action is not None:
+        query = query.filter(ActivityLog.action == action)
+    if start is not None:
+        query = query.filter(ActivityLog.timestamp >= start)
+    if end is not None:
+        query = query.filter(ActivityLog.timestamp < end)
+    query = query.order_by(ActivityLog.timestamp.desc())
+    if limit:
+        query = query.limit(limit)
+    records = {log.id: {'id': log.id, 'user_id': log.user_id, 'action': log.action,
+                        'timestamp': log.timestamp, 'details': log.details} for log in query}
+    # The live table holds everything newer than its oldest row, so a full page from it
+    # can only be completed by archives when the range reaches further back.
+    if not include_archive or (limit and len(records) >= limit):
+        return list(records.values())
+    for path in reversed(_partitions(archive_dir, start, end, user_id)):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                if record['id'] not in records and _matches(record, user_id, action, start, end):
+                    records[record['id']] = record
+        if limit and len(records) >= limit:
+            break
+    results = sorted(records.values(), key=lambda r: (r['timestamp'], r['id']), reverse=True)
+    return results[:limit] if limit else results
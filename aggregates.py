@@ -0,0 +1,252 @@
+from datetime import datetime
+from sqlalchemy import event, inspect, select, update, insert, delete, func, literal, union_all
+from sqlalchemy.orm import Session, object_session
+from models import db, User, Transaction, CashAccount, CashTransaction, Dividend, DailyFlow, DailyRealizedGain, CorporateAction
+from lots import LotBook, DEFAULT_METHOD
+from corporate_actions import load_split_factors, NO_SPLITS
+
+# Signed contribution of each cash transaction type to (operating, investing).
+# Deposits and withdrawals count against the receiving/paying account; conversions are internal.
+CASH_FLOW_SIGNS = {
+    'deposit': ('to_account_id', 1, 0),
+    'withdraw': ('from_account_id', -1, 0),
+    'investment_buy': ('from_account_id', 0, -1),
+    'investment_sell': ('to_account_id', 0, 1),
+}
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _old_value(target, attr):
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+def _pending(target):
+    session = object_session(target)
+    return session.info.setdefault('aggregate_changes', {'accounts': {}, 'users': {}, 'positions': set()})
+
+def _add_cash_delta(pending, txn_type, from_id, to_id, day, amount, sign):
+    if txn_type not in CASH_FLOW_SIGNS or amount is None:
+        return
+    account_attr, operating, investing = CASH_FLOW_SIGNS[txn_type]
+    account_id = from_id if account_attr == 'from_account_id' else to_id
+    if account_id is None:
+        return
+    key = (account_id, _day(day))
+    o, i = pending['accounts'].get(key, (0, 0))
+    pending['accounts'][key] = (o + sign * operating * amount, i + sign * investing * amount)
+
+def _add_dividend_delta(pending, user_id, day, amount, sign):
+    key = (user_id, _day(day))
+    pending['users'][key] = pending['users'].get(key, 0) + sign * amount
+
+def _cash_state(target, old=False):
+    value = _old_value if old else getattr
+    return tuple(value(target, attr) for attr in ('transaction_type', 'from_account_id', 'to_account_id', 'date', 'amount'))
+
+@event.listens_for(CashTransaction, 'after_insert')
+def _cash_inserted(mapper, connection, target):
+    _add_cash_delta(_pending(target), *_cash_state(target), 1)
+
+@event.listens_for(CashTransaction, 'after_update')
+def _cash_updated(mapper, connection, target):
+    pending = _pending(target)
+    _add_cash_delta(pending, *_cash_state(target, old=True), -1)
+    _add_cash_delta(pending, *_cash_state(target), 1)
+
+@event.listens_for(CashTransaction, 'after_delete')
+def _cash_deleted(mapper, connection, target):
+    _add_cash_delta(_pending(target), *_cash_state(target, old=True), -1)
+
+@event.listens_for(Dividend, 'after_insert')
+def _dividend_inserted(mapper, connection, target):
+    _add_dividend_delta(_pending(target), target.user_id, target.date, target.amount, 1)
+
+@event.listens_for(Dividend, 'after_update')
+def _dividend_updated(mapper, connection, target):
+    pending = _pending(target)
+    _add_dividend_delta(pending, _old_value(target, 'user_id'), _old_value(target, 'date'), _old_value(target, 'amount'), -1)
+    _add_dividend_delta(pending, target.user_id, target.date, target.amount, 1)
+
+@event.listens_for(Dividend, 'after_delete')
+def _dividend_deleted(mapper, connection, target):
+    _add_dividend_delta(_pending(target), _old_value(target, 'user_id'), _old_value(target, 'date'), _old_value(target, 'amount'), -1)
+
+@event.listens_for(Transaction, 'after_insert')
+@event.listens_for(Transaction, 'after_update')
+@event.listens_for(Transaction, 'after_delete')
+def _transaction_changed(mapper, connection, target):
+    # Realized gains depend on the whole lot history, so the position is recomputed once per flush.
+    positions = _pending(target)['positions']
+    for user_id, investment_id in ((target.user_id, target.investment_id),
+                                   (_old_value(target, 'user_id'), _old_value(target, 'investment_id'))):
+        if investment_id is not None:
+            positions.add((user_id, investment_id))
+
+def _apply_flow_delta(conn, user_id, day, operating=0, investing=0, dividends=0):
+    table = DailyFlow.__table__
+    result = conn.execute(update(table).where(table.c.user_id == user_id, table.c.day == day).values(
+        operating=table.c.operating + operating,
+        investing=table.c.investing + investing,
+        dividends=table.c.dividends + dividends,
+    ))
+    if result.rowcount == 0:
+        conn.execute(insert(table).values(user_id=user_id, day=day, operating=operating,
+                                          investing=investing, dividends=dividends))
+    else:
+        conn.execute(delete(table).where(table.c.user_id == user_id, table.c.day == day, table.c.operating == 0,
+                                         table.c.investing == 0, table.c.dividends == 0))
+
+def realized_gains_by_day(txns, method=DEFAULT_METHOD, splits=None):
+    """
+    Realized gain per sell day for one position under a lot method, with trades restated across splits.
+    txns are (date, type, price, quantity, id, lot_id) in date order.
+    """
+    book = LotBook(method, splits)
+    gains = {}
+    for txn_date, txn_type, price, quantity, txn_id, lot_id in txns:
+        gain = book.apply(txn_type, quantity, price, txn_id, lot_id, txn_date)
+        if txn_type.lower() == 'sell':
+            day = _day(txn_date)
+            gains[day] = gains.get(day, 0) + gain
+    return gains
+
+def refresh_realized_gains(conn, user_id, investment_id, method=None, splits=None):
+    # method and splits are looked up when not given; rebuilds pass them in for every position.
+    txn_table = Transaction.__table__
+    gain_table = DailyRealizedGain.__table__
+    if method is None:
+        method = conn.execute(select(User.__table__.c.lot_method).where(User.__table__.c.id == user_id)).scalar()
+    if splits is None:
+        splits = load_split_factors(conn, [investment_id]).get(investment_id, NO_SPLITS)
+    txns = conn.execute(select(txn_table.c.date, txn_table.c.transaction_type, txn_table.c.transaction_price,
+                               txn_table.c.quantity, txn_table.c.id, txn_table.c.lot_id)
+                        .where(txn_table.c.user_id == user_id, txn_table.c.investment_id == investment_id)
+                        .order_by(txn_table.c.date, txn_table.c.id)).all()
+    conn.execute(delete(gain_table).where(gain_table.c.user_id == user_id, gain_table.c.investment_id == investment_id))
+    rows = [{'user_id': user_id, 'investment_id': investment_id, 'day': day, 'amount': amount}
+            for day, amount in realized_gains_by_day(txns, method or DEFAULT_METHOD, splits).items()]
+    if rows:
+        conn.execute(insert(gain_table), rows)
+
+@event.listens_for(User, 'after_update')
+def _lot_method_changed(mapper, connection, target):
+    # Switching lot method changes the realized gains of every position the user has traded.
+    if not inspect(target).attrs.lot_method.history.has_changes():
+        return
+    t = Transaction.__table__
+    _pending(target)['positions'].update(tuple(row) for row in connection.execute(
+        select(t.c.user_id, t.c.investment_id).where(t.c.user_id == target.id, t.c.investment_id.isnot(None))
+        .distinct()))
+
+@event.listens_for(CorporateAction, 'after_insert')
+@event.listens_for(CorporateAction, 'after_update')
+@event.listens_for(CorporateAction, 'after_delete')
+def _corporate_action_changed(mapper, connection, target):
+    # A split scales quantity and price inversely, so gains between trades on the same side of it
+    # are unchanged. Only positions with trades on or after its effective date mix pre- and
+    # post-split shares and need recomputing; ticker changes never do.
+    if {target.action_type, _old_value(target, 'action_type')}.isdisjoint(('split', 'reverse_split')):
+        return
+    since = min(target.date, _old_value(target, 'date'))
+    investment_ids = {target.investment_id, _old_value(target, 'investment_id')}
+    t = Transaction.__table__
+    _pending(target)['positions'].update(tuple(row) for row in connection.execute(
+        select(t.c.user_id, t.c.investment_id).where(t.c.investment_id.in_(investment_ids), t.c.date >= since)
+        .distinct()))
+
+@event.listens_for(Session, 'after_flush')
+def _apply_aggregate_changes(session, flush_context):
+    pending = session.info.pop('aggregate_changes', None)
+    if not pending:
+        return
+    conn = session.connection()
+    account_ids = {account_id for account_id, _ in pending['accounts']}
+    owners = dict(conn.execute(select(CashAccount.__table__.c.id, CashAccount.__table__.c.user_id)
+                               .where(CashAccount.__table__.c.id.in_(account_ids))).all()) if account_ids else {}
+    flows = {}
+    for (account_id, day), (operating, investing) in pending['accounts'].items():
+        if account_id in owners:
+            entry = flows.setdefault((owners[account_id], day), [0, 0, 0])
+            entry[0] += operating
+            entry[1] += investing
+    for (user_id, day), amount in pending['users'].items():
+        flows.setdefault((user_id, day), [0, 0, 0])[2] += amount
+    for (user_id, day), (operating, investing, dividends) in flows.items():
+        if operating or investing or dividends:
+            _apply_flow_delta(conn, user_id, day, operating, investing, dividends)
+    for user_id, investment_id in pending['positions']:
+        refresh_realized_gains(conn, user_id, investment_id)
+
+def rebuild_aggregates():
+    """
+    Recompute every aggregate row from CashTransaction, Dividend and Transaction.
+    """
+    conn = db.session.connection()
+    conn.execute(delete(DailyFlow.__table__))
+    conn.execute(delete(DailyRealizedGain.__table__))
+    flows = {}
+    owners = dict(db.session.query(CashAccount.id, CashAccount.user_id).all())
+    cash_rows = db.session.query(CashTransaction.transaction_type, CashTransaction.from_account_id,
+                                 CashTransaction.to_account_id, CashTransaction.date, CashTransaction.amount)
+    for txn_type, from_id, to_id, txn_date, amount in cash_rows.yield_per(5000):
+        if txn_type not in CASH_FLOW_SIGNS:
+            continue
+        account_attr, operating, investing = CASH_FLOW_SIGNS[txn_type]
+        account_id = from_id if account_attr == 'from_account_id' else to_id
+        if account_id in owners:
+            entry = flows.setdefault((owners[account_id], _day(txn_date)), [0, 0, 0])
+            entry[0] += operating * amount
+            entry[1] += investing * amount
+    dividend_rows = db.session.query(Dividend.user_id, Dividend.date, func.sum(Dividend.amount)).group_by(
+        Dividend.user_id, Dividend.date)
+    for user_id, day, amount in dividend_rows:
+        flows.setdefault((user_id, day), [0, 0, 0])[2] += amount
+    if flows:
+        conn.execute(insert(DailyFlow.__table__), [
+            {'user_id': u, 'day': d, 'operating': o, 'investing': i, 'dividends': v}
+            for (u, d), (o, i, v) in flows.items()
+        ])
+    positions = db.session.query(Transaction.user_id, Transaction.investment_id).filter(
+        Transaction.investment_id.isnot(None)).distinct().all()
+    methods = dict(db.session.query(User.id, User.lot_method).all())
+    splits = load_split_factors(conn)
+    for user_id, investment_id in positions:
+        refresh_realized_gains(conn, user_id, investment_id, methods.get(user_id),
+                               splits.get(investment_id, NO_SPLITS))
+
+# SQLite caps a compound SELECT at 500 terms.
+_PERIODS_PER_QUERY = 200
+
+def _range_sums(table, columns, user_id, periods):
+    """
+    SUM of each column over every period's [start, end] days. Each period is its own
+    `day BETWEEN` term of one UNION ALL, so the database reads only that range of the
+    user's rows through its (user_id, day) index.
+    """
+    sums = []
+    for offset in range(0, len(periods), _PERIODS_PER_QUERY):
+        chunk = periods[offset:offset + _PERIODS_PER_QUERY]
+        terms = [select(literal(i).label('period'),
+                        *[func.coalesce(func.sum(table.c[name]), 0.0) for name in columns])
+                 .where(table.c.user_id == user_id, table.c.day.between(start_date, end_date))
+                 for i, (_, start_date, end_date) in enumerate(chunk)]
+        rows = {row[0]: row[1:] for row in db.session.execute(union_all(*terms))}
+        sums.extend(rows[i] for i in range(len(chunk)))
+    return sums
+
+def period_totals(user_id, periods):
+    """
+    Operating, investing, dividend and realized-gain totals for each (label, start, end) period,
+    summed in SQL over the user's compact daily rows.
+    """
+    if not periods:
+        return []
+    flows = _range_sums(DailyFlow.__table__, ('operating', 'investing', 'dividends'), user_id, periods)
+    gains = _range_sums(DailyRealizedGain.__table__, ('amount',), user_id, periods)
+    return [{
+        'operating': float(operating),
+        'investing': float(investing),
+        'dividends': float(dividends),
+        'realized_gain': float(gain),
+    } for (operating, investing, dividends), (gain,) in zip(flows, gains)]
@@ -1,34 +1,189 @@
+import click
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from cache import LRUCache
 from config import Config
 from models import db, User
 from flask_login import LoginManager
-from blueprints import register_blueprints
-
-app = Flask(__name__)
-app.config.from_object(Config)
-
-db.init_app(app)
 
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
+# Every request loads its user; keep a detached copy per worker and attach it to the request's
+# session without a query. Changes through the ORM drop the copy, the TTL bounds other workers.
+_user_cache = LRUCache(maxsize=4096, ttl=Config.USER_CACHE_SECONDS)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        snapshot = User(**{attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs})
+        make_transient_to_detached(snapshot)
+        _user_cache.set(user_id, snapshot)
+    return user
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _forget_cached_user(mapper, connection, target):
+    _user_cache.delete(target.id)
+
+def create_app(config_class=Config):
+    """
+    Build a configured app. Blueprints and the modules behind them are imported here rather
+    than at module import, so CLI tools and workers that never build an app stay cheap to load.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    app.jinja_options = {
+        **app.jinja_options,
+        'bytecode_cache': FileSystemBytecodeCache(app.config.get('JINJA_BYTECODE_CACHE_DIR')),
+        'extensions': ['template_cache.FragmentCacheExtension'],
+    }
+
+    db.init_app(app)
+    login_manager.init_app(app)
+
+    # Flush listeners that keep data versions, daily aggregates, statement snapshots and the cash ledger in step.
+    import data_version, aggregates, statements, cash_ledger  # noqa: F401
+    from blueprints import register_blueprints
+    register_blueprints(app)
+    register_commands(app)
+    return app
+
+def register_commands(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Add the tables, columns and indexes that newer versions need to an existing database."""
+        from schema import upgrade_schema
+        statements = upgrade_schema()
+        for sql in statements:
+            print(sql)
+        print(f"Schema up to date ({len(statements)} changes).")
+
+    @app.cli.command('rebuild-aggregates')
+    def rebuild_aggregates_command():
+        """Recompute the daily statement aggregates from the raw rows."""
+        from aggregates import rebuild_aggregates
+        rebuild_aggregates()
+        db.session.commit()
+        print("Aggregates rebuilt.")
 
-register_blueprints(app)
+    @app.cli.command('rebuild-calendar')
+    def rebuild_calendar_command():
+        """Re-expand every user's bond coupons and declared dividends into the cash-flow calendar."""
+        from cashflow_calendar import rebuild_user_calendar
+        user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+        for user_id in user_ids:
+            rebuild_user_calendar(user_id)
+        db.session.commit()
+        print(f"Cash-flow calendar rebuilt for {len(user_ids)} users.")
 
-def init_db():
+    @app.cli.command('rebuild-positions')
+    def rebuild_positions_command():
+        """Recreate each user's positions and their quote currencies from the trades."""
+        from helpers import rebuild_positions
+        rebuild_positions()
+        db.session.commit()
+        print("Positions rebuilt.")
+
+    @app.cli.command('rebuild-cash-ledger')
+    @click.option('--adopt-balances', is_flag=True,
+                  help='Book an adjustment for any stored balance the transactions do not explain.')
+    def rebuild_cash_ledger_command(adopt_balances):
+        """Replay every cash transaction into the ledger and recompute account balances."""
+        from cash_ledger import rebuild_ledger, adopt_balances as adopt
+        changed = rebuild_ledger()
+        if adopt_balances:
+            adopt(changed)
+        db.session.commit()
+        for account_id, (old, new) in sorted(changed.items()):
+            note = ' (adjustment booked)' if adopt_balances else ''
+            print(f"Account {account_id}: stored balance {old}, ledger balance {new}{note}.")
+        print("Cash ledger rebuilt.")
+
+    @app.cli.command('init-price-table')
+    def init_price_table_command():
+        """Create the shared price table and publish the static FX rates into it."""
+        from helpers import conversion_rates
+        from price_table import open_writer, fx_symbol
+        table = open_writer()
+        table.write_many({fx_symbol(a, b): rate for (a, b), rate in conversion_rates.items()})
+        print(f"Price table ready at {table.path}.")
+
+    @app.cli.command('run-feeds')
+    @click.option('--once', is_flag=True, help="Run the due feeds a single time and exit.")
+    def run_feeds_command(once):
+        """Run the feed scripts on their schedules and publish prices to the shared table."""
+        from pricefeed import run_feeds
+        run_feeds(once=once)
+
+    @app.cli.command('set-admin')
+    @click.argument('username')
+    @click.option('--revoke', is_flag=True, help="Take admin rights away instead of granting them.")
+    def set_admin_command(username, revoke):
+        """Grant a user admin rights, e.g. to record corporate actions."""
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f"No user named {username}.")
+        user.is_admin = not revoke
+        db.session.commit()
+        print(f"{username} is {'no longer' if revoke else 'now'} an admin.")
+
+    @app.cli.command('backfill-prices')
+    @click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+    @click.option('--symbol', help="Symbol for files without a symbol column (default: file name).")
+    @click.option('--create-missing', is_flag=True, help="Create investments for unknown symbols.")
+    def backfill_prices_command(paths, symbol, create_missing):
+        """Load daily OHLC bars from CSV files into the historical price store."""
+        from backfill_prices import backfill_files
+        stats = backfill_files(paths, symbol=symbol, create_missing=create_missing)
+        print(f"Read {stats['read']} rows: inserted {stats['inserted']}, skipped {stats['duplicates']} "
+              f"dates already stored or repeated, rejected {stats['rejected']} malformed rows.")
+        for reject in stats['rejected_rows']:
+            print(f"  {reject}")
+        if stats['unknown_symbols']:
+            print(f"Unknown symbols skipped: {', '.join(sorted(stats['unknown_symbols']))}")
+
+    @app.cli.command('aum-report')
+    @click.option('--output', default='aum_report.json', show_default=True, help="Destination .json or .csv file.")
+    @click.option('--workers', type=int, default=None, help="Worker processes (default: CPU count).")
+    @click.option('--chunk-size', type=int, default=2000, show_default=True, help="Users per worker task.")
+    @click.option('--currency', default='USD', show_default=True, help="Reporting currency.")
+    def aum_report_command(output, workers, chunk_size, currency):
+        """Firm-wide AUM, exposure and cash by currency across all users."""
+        from aum_report import build_report, write_report
+        report = build_report(db.engine.url.render_as_string(hide_password=False), workers=workers,
+                              chunk_size=chunk_size, currency=currency)
+        write_report(report, output)
+        print(f"AUM {report['aum']:,.2f} {currency} across {report['users']} users written to {output}.")
+
+    @app.cli.command('archive-activity')
+    @click.option('--hot-days', type=int, default=None, help="Days kept in the live table (default: Config.ACTIVITY_HOT_DAYS).")
+    def archive_activity_command(hot_days):
+        """Move activity log rows older than the hot window into compressed monthly archives."""
+        from activity_archive import archive_activity
+        moved = archive_activity(hot_days=hot_days)
+        print(f"Archived {moved} activity log rows.")
+
+def init_db(app):
     with app.app_context():
         db.create_all()
-        from models import CashAccount
+        from models import CashAccount, CashTransaction
         # For testing purposes only. In production, each user creates their own account.
         if not CashAccount.query.first():
-            default_account = CashAccount(account_name='Main Account', currency='USD', balance=10000, user_id=1)
+            default_account = CashAccount(account_name='Main Account', currency='USD', user_id=1)
             db.session.add(default_account)
             db.session.commit()
+            db.session.add(CashTransaction(transaction_type='deposit', to_account_id=default_account.id, amount=10000))
+            db.session.commit()
 
 if __name__ == '__main__':
-    init_db()
+    app = create_app()
+    init_db(app)
     app.run(debug=True, port=8080)
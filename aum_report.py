@@ -0,0 +1,195 @@
+import csv
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, func
+from config import Config
+from models import db, User, Investment, Transaction, CashAccount, Bond, Position
+from lots import LotBook
+from corporate_actions import load_split_factors
+
+DEFAULT_CHUNK_SIZE = 2000
+
+def user_id_ranges(chunk_size):
+    """
+    Contiguous (first_id, last_id) ranges of about chunk_size users, read by keyset so that
+    only one page of ids is in memory at a time.
+    """
+    last_id = 0
+    while True:
+        ids = db.session.execute(select(User.id).where(User.id > last_id).order_by(User.id)
+                                 .limit(chunk_size)).scalars().all()
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+def empty_partial():
+    return {'users': 0, 'users_with_assets': 0, 'investments': {}, 'cash': {}, 'bonds_usd': 0.0, 'bond_count': 0}
+
+def _holdings(lo, hi):
+    """
+    Remaining shares per (user, investment) under each user's lot method and restated across
+    splits, as in compute_user_investment, streamed in (user, investment, date) order so only one position
+    is folded at a time.
+    """
+    t = Transaction.__table__
+    u = User.__table__
+    splits = load_split_factors(db.session)
+    rows = db.session.execute(select(t.c.user_id, t.c.investment_id, u.c.lot_method, t.c.transaction_type,
+                                     t.c.quantity, t.c.transaction_price, t.c.id, t.c.lot_id, t.c.date)
+                              .join(u, u.c.id == t.c.user_id)
+                              .where(t.c.user_id.between(lo, hi), t.c.investment_id.isnot(None))
+                              .order_by(t.c.user_id, t.c.investment_id, t.c.date, t.c.id)
+                              .execution_options(yield_per=5000))
+    key, book = None, None
+    for user_id, investment_id, lot_method, *trade in rows:
+        if (user_id, investment_id) != key:
+            if key is not None:
+                yield key, book.shares
+            key, book = (user_id, investment_id), LotBook(lot_method, splits.get(investment_id))
+        book.apply(*trade)
+    if key is not None:
+        yield key, book.shares
+
+def report_range(lo, hi, prices):
+    """
+    Partial aggregates for users lo..hi, using a handful of bulk queries and no ORM objects.
+    prices maps investment id -> price, resolved once so every worker values at the same prices;
+    investments created after it was built are priced here on first sight.
+    """
+    from helpers import convert_currency, get_price
+    from bond_analytics import analyze_bonds
+    partial = empty_partial()
+    partial['users'] = db.session.execute(select(func.count(User.id)).where(User.id.between(lo, hi))).scalar()
+    p = Position.__table__
+    quote = {(u, i): c for u, i, c in db.session.execute(
+        select(p.c.user_id, p.c.investment_id, p.c.quote_currency).where(p.c.user_id.between(lo, hi)))}
+    with_assets = set()
+    for (user_id, investment_id), shares in _holdings(lo, hi):
+        if shares <= 0:
+            continue
+        if investment_id not in prices:
+            symbol = db.session.execute(select(Investment.symbol).where(Investment.id == investment_id)).scalar()
+            prices[investment_id] = get_price(symbol)
+        currency = quote.get((user_id, investment_id), 'USD')
+        value = convert_currency(shares * prices[investment_id], currency, 'USD')
+        entry = partial['investments'].setdefault(investment_id, [0.0, 0.0, 0])
+        entry[0] += shares
+        entry[1] += value
+        entry[2] += 1
+        with_assets.add(user_id)
+    c = CashAccount.__table__
+    for user_id, currency, balance in db.session.execute(
+            select(c.c.user_id, c.c.currency, func.sum(c.c.balance)).where(c.c.user_id.between(lo, hi))
+            .group_by(c.c.user_id, c.c.currency)):
+        partial['cash'][currency] = partial['cash'].get(currency, 0.0) + balance
+        if balance:
+            with_assets.add(user_id)
+    b = Bond.__table__
+    bonds = db.session.execute(select(b.c.id, b.c.user_id, b.c.face_value, b.c.coupon_rate, b.c.coupon_frequency,
+                                      b.c.maturity_date, b.c.quantity, b.c.market_price, b.c.cost_basis)
+                               .where(b.c.user_id.between(lo, hi))).all()
+    for analytics in analyze_bonds(bonds).values():
+        partial['bonds_usd'] += analytics['market_value']
+    partial['bond_count'] += len(bonds)
+    with_assets.update(bond.user_id for bond in bonds)
+    partial['users_with_assets'] = len(with_assets)
+    return partial
+
+def merge_partials(total, partial):
+    for name in ('users', 'users_with_assets', 'bonds_usd', 'bond_count'):
+        total[name] += partial[name]
+    for investment_id, (shares, value, holders) in partial['investments'].items():
+        entry = total['investments'].setdefault(investment_id, [0.0, 0.0, 0])
+        entry[0] += shares
+        entry[1] += value
+        entry[2] += holders
+    for currency, amount in partial['cash'].items():
+        total['cash'][currency] = total['cash'].get(currency, 0.0) + amount
+    return total
+
+_worker_app = None
+_worker_prices = None
+
+def _init_worker(database_uri, prices):
+    global _worker_app, _worker_prices
+    from app import create_app
+    config = type('ReportConfig', (Config,), {'SQLALCHEMY_DATABASE_URI': database_uri})
+    _worker_app = create_app(config)
+    _worker_prices = prices
+
+def _worker_report(id_range):
+    with _worker_app.app_context():
+        return report_range(id_range[0], id_range[1], _worker_prices)
+
+def build_report(database_uri, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, currency='USD'):
+    """
+    Firm-wide AUM, exposure by investment and asset class, and cash by currency. User id ranges
+    are fanned out to a process pool whose workers each open their own app and connection;
+    only the small partial aggregates travel back to be merged here. Needs an app context.
+    """
+    from helpers import convert_currency, get_price
+    total = empty_partial()
+    investments = {inv.id: inv for inv in db.session.execute(
+        select(Investment.id, Investment.symbol, Investment.asset_class)).all()}
+    prices = {inv.id: get_price(inv.symbol) for inv in investments.values()}
+    ranges = list(user_id_ranges(chunk_size))
+    if ranges:
+        # spawn gives each worker a clean interpreter instead of a forked copy of our DB connections
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(database_uri, prices)) as pool:
+            for partial in pool.map(_worker_report, ranges):
+                merge_partials(total, partial)
+    # The database is live: trades entered mid-report may hold investments created since the lookup above.
+    missing = set(total['investments']) - set(investments)
+    if missing:
+        investments.update((inv.id, inv) for inv in db.session.execute(
+            select(Investment.id, Investment.symbol, Investment.asset_class).where(Investment.id.in_(missing))))
+    rate = convert_currency(1, 'USD', currency)
+    exposure = []
+    by_class = {}
+    for investment_id, (shares, value, holders) in total['investments'].items():
+        inv = investments[investment_id]
+        exposure.append({'symbol': inv.symbol, 'asset_class': inv.asset_class, 'shares': round(shares, 6),
+                         'value': round(value * rate, 2), 'holders': holders})
+        entry = by_class.setdefault(inv.asset_class, {'asset_class': inv.asset_class, 'value': 0.0, 'holders': 0})
+        entry['value'] += value * rate
+        entry['holders'] += holders
+    cash_value = sum(convert_currency(amount, cur, currency) for cur, amount in total['cash'].items())
+    investments_value = sum(e['value'] for e in exposure)
+    bonds_value = total['bonds_usd'] * rate
+    return {
+        'currency': currency,
+        'users': total['users'],
+        'users_with_assets': total['users_with_assets'],
+        'aum': round(investments_value + cash_value + bonds_value, 2),
+        'investments_value': round(investments_value, 2),
+        'cash_value': round(cash_value, 2),
+        'bonds_value': round(bonds_value, 2),
+        'bond_count': total['bond_count'],
+        'by_investment': sorted(exposure, key=lambda e: -e['value']),
+        'by_asset_class': sorted(({**e, 'value': round(e['value'], 2)} for e in by_class.values()),
+                                 key=lambda e: -e['value']),
+        'cash_by_currency': {cur: round(amount, 2) for cur, amount in sorted(total['cash'].items())},
+    }
+
+def write_report(report, path):
+    if path.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        return
+    currency = report['currency']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['section', 'name', 'asset_class', 'shares', 'value', 'currency', 'holders'])
+        for name in ('aum', 'investments_value', 'cash_value', 'bonds_value'):
+            writer.writerow(['total', name, '', '', report[name], currency, ''])
+        writer.writerow(['total', 'users', '', '', report['users'], '', ''])
+        writer.writerow(['total', 'users_with_assets', '', '', report['users_with_assets'], '', ''])
+        for e in report['by_asset_class']:
+            writer.writerow(['asset_class', e['asset_class'], e['asset_class'], '', e['value'], currency, e['holders']])
+        for e in report['by_investment']:
+            writer.writerow(['investment', e['symbol'], e['asset_class'], e['shares'], e['value'], currency, e['holders']])
+        for cur, amount in report['cash_by_currency'].items():
+            writer.writerow(['cash', cur, '', '', amount, cur, ''])
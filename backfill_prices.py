@@ -0,0 +1,157 @@
+import csv
+import os
+from datetime import date, datetime
+from sqlalchemy import update
+from models import db, Investment, PeriodSnapshot
+
+# Rows held for one symbol before it is flushed, and across all symbols before the largest is flushed.
+SYMBOL_BUFFER_ROWS = 50000
+TOTAL_BUFFER_ROWS = 500000
+INSERT_BATCH_ROWS = 10000
+MAX_REPORTED_REJECTS = 10
+INSERT_SQL = ("INSERT OR IGNORE INTO historical_price (investment_id, date, open, high, low, close, volume) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+COLUMN_ALIASES = {
+    'date': 'date', 'timestamp': 'date', 'time': 'date',
+    'symbol': 'symbol', 'ticker': 'symbol',
+    'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'adj close': 'adj_close',
+    'volume': 'volume',
+}
+
+def parse_date(value):
+    value = value.strip()
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return datetime.strptime(value, '%m/%d/%Y').date()
+
+def _number(value):
+    return float(value) if value and not value.isspace() else None
+
+def read_bars(path, default_symbol=None, on_reject=None):
+    """
+    Stream (symbol, date, open, high, low, close, volume) rows from an OHLC CSV file.
+    Files without a symbol column take the symbol from default_symbol or the file name.
+    A row with a malformed date or number is passed to on_reject(path, line, error) and
+    skipped; without on_reject it raises.
+    """
+    symbol = default_symbol or os.path.splitext(os.path.basename(path))[0].upper()
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = [COLUMN_ALIASES.get(h.strip().lower(), h.strip().lower()) for h in next(reader)]
+        index = {name: i for i, name in enumerate(header)}
+        if 'date' not in index or ('close' not in index and 'adj_close' not in index):
+            raise ValueError(f"{path}: expected at least date and close columns, got {header}")
+        close_col = index.get('close', index.get('adj_close'))
+        for row in reader:
+            try:
+                if not row or not row[index['date']].strip():
+                    continue
+                close = _number(row[close_col])
+                if close is None:
+                    continue
+                bar = (
+                    row[index['symbol']].strip().upper() if 'symbol' in index else symbol,
+                    parse_date(row[index['date']]),
+                    _number(row[index['open']]) if 'open' in index else None,
+                    _number(row[index['high']]) if 'high' in index else None,
+                    _number(row[index['low']]) if 'low' in index else None,
+                    close,
+                    _number(row[index['volume']]) if 'volume' in index else None,
+                )
+            except (ValueError, IndexError) as e:
+                if on_reject is None:
+                    raise
+                on_reject(path, reader.line_num, e)
+                continue
+            yield bar
+
+class Backfill:
+    """
+    Buffers bars per symbol and appends them to HistoricalPrice in large INSERT OR IGNORE batches.
+    Memory is bounded by the buffer limits whatever the input size. Dates already stored for a
+    symbol are left as they are and counted as duplicates, so a rerun only fills the gaps.
+    """
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        # Symbols are not unique; bars for a shared ticker go to its first investment.
+        self.investments = dict(db.session.query(Investment.symbol, Investment.id).order_by(Investment.id.desc()).all())
+        self.buffers = {}
+        self.buffered = 0
+        self.stats = {'read': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'rejected_rows': [],
+                      'unknown_symbols': set()}
+        self.earliest = None
+
+    def investment_id(self, symbol):
+        inv_id = self.investments.get(symbol)
+        if inv_id is None and self.create_missing:
+            investment = Investment(symbol=symbol, description=symbol, asset_class='Other')
+            db.session.add(investment)
+            db.session.flush()
+            inv_id = self.investments[symbol] = investment.id
+        return inv_id
+
+    def reject(self, path, line, error):
+        self.stats['read'] += 1
+        self.stats['rejected'] += 1
+        if len(self.stats['rejected_rows']) < MAX_REPORTED_REJECTS:
+            self.stats['rejected_rows'].append(f"{path}:{line}: {error}")
+
+    def add(self, bar):
+        self.stats['read'] += 1
+        inv_id = self.investment_id(bar[0])
+        if inv_id is None:
+            self.stats['unknown_symbols'].add(bar[0])
+            return
+        buffer = self.buffers.setdefault(inv_id, [])
+        buffer.append(bar[1:])
+        self.buffered += 1
+        if len(buffer) >= SYMBOL_BUFFER_ROWS:
+            self.flush(inv_id)
+            db.session.commit()
+        elif self.buffered >= TOTAL_BUFFER_ROWS:
+            self.flush(max(self.buffers, key=lambda k: len(self.buffers[k])))
+            db.session.commit()
+
+    def flush(self, inv_id):
+        bars = self.buffers.pop(inv_id, [])
+        self.buffered -= len(bars)
+        # Stable sort keeps file order within a date, so the last row for a date wins.
+        bars.sort(key=lambda bar: bar[0])
+        rows = []
+        for bar in bars:
+            if rows and rows[-1][1] == bar[0]:
+                self.stats['duplicates'] += 1
+                rows.pop()
+            rows.append((inv_id,) + bar)
+        if not rows:
+            return
+        # Plain DB-API executemany: per-row SQLAlchemy parameter processing would dominate the load time.
+        # Dates are bound as ISO strings, the same storage format the Date column type uses on SQLite.
+        conn = db.session.connection()
+        for start in range(0, len(rows), INSERT_BATCH_ROWS):
+            batch = [(r[0], r[1].isoformat()) + r[2:] for r in rows[start:start + INSERT_BATCH_ROWS]]
+            inserted = max(conn.exec_driver_sql(INSERT_SQL, batch).rowcount, 0)
+            self.stats['inserted'] += inserted
+            # Dates already stored for the symbol hit the primary key and are ignored.
+            self.stats['duplicates'] += len(batch) - inserted
+            if inserted and (self.earliest is None or rows[start][1] < self.earliest):
+                self.earliest = rows[start][1]
+
+    def finish(self):
+        for inv_id in list(self.buffers):
+            self.flush(inv_id)
+        if self.earliest is not None:
+            # Closed statement periods valued on prices that just changed must be recomputed.
+            table = PeriodSnapshot.__table__
+            db.session.connection().execute(update(table).where(table.c.end_date >= self.earliest).values(stale=True))
+        db.session.commit()
+        return self.stats
+
+def backfill_files(paths, symbol=None, create_missing=False):
+    backfill = Backfill(create_missing=create_missing)
+    for path in paths:
+        for bar in read_bars(path, default_symbol=symbol, on_reject=backfill.reject):
+            backfill.add(bar)
+    return backfill.finish()
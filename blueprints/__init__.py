@@ -1,11 +1,12 @@
-from .auth import auth_bp
-from .investments import investments_bp
-from .cash import cash_bp
-from .bonds import bonds_bp
-from .dividends import dividends_bp
-from .financials import financials_bp
-
 def register_blueprints(app):
+    # Imported on registration so that importing the package does not pull in every view module.
+    from .auth import auth_bp
+    from .investments import investments_bp
+    from .cash import cash_bp
+    from .bonds import bonds_bp
+    from .dividends import dividends_bp
+    from .financials import financials_bp
+
     app.register_blueprint(auth_bp)
     app.register_blueprint(investments_bp)
     app.register_blueprint(cash_bp)
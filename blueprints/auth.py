@@ -1,5 +1,6 @@
+from datetime import datetime, timedelta
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_user, logout_user, current_user
+from flask_login import login_user, logout_user, current_user, login_required
 from models import db, User
 from helpers import log_activity
 
@@ -42,3 +43,37 @@ def logout():
     logout_user()
     flash('Logged out successfully.', 'success')
     return redirect(url_for('auth.login'))
+
+@auth_bp.route('/activity')
+@login_required
+def activity():
+    from activity_archive import query_activity
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+    except ValueError:
+        flash('Dates must be YYYY-MM-DD', 'danger')
+        start = end = None
+    # Archives are only opened for an explicit date range or when older entries are asked for.
+    older = bool(start or end or request.args.get('older'))
+    entries = query_activity(user_id=current_user.id, start=start, end=end, limit=500, include_archive=older)
+    return render_template('activity.html', entries=entries, older=older,
+                           start=request.args.get('start', ''), end=request.args.get('end', ''))
+
+@auth_bp.route('/settings', methods=['GET', 'POST'])
+@login_required
+def settings():
+    from lots import METHODS, METHOD_LABELS
+    if request.method == 'POST':
+        lot_method = request.form.get('lot_method')
+        if lot_method not in METHODS:
+            flash('Unknown lot method', 'danger')
+            return redirect(url_for('auth.settings'))
+        if lot_method != current_user.lot_method:
+            # Realized gains for every position are recomputed in the same flush.
+            current_user.lot_method = lot_method
+            db.session.commit()
+            log_activity("Settings Updated", f"Lot method set to {lot_method}.")
+        flash('Settings saved.', 'success')
+        return redirect(url_for('auth.settings'))
+    return render_template('settings.html', lot_methods=METHOD_LABELS, lot_method=current_user.lot_method)
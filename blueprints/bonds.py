@@ -3,6 +3,13 @@ from flask_login import login_required, current_user
 from models import db, Bond
 from datetime import datetime
 from helpers import log_activity
+from bond_analytics import analyze_bonds
+from cashflow_calendar import refresh_bond_cash_flows, remove_bond_cash_flows
+
+COUPON_FREQUENCIES = [1, 2, 4, 12]
+
+def parse_market_price(value):
+    return float(value) if value else None
 
 bonds_bp = Blueprint('bonds', __name__)
 
@@ -10,7 +17,8 @@ bonds_bp = Blueprint('bonds', __name__)
 @login_required
 def bonds():
     bonds = Bond.query.filter_by(user_id=current_user.id).order_by(Bond.maturity_date).all()
-    return render_template('bonds.html', bonds=bonds)
+    analytics = analyze_bonds(bonds)
+    return render_template('bonds.html', bonds=bonds, analytics=analytics)
 
 @bonds_bp.route('/bond/add', methods=['GET', 'POST'])
 @login_required
@@ -22,10 +30,15 @@ def add_bond():
             coupon_rate = float(request.form.get('coupon_rate'))
             quantity = float(request.form.get('quantity'))
             transaction_price = float(request.form.get('transaction_price'))
+            coupon_frequency = int(request.form.get('coupon_frequency', 2))
+            market_price = parse_market_price(request.form.get('market_price'))
         except ValueError:
             flash("Invalid numeric value for bond parameters", "danger")
             return redirect(url_for('bonds.add_bond'))
-        if face_value < 0 or coupon_rate < 0 or quantity < 0 or transaction_price < 0:
+        if coupon_frequency not in COUPON_FREQUENCIES:
+            flash("Invalid coupon frequency", "danger")
+            return redirect(url_for('bonds.add_bond'))
+        if face_value < 0 or coupon_rate < 0 or quantity < 0 or transaction_price < 0 or (market_price or 0) < 0:
             flash("Bond parameters must be non-negative", "danger")
             return redirect(url_for('bonds.add_bond'))
         try:
@@ -42,14 +55,18 @@ def add_bond():
             purchase_date=purchase_date,
             quantity=quantity,
             cost_basis=transaction_price,
+            coupon_frequency=coupon_frequency,
+            market_price=market_price,
             user_id=current_user.id
         )
         db.session.add(bond)
+        db.session.flush()
+        refresh_bond_cash_flows(bond)
         db.session.commit()
         log_activity("Bond Added", f"Bond {name} added.")
         flash('Bond added successfully!', 'success')
         return redirect(url_for('bonds.bonds'))
-    return render_template('add_bond.html')
+    return render_template('add_bond.html', coupon_frequencies=COUPON_FREQUENCIES)
 
 @bonds_bp.route('/bond/edit/<int:bond_id>', methods=['GET', 'POST'])
 @login_required
@@ -62,10 +79,15 @@ def edit_bond(bond_id):
             bond.coupon_rate = float(request.form.get('coupon_rate'))
             bond.quantity = float(request.form.get('quantity'))
             bond.cost_basis = float(request.form.get('transaction_price'))
+            bond.coupon_frequency = int(request.form.get('coupon_frequency', bond.coupon_frequency))
+            bond.market_price = parse_market_price(request.form.get('market_price'))
         except ValueError:
             flash("Invalid numeric value for bond parameters", "danger")
             return redirect(url_for('bonds.edit_bond', bond_id=bond_id))
-        if bond.face_value < 0 or bond.coupon_rate < 0 or bond.quantity < 0 or bond.cost_basis < 0:
+        if bond.coupon_frequency not in COUPON_FREQUENCIES:
+            flash("Invalid coupon frequency", "danger")
+            return redirect(url_for('bonds.edit_bond', bond_id=bond_id))
+        if bond.face_value < 0 or bond.coupon_rate < 0 or bond.quantity < 0 or bond.cost_basis < 0 or (bond.market_price or 0) < 0:
             flash("Bond parameters must be non-negative", "danger")
             return redirect(url_for('bonds.edit_bond', bond_id=bond_id))
         try:
@@ -74,16 +96,18 @@ def edit_bond(bond_id):
         except ValueError:
             flash("Invalid date format. Please use YYYY-MM-DD.", "danger")
             return redirect(url_for('bonds.edit_bond', bond_id=bond_id))
+        refresh_bond_cash_flows(bond)
         db.session.commit()
         log_activity("Bond Edited", f"Bond ID {bond_id} edited.")
         flash('Bond updated successfully!', 'success')
         return redirect(url_for('bonds.bonds'))
-    return render_template('edit_bond.html', bond=bond)
+    return render_template('edit_bond.html', bond=bond, coupon_frequencies=COUPON_FREQUENCIES)
 
 @bonds_bp.route('/bond/delete/<int:bond_id>', methods=['POST'])
 @login_required
 def delete_bond(bond_id):
     bond = Bond.query.filter_by(id=bond_id, user_id=current_user.id).first_or_404()
+    remove_bond_cash_flows(bond.id)
     db.session.delete(bond)
     db.session.commit()
     log_activity("Bond Deleted", f"Bond ID {bond_id} deleted.")
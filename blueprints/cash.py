@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import csv
+import io
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, Response, jsonify, abort,
+                   stream_with_context)
 from flask_login import login_required, current_user
 from models import db, CashAccount, CashTransaction
-from datetime import datetime
-from helpers import log_activity
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from helpers import log_activity, commit_with_retry
+from cash_ledger import forbid_overdraft, InsufficientFunds
+from cash_statement import PAGE_SIZE, statement_page, iter_statement, encode_cursor, decode_cursor
 
 cash_bp = Blueprint('cash', __name__)
 
@@ -27,7 +33,7 @@ def add_cash():
         if balance < 0:
             flash("Balance cannot be negative", "danger")
             return redirect(url_for('cash.add_cash'))
-        new_acc = CashAccount(account_name=account_name, currency=currency, balance=balance, user_id=current_user.id)
+        new_acc = CashAccount(account_name=account_name, currency=currency, user_id=current_user.id)
         db.session.add(new_acc)
         db.session.commit()
         ct = CashTransaction(
@@ -48,8 +54,6 @@ def add_cash():
 def edit_cash(cash_id):
     acc = CashAccount.query.filter_by(id=cash_id, user_id=current_user.id).first_or_404()
     if request.method == 'POST':
-        acc.account_name = request.form.get('account_name')
-        acc.currency = request.form.get('currency')
         try:
             new_balance = float(request.form.get('balance'))
         except ValueError:
@@ -58,9 +62,22 @@ def edit_cash(cash_id):
         if new_balance < 0:
             flash("Balance cannot be negative", "danger")
             return redirect(url_for('cash.edit_cash', cash_id=cash_id))
-        acc.balance = new_balance
-        db.session.commit()
-        log_activity("Cash Account Edited", f"Cash account ID {cash_id} edited.")
+        def record():
+            acc.account_name = request.form.get('account_name')
+            acc.currency = request.form.get('currency')
+            # The balance is derived from the ledger, so a correction is booked as an adjustment. It is
+            # measured against the balance read in this transaction, not the one shown on the form, so a
+            # deposit or trade committed meanwhile is kept; a busy retry reads it again.
+            balance = db.session.execute(select(CashAccount.balance).where(CashAccount.id == acc.id)).scalar()
+            if new_balance != balance:
+                db.session.add(CashTransaction(
+                    date=datetime.utcnow(),
+                    transaction_type='adjustment',
+                    to_account_id=acc.id,
+                    amount=new_balance - balance
+                ))
+            log_activity("Cash Account Edited", f"Cash account ID {cash_id} edited.", commit=False)
+        commit_with_retry(record)
         flash('Cash account updated successfully!', 'success')
         return redirect(url_for('cash.cash_list'))
     return render_template('edit_cash.html', cash_account=acc)
@@ -88,16 +105,15 @@ def deposit_cash(cash_id):
         if amount < 0:
             flash("Deposit amount must be non-negative", "danger")
             return redirect(url_for('cash.deposit_cash', cash_id=cash_id))
-        acc.balance += amount
-        ct = CashTransaction(
-            date=datetime.utcnow().date(),
-            transaction_type='deposit',
-            to_account_id=acc.id,
-            amount=amount
-        )
-        db.session.add(ct)
-        db.session.commit()
-        log_activity("Cash Deposit", f"Deposited {amount} into cash account ID {cash_id}.")
+        def record():
+            db.session.add(CashTransaction(
+                date=datetime.utcnow().date(),
+                transaction_type='deposit',
+                to_account_id=cash_id,
+                amount=amount
+            ))
+            log_activity("Cash Deposit", f"Deposited {amount} into cash account ID {cash_id}.", commit=False)
+        commit_with_retry(record)
         flash('Deposit successful!', 'success')
         return redirect(url_for('cash.cash_list'))
     return render_template('deposit_cash.html', cash_account=acc)
@@ -115,19 +131,19 @@ def withdraw_cash(cash_id):
         if amount < 0:
             flash("Withdrawal amount must be non-negative", "danger")
             return redirect(url_for('cash.withdraw_cash', cash_id=cash_id))
-        if acc.balance >= amount:
-            acc.balance -= amount
-            ct = CashTransaction(
+        def record():
+            db.session.add(CashTransaction(
                 date=datetime.utcnow().date(),
                 transaction_type='withdraw',
-                from_account_id=acc.id,
+                from_account_id=cash_id,
                 amount=amount
-            )
-            db.session.add(ct)
-            db.session.commit()
-            log_activity("Cash Withdrawal", f"Withdrew {amount} from cash account ID {cash_id}.")
+            ))
+            forbid_overdraft(db.session, cash_id)
+            log_activity("Cash Withdrawal", f"Withdrew {amount} from cash account ID {cash_id}.", commit=False)
+        try:
+            commit_with_retry(record)
             flash('Withdrawal successful!', 'success')
-        else:
+        except InsufficientFunds:
             flash('Insufficient funds!', 'danger')
         return redirect(url_for('cash.cash_list'))
     return render_template('withdraw_cash.html', cash_account=acc)
@@ -148,24 +164,66 @@ def convert_cash(from_id):
         if amount < 0 or conversion_rate < 0:
             flash("Amount and conversion rate must be non-negative", "danger")
             return redirect(url_for('cash.convert_cash', from_id=from_id))
-        to_acc = CashAccount.query.filter_by(id=to_id, user_id=current_user.id).first_or_404()
-        if from_acc.balance < amount:
+        CashAccount.query.filter_by(id=to_id, user_id=current_user.id).first_or_404()
+        # Both legs are applied in the same flush; the debit only lands if the source still has the funds.
+        def record():
+            db.session.add(CashTransaction(
+                date=datetime.utcnow().date(),
+                transaction_type='conversion',
+                from_account_id=from_id,
+                to_account_id=to_id,
+                amount=amount,
+                conversion_rate=conversion_rate
+            ))
+            forbid_overdraft(db.session, from_id)
+            log_activity("Cash Conversion", f"Converted {amount} from account ID {from_id} to account ID {to_id} at rate {conversion_rate}.", commit=False)
+        try:
+            commit_with_retry(record)
+        except InsufficientFunds:
             flash('Insufficient funds in source account!', 'danger')
             return redirect(url_for('cash.convert_cash', from_id=from_id))
-        from_acc.balance -= amount
-        converted_amount = amount * conversion_rate
-        to_acc.balance += converted_amount
-        ct = CashTransaction(
-            date=datetime.utcnow().date(),
-            transaction_type='conversion',
-            from_account_id=from_acc.id,
-            to_account_id=to_acc.id,
-            amount=amount,
-            conversion_rate=conversion_rate
-        )
-        db.session.add(ct)
-        db.session.commit()
-        log_activity("Cash Conversion", f"Converted {amount} from account ID {from_id} to account ID {to_id} at rate {conversion_rate}.")
         flash('Conversion successful!', 'success')
         return redirect(url_for('cash.cash_list'))
     return render_template('convert_cash.html', from_account=from_acc, accounts=accounts)
+
+STATEMENT_COLUMNS = ['date', 'id', 'transaction_type', 'counterparty_id', 'amount', 'conversion_rate', 'signed', 'balance']
+
+@cash_bp.route('/cash/<int:cash_id>/statement', methods=['GET'])
+@login_required
+def cash_statement(cash_id):
+    acc = CashAccount.query.filter_by(id=cash_id, user_id=current_user.id).first_or_404()
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+        after = decode_cursor(request.args.get('after'))
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), 5000)
+    except ValueError:
+        abort(400)
+    fmt = request.args.get('format', 'html')
+    if fmt == 'csv':
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(STATEMENT_COLUMNS)
+            for row in iter_statement(acc.id, start, end):
+                writer.writerow([getattr(row, name) for name in STATEMENT_COLUMNS])
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        return Response(stream_with_context(generate()), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment;filename=statement-{acc.id}.csv'})
+    opening, rows, cursor = statement_page(acc.id, start, end, after, limit)
+    if fmt == 'json':
+        return jsonify({
+            'account_id': acc.id,
+            'currency': acc.currency,
+            'opening_balance': opening,
+            'rows': [{name: row.date.isoformat() if name == 'date' else getattr(row, name) for name in STATEMENT_COLUMNS}
+                     for row in rows],
+            'next': encode_cursor(cursor),
+        })
+    return render_template('cash_statement.html', account=acc, opening=opening, rows=rows,
+                           next_cursor=encode_cursor(cursor), start=request.args.get('start', ''),
+                           end=request.args.get('end', ''))
@@ -2,7 +2,9 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from models import db, Dividend, Investment
 from datetime import datetime
-from helpers import log_activity
+from helpers import log_activity, get_investments
+from cashflow_calendar import refresh_dividend_cash_flow, remove_dividend_cash_flow
+from dividend_analytics import dividend_summary
 
 dividends_bp = Blueprint('dividends', __name__)
 
@@ -10,13 +12,14 @@ dividends_bp = Blueprint('dividends', __name__)
 @login_required
 def dividends():
     dividends = Dividend.query.filter_by(user_id=current_user.id).order_by(Dividend.date.desc()).all()
-    investments = Investment.query.all()  # global investments
-    return render_template('dividends.html', dividends=dividends, investments=investments)
+    investments = get_investments()  # global investments
+    summary = dividend_summary(current_user.id)
+    return render_template('dividends.html', dividends=dividends, investments=investments, summary=summary)
 
 @dividends_bp.route('/dividend/add', methods=['GET', 'POST'])
 @login_required
 def add_dividend():
-    investments = Investment.query.all()  # global investments
+    investments = get_investments()  # global investments
     if request.method == 'POST':
         try:
             investment_id = int(request.form.get('investment_id'))
@@ -35,6 +38,8 @@ def add_dividend():
         note = request.form.get('note')
         dividend = Dividend(investment_id=investment_id, date=date_div, amount=amount, note=note, user_id=current_user.id)
         db.session.add(dividend)
+        db.session.flush()
+        refresh_dividend_cash_flow(dividend)
         db.session.commit()
         log_activity("Dividend Added", f"Dividend for investment ID {investment_id} added.")
         flash('Dividend recorded successfully!', 'success')
@@ -45,7 +50,7 @@ def add_dividend():
 @login_required
 def edit_dividend(dividend_id):
     dividend = Dividend.query.filter_by(id=dividend_id, user_id=current_user.id).first_or_404()
-    investments = Investment.query.all()  # global investments
+    investments = get_investments()  # global investments
     if request.method == 'POST':
         try:
             dividend.investment_id = int(request.form.get('investment_id'))
@@ -62,6 +67,7 @@ def edit_dividend(dividend_id):
             flash("Invalid date format. Please use YYYY-MM-DD.", "danger")
             return redirect(url_for('dividends.edit_dividend', dividend_id=dividend_id))
         dividend.note = request.form.get('note')
+        refresh_dividend_cash_flow(dividend)
         db.session.commit()
         log_activity("Dividend Edited", f"Dividend ID {dividend_id} edited.")
         flash('Dividend updated successfully!', 'success')
@@ -72,6 +78,7 @@ def edit_dividend(dividend_id):
 @login_required
 def delete_dividend(dividend_id):
     dividend = Dividend.query.filter_by(id=dividend_id, user_id=current_user.id).first_or_404()
+    remove_dividend_cash_flow(dividend.id)
     db.session.delete(dividend)
     db.session.commit()
     log_activity("Dividend Deleted", f"Dividend ID {dividend_id} deleted.")
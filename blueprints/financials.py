@@ -1,81 +1,85 @@
-from flask import Blueprint, render_template, request, flash, session
+from flask import Blueprint, render_template, request, flash, session, jsonify, current_app
 from flask_login import login_required, current_user
-from models import db, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend
-from datetime import datetime, date
+from models import db, Investment, CashAccount, CashTransaction, Bond, Dividend
+from datetime import datetime, date, timedelta
 from helpers import (
     convert_currency, 
     get_price, 
     calculate_cash_balance_as_of, 
     get_periods,
     log_activity, 
-    get_investment_quote_currency, 
+    get_quote_currencies,
+    get_investments,
+    get_reporting_currency,
     compute_user_investment, 
-    compute_realized_gain
+    compute_realized_gain,
+    SUPPORTED_CURRENCIES
 )
+from bond_analytics import add_months
+from cashflow_calendar import monthly_projection
+from statements import get_statement_figures
 
 financials_bp = Blueprint('financials', __name__)
 
+def _chart_series(rows, label_key, points, method, value_keys=('asset_value', 'cost_basis', 'profit_loss')):
+    """Chart arrays for the rows, thinned to about `points` samples chosen on the first value key."""
+    from downsample import downsample_series
+    series = {key: [row[key] for row in rows] for key in (label_key,) + tuple(value_keys)}
+    if not rows:
+        return series
+    x = [row['day'] for row in rows] if 'day' in rows[0] else list(range(len(rows)))
+    _, thinned = downsample_series(x, series, points, value_keys[0], method)
+    return thinned
+
+def _chart_args():
+    """(start, end, points, method) from the request, for drill-down by date range."""
+    def day(name, month_end=False):
+        value = request.args.get(name)
+        for fmt in ('%Y-%m-%d', '%Y-%m'):
+            try:
+                parsed = datetime.strptime(value, fmt).date() if value else None
+            except ValueError:
+                continue
+            # A month on its own reaches to the month's last day when it ends the range.
+            if parsed and fmt == '%Y-%m' and month_end:
+                parsed = add_months(parsed, 1) - timedelta(days=1)
+            return parsed
+        return None
+    try:
+        points = int(request.args.get('points', current_app.config['CHART_MAX_POINTS']))
+    except ValueError:
+        points = current_app.config['CHART_MAX_POINTS']
+    points = max(3, min(points, current_app.config['CHART_MAX_POINTS']))
+    method = request.args.get('method', 'lttb')
+    return day('start'), day('end', month_end=True), points, method if method in ('lttb', 'minmax') else 'lttb'
+
+def _granularity():
+    from timeline import GRANULARITIES
+    granularity = request.args.get('granularity', 'monthly')
+    return granularity if granularity in GRANULARITIES else 'monthly'
+
 @financials_bp.route('/summary')
 @login_required
 def summary():
     selected_currency = request.args.get('currency', 'USD')
-    investments = Investment.query.all()
-    
-    # Determine timeline based on user transactions
-    txns = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.date).all()
-    if txns:
-        first_date = txns[0].date
-        start_date = first_date if isinstance(first_date, date) else first_date.date()
-    else:
-        start_date = datetime.utcnow().date()
-    end_date = datetime.utcnow().date()
-    
-    timeline = []
-    current_date = start_date
-    while current_date <= end_date:
-        timeline.append(current_date)
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year+1, month=1)
-        else:
-            current_date = current_date.replace(month=current_date.month+1)
-    
-    monthly_data = []
-    for month_start in timeline:
-        if month_start.month == 12:
-            next_month = month_start.replace(year=month_start.year+1, month=1)
-        else:
-            next_month = month_start.replace(month=month_start.month+1)
-        total_asset_value = 0
-        total_cost_basis = 0
-        for inv in investments:
-            shares, avg_cost = compute_user_investment(inv, current_user.id)
-            if shares == 0:
-                continue
-            price = get_price(inv.symbol)
-            asset_value = shares * price
-            cost_basis_total = shares * avg_cost
-            inv_currency = get_investment_quote_currency(inv, current_user.id)
-            asset_value_conv = convert_currency(asset_value, inv_currency, selected_currency)
-            cost_conv = convert_currency(cost_basis_total, inv_currency, selected_currency)
-            total_asset_value += asset_value_conv
-            total_cost_basis += cost_conv
-        profit_loss = total_asset_value - total_cost_basis
-        monthly_data.append({
-            'month': month_start.strftime("%Y-%m"),
-            'asset_value': round(total_asset_value, 2),
-            'cost_basis': round(total_cost_basis, 2),
-            'profit_loss': round(profit_loss, 2)
-        })
-    
+    if selected_currency not in SUPPORTED_CURRENCIES:
+        selected_currency = 'USD'
+    from timeline import portfolio_timeline, GRANULARITIES
+    start, end, points, method = _chart_args()
+    granularity = _granularity()
+    timeline = portfolio_timeline(current_user.id, selected_currency, granularity, start, end)
+    chart = _chart_series(timeline, 'period', points, method, ('investments', 'net_worth'))
+
     category_data = {}
-    for inv in investments:
+    quote_currencies = get_quote_currencies(current_user.id)
+    for inv in get_investments():
         shares, avg_cost = compute_user_investment(inv, current_user.id)
         if shares == 0:
             continue
         price = get_price(inv.symbol)
         asset_value = shares * price
         total_cost = shares * avg_cost
-        inv_currency = get_investment_quote_currency(inv, current_user.id)
+        inv_currency = quote_currencies.get(inv.id, 'USD')
         asset_value_conv = convert_currency(asset_value, inv_currency, selected_currency)
         cost_conv = convert_currency(total_cost, inv_currency, selected_currency)
         cat = inv.asset_class
@@ -88,16 +92,42 @@ def summary():
         category_data[cat]['profit_loss'] = round(category_data[cat]['asset_value'] - category_data[cat]['cost_basis'], 2)
         category_data[cat]['asset_value'] = round(category_data[cat]['asset_value'], 2)
         category_data[cat]['cost_basis'] = round(category_data[cat]['cost_basis'], 2)
-    
-    return render_template('summary.html', 
-                           monthly_data=monthly_data, 
+
+    return render_template('summary.html',
+                           timeline=timeline,
+                           chart=chart,
+                           granularity=granularity,
+                           granularities=GRANULARITIES,
                            category_data=category_data,
-                           currency=selected_currency)
+                           currency=selected_currency,
+                           currencies=SUPPORTED_CURRENCIES,
+                           start=request.args.get('start', ''),
+                           end=request.args.get('end', ''))
+
+@financials_bp.route('/timeline')
+@login_required
+def timeline_series():
+    """
+    Portfolio values per period for any granularity and date range, cut from the cached daily
+    series; periods beyond the point budget are thinned for charting.
+    """
+    from timeline import portfolio_timeline, BALANCES, FLOWS
+    currency = request.args.get('currency', 'USD')
+    if currency not in SUPPORTED_CURRENCIES:
+        currency = 'USD'
+    start, end, points, method = _chart_args()
+    granularity = _granularity()
+    timeline = portfolio_timeline(current_user.id, currency, granularity, start, end)
+    value_keys = ('net_worth',) + tuple(name for name in BALANCES + FLOWS if name != 'net_worth')
+    series = _chart_series(timeline, 'period', points, method, value_keys)
+    return jsonify({'currency': currency, 'granularity': granularity, 'total_points': len(timeline),
+                    'returned_points': len(series['period']), **series})
 
 @financials_bp.route('/balance_sheet')
 @login_required
 def balance_sheet():
     period_type = request.args.get('period_type', 'yearly')
+    currency = get_reporting_currency(request, session)
     today = date.today()
     allowed_years = list(range(today.year - 10, today.year + 1))
     periods = get_periods(period_type, request)
@@ -110,21 +140,11 @@ def balance_sheet():
     liabilities_values = []
     equity_values = []
 
-    for label, start_date, end_date in periods:
-        cash = sum(calculate_cash_balance_as_of(acc, end_date) for acc in CashAccount.query.filter_by(user_id=current_user.id).all())
-        inv_val = 0
-        for inv in Investment.query.all():
-            shares, avg = compute_user_investment(inv, current_user.id)
-            price = get_price(inv.symbol)
-            asset_value = shares * price
-            inv_val += convert_currency(asset_value, get_investment_quote_currency(inv, current_user.id), 'USD')
-        bonds_list = Bond.query.filter(Bond.purchase_date <= end_date, Bond.user_id==current_user.id).all()
-        bond_val = sum(bond.quantity * bond.face_value for bond in bonds_list)
-        total = cash + inv_val + bond_val
-        
-        cash_values.append(round(cash, 2))
-        investment_values.append(round(inv_val, 2))
-        bond_values.append(round(bond_val, 2))
+    for figures in get_statement_figures(current_user.id, period_type, periods, currency):
+        total = figures['cash'] + figures['investments'] + figures['bonds']
+        cash_values.append(round(figures['cash'], 2))
+        investment_values.append(round(figures['investments'], 2))
+        bond_values.append(round(figures['bonds'], 2))
         total_assets.append(round(total, 2))
         liabilities_values.append(0)
         equity_values.append(round(total, 2))
@@ -133,7 +153,8 @@ def balance_sheet():
                            period_labels=period_labels, cash_values=cash_values,
                            investment_values=investment_values, bond_values=bond_values,
                            total_assets=total_assets, liabilities_values=liabilities_values,
-                           equity_values=equity_values, allowed_years=allowed_years, today=today)
+                           equity_values=equity_values, allowed_years=allowed_years, today=today,
+                           currency=currency, currencies=SUPPORTED_CURRENCIES)
 
 @financials_bp.route('/income_statement')
 @login_required
@@ -150,20 +171,13 @@ def income_statement():
     total_expenses_list = []
     net_income_list = []
 
-    for label, start_date, end_date in periods:
-        dividends = Dividend.query.filter(Dividend.date >= start_date, Dividend.date <= end_date, Dividend.user_id==current_user.id).all()
-        total_dividends = sum(d.amount for d in dividends)
-        
-        realized_gain = 0
-        for inv in Investment.query.all():
-            realized_gain += compute_realized_gain(inv, current_user.id, start_date, end_date)
-        
-        total_revenue = total_dividends + realized_gain
+    for figures in get_statement_figures(current_user.id, period_type, periods):
+        total_revenue = figures['dividends'] + figures['realized_gain']
         total_expenses = 0
         net_income = total_revenue - total_expenses
 
-        total_dividends_list.append(round(total_dividends, 2))
-        realized_gain_list.append(round(realized_gain, 2))
+        total_dividends_list.append(round(figures['dividends'], 2))
+        realized_gain_list.append(round(figures['realized_gain'], 2))
         total_revenue_list.append(round(total_revenue, 2))
         total_expenses_list.append(round(total_expenses, 2))
         net_income_list.append(round(net_income, 2))
@@ -187,24 +201,10 @@ def cash_flow_statement():
     investing_list = []
     net_cash_flow_list = []
 
-    for label, start_date, end_date in periods:
-        txns = CashTransaction.query.filter(CashTransaction.date >= start_date, CashTransaction.date <= end_date).all()
-        operating = 0
-        investing = 0
-        for txn in txns:
-            if txn.transaction_type in ['deposit', 'withdraw']:
-                if txn.transaction_type == 'deposit':
-                    operating += txn.amount
-                else:
-                    operating -= txn.amount
-            elif txn.transaction_type in ['investment_buy', 'investment_sell']:
-                if txn.transaction_type == 'investment_buy':
-                    investing -= txn.amount
-                else:
-                    investing += txn.amount
-        net_cash_flow = operating + investing
-        operating_list.append(round(operating, 2))
-        investing_list.append(round(investing, 2))
+    for figures in get_statement_figures(current_user.id, period_type, periods):
+        net_cash_flow = figures['operating'] + figures['investing']
+        operating_list.append(round(figures['operating'], 2))
+        investing_list.append(round(figures['investing'], 2))
         net_cash_flow_list.append(round(net_cash_flow, 2))
 
     return render_template('cash_flow_statement.html', period_type=period_type,
@@ -212,6 +212,20 @@ def cash_flow_statement():
                            investing_list=investing_list, net_cash_flow_list=net_cash_flow_list,
                            allowed_years=allowed_years, today=today)
 
+@financials_bp.route('/cash_flow/calendar')
+@login_required
+def cash_flow_calendar():
+    try:
+        years = int(request.args.get('years', 5))
+    except ValueError:
+        years = 5
+    years = min(max(years, 1), 30)
+    start_date = date.today().replace(day=1)
+    end_date = add_months(start_date, years * 12)
+    months = monthly_projection(current_user.id, start_date, end_date)
+    totals = {key: round(sum(m[key] for m in months), 2) for key in ('coupon', 'principal', 'dividend', 'total')}
+    return render_template('cash_flow_calendar.html', months=months, totals=totals, years=years)
+
 @financials_bp.route('/financial_overview')
 @login_required
 def financial_overview():
@@ -219,6 +233,7 @@ def financial_overview():
     today = date.today()
     allowed_years = list(range(today.year - 10, today.year + 1))
     overview_data = []
+    quote_currencies = get_quote_currencies(current_user.id)
     if period_type == 'yearly':
         current_year = today.year
         try:
@@ -236,32 +251,12 @@ def financial_overview():
         for year in range(start_year, end_year + 1):
             comp_total_asset = 0
             comp_total_cost = 0
-            for inv in Investment.query.all():
-                txns = Transaction.query.filter(
-                    Transaction.investment_id == inv.id,
-                    Transaction.user_id == current_user.id,
-                    Transaction.date <= datetime(year, 12, 31)
-                ).order_by(Transaction.date).all()
-                shares = 0
-                avg = 0
-                for t in txns:
-                    if t.transaction_type.lower() == 'buy':
-                        if shares == 0:
-                            shares = t.quantity
-                            avg = t.transaction_price
-                        else:
-                            new_total = shares + t.quantity
-                            new_total_cost = avg * shares + t.transaction_price * t.quantity
-                            avg = new_total_cost / new_total
-                            shares = new_total
-                    elif t.transaction_type.lower() == 'sell':
-                        shares -= t.quantity
-                        if shares <= 0:
-                            shares = 0
-                            avg = 0
+            for inv in get_investments():
+                shares, avg = compute_user_investment(inv, current_user.id, as_of=date(year, 12, 31))
                 price = get_price(inv.symbol)
-                comp_total_asset += convert_currency(shares * price, get_investment_quote_currency(inv, current_user.id), 'USD')
-                comp_total_cost += convert_currency(shares * avg, get_investment_quote_currency(inv, current_user.id), 'USD')
+                inv_currency = quote_currencies.get(inv.id, 'USD')
+                comp_total_asset += convert_currency(shares * price, inv_currency, 'USD')
+                comp_total_cost += convert_currency(shares * avg, inv_currency, 'USD')
             profit_loss = comp_total_asset - comp_total_cost
             overview_data.append({
                 'period': str(year),
@@ -285,32 +280,12 @@ def financial_overview():
                 comp_end = date(selected_year, 12, 31)
             comp_total_asset = 0
             comp_total_cost = 0
-            for inv in Investment.query.all():
-                txns = Transaction.query.filter(
-                    Transaction.investment_id == inv.id,
-                    Transaction.user_id == current_user.id,
-                    Transaction.date <= datetime(selected_year, comp_end.month, comp_end.day)
-                ).order_by(Transaction.date).all()
-                shares = 0
-                avg = 0
-                for t in txns:
-                    if t.transaction_type.lower() == 'buy':
-                        if shares == 0:
-                            shares = t.quantity
-                            avg = t.transaction_price
-                        else:
-                            new_total = shares + t.quantity
-                            new_total_cost = avg * shares + t.transaction_price * t.quantity
-                            avg = new_total_cost / new_total
-                            shares = new_total
-                    elif t.transaction_type.lower() == 'sell':
-                        shares -= t.quantity
-                        if shares <= 0:
-                            shares = 0
-                            avg = 0
+            for inv in get_investments():
+                shares, avg = compute_user_investment(inv, current_user.id, as_of=comp_end)
                 price = get_price(inv.symbol)
-                comp_total_asset += convert_currency(shares * price, get_investment_quote_currency(inv, current_user.id), 'USD')
-                comp_total_cost += convert_currency(shares * avg, get_investment_quote_currency(inv, current_user.id), 'USD')
+                inv_currency = quote_currencies.get(inv.id, 'USD')
+                comp_total_asset += convert_currency(shares * price, inv_currency, 'USD')
+                comp_total_cost += convert_currency(shares * avg, inv_currency, 'USD')
             profit_loss = comp_total_asset - comp_total_cost
             overview_data.append({
                 'period': f"{selected_year}-{q}",
@@ -319,10 +294,12 @@ def financial_overview():
                 'profit_loss': round(profit_loss, 2)
             })
 
-    labels = [d['period'] for d in overview_data]
-    asset_values = [d['asset_value'] for d in overview_data]
-    cost_basis_list = [d['cost_basis'] for d in overview_data]
-    profit_losses = [d['profit_loss'] for d in overview_data]
+    _, _, points, method = _chart_args()
+    chart = _chart_series(overview_data, 'period', points, method)
+    labels = chart['period']
+    asset_values = chart['asset_value']
+    cost_basis_list = chart['cost_basis']
+    profit_losses = chart['profit_loss']
     
     return render_template('financial_overview.html',
                            period_type=period_type,
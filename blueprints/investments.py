@@ -1,39 +1,84 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, Response, session, current_app, jsonify,
+                   abort)
 from flask_login import login_required, current_user
-from models import db, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend
-from helpers import get_price, compute_user_investment, log_activity, convert_currency, get_investment_quote_currency
+from models import db, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend, CorporateAction
+from helpers import (
+    get_price,
+    compute_user_investment,
+    log_activity,
+    convert_currency,
+    convert_amounts,
+    get_quote_currencies,
+    get_investments,
+    get_cash_accounts,
+    get_reporting_currency,
+    ensure_position,
+    get_lot_method,
+    commit_with_retry,
+    SUPPORTED_CURRENCIES
+)
+from bond_analytics import analyze_bonds
+from cash_ledger import forbid_overdraft, InsufficientFunds
+from pricefeed import discover_feeds
 from datetime import datetime
 from sqlalchemy import or_
 
 investments_bp = Blueprint('investments', __name__)
 
+def _lot_id(value, investment_id):
+    """
+    The buy a sell names for specific-lot identification, or None. Raises ValueError unless it
+    is one of the user's buys of the same investment.
+    """
+    if not value:
+        return None
+    lot = Transaction.query.filter_by(id=int(value), user_id=current_user.id, investment_id=investment_id).first()
+    if lot is None or lot.transaction_type.lower() != 'buy':
+        raise ValueError(value)
+    return lot.id
+
 @investments_bp.route('/')
 @login_required
 def dashboard():
+    currency = get_reporting_currency(request, session)
     # Get all global investments
-    investments = Investment.query.all()
-    # For each investment, compute user's holdings
+    investments = get_investments()
+    quote_currencies = get_quote_currencies(current_user.id)
+    # For each investment, compute user's holdings in its quote currency
     for inv in investments:
         shares, avg_cost = compute_user_investment(inv, current_user.id)
+        inv.currency = quote_currencies.get(inv.id, 'USD')
         inv.user_shares = shares
         inv.user_avg_cost = avg_cost
         inv.current_price = get_price(inv.symbol)
         inv.user_total_value = shares * inv.current_price
         inv.user_profit_loss = (inv.current_price - avg_cost) * shares
-    total_investment = sum(inv.user_total_value for inv in investments)
-    cash_accounts = CashAccount.query.filter_by(user_id=current_user.id).all()
-    total_cash = sum(cash.balance for cash in cash_accounts)
+    cash_accounts = get_cash_accounts(current_user.id)
     bonds = Bond.query.filter_by(user_id=current_user.id).all()
-    total_bonds = sum(bond.total_value for bond in bonds)
-    net_worth = total_investment + total_cash + total_bonds
+    bond_analytics = analyze_bonds(bonds)
+    # Value every position, account and bond in the reporting currency in one batch conversion
+    amounts = [(inv.user_total_value, inv.currency) for inv in investments]
+    amounts += [(cash.balance, cash.currency) for cash in cash_accounts]
+    amounts += [(a['market_value'], 'USD') for a in bond_analytics.values()]
+    net_worth = round(convert_amounts(amounts, currency), 2)
     return render_template('dashboard.html', investments=investments,
-                           cash_accounts=cash_accounts, bonds=bonds, net_worth=net_worth)
+                           cash_accounts=cash_accounts, bonds=bonds, bond_analytics=bond_analytics,
+                           net_worth=net_worth, currency=currency, currencies=SUPPORTED_CURRENCIES)
+
+@investments_bp.route('/stream/valuations')
+@login_required
+def stream_valuations():
+    from valuation_stream import get_hub
+    currency = get_reporting_currency(request, session)
+    hub = get_hub(current_app._get_current_object())
+    return Response(hub.stream(current_user.id, currency), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @investments_bp.route('/transaction', methods=['GET', 'POST'])
 @login_required
 def transaction():
-    investments = Investment.query.all()  # global investments
-    cash_accounts = CashAccount.query.filter_by(user_id=current_user.id).all()
+    investments = get_investments()  # global investments
+    cash_accounts = get_cash_accounts(current_user.id)
     if request.method == 'POST':
         is_new_investment = request.form.get('is_new_investment')
         if is_new_investment == 'on':
@@ -42,11 +87,13 @@ def transaction():
             new_asset_class = request.form.get('new_asset_class')
             new_currency = request.form.get('new_currency')  # used for quote_currency in transaction
             new_wallet_address = request.form.get('new_wallet_address')
+            new_price_feed = request.form.get('new_price_feed') or None
             new_investment = Investment(
                 symbol=new_symbol,
                 description=new_description,
                 asset_class=new_asset_class,
-                wallet_address=new_wallet_address
+                wallet_address=new_wallet_address,
+                price_feed=new_price_feed
             )
             db.session.add(new_investment)
             db.session.commit()
@@ -76,42 +123,98 @@ def transaction():
         except ValueError:
             flash("Invalid date format. Please use YYYY-MM-DD.", "danger")
             return redirect(url_for('investments.transaction'))
+        try:
+            lot_id = _lot_id(request.form.get('lot_id'), investment_id) if transaction_type == 'Sell' else None
+        except ValueError:
+            flash("Lot must be the ID of one of your buys of this investment", "danger")
+            return redirect(url_for('investments.transaction'))
 
-        new_txn = Transaction(
-            investment_id=investment_id,
-            user_id=current_user.id,
-            date=date_obj,
-            transaction_type=transaction_type,
-            transaction_price=transaction_price,
-            quantity=quantity,
-            broker_note=broker_note
-        )
+        cash_acc = None
         if cash_account_id:
             cash_acc = CashAccount.query.filter_by(id=int(cash_account_id), user_id=current_user.id).first()
             if not quote_currency:
                 quote_currency = cash_acc.currency
-            amount = transaction_price * quantity
-            if transaction_type.lower() == 'buy':
-                cash_acc.balance -= amount
-                txn_type = 'investment_buy'
-            elif transaction_type.lower() == 'sell':
-                cash_acc.balance += amount
-                txn_type = 'investment_sell'
-            ct = CashTransaction(
+        buy = transaction_type.lower() == 'buy'
+        def record():
+            new_txn = Transaction(
+                investment_id=investment_id,
+                user_id=current_user.id,
                 date=date_obj,
-                transaction_type=txn_type,
-                from_account_id=cash_acc.id if transaction_type.lower() == 'buy' else None,
-                to_account_id=cash_acc.id if transaction_type.lower() == 'sell' else None,
-                amount=amount
+                transaction_type=transaction_type,
+                transaction_price=transaction_price,
+                quantity=quantity,
+                broker_note=broker_note,
+                lot_id=lot_id,
+                quote_currency=quote_currency if quote_currency else 'USD'
             )
-            db.session.add(ct)
-        new_txn.quote_currency = quote_currency if quote_currency else 'USD'
-        db.session.add(new_txn)
-        db.session.commit()
-        log_activity("Transaction Recorded", f"Transaction for investment ID {investment_id} recorded.")
+            if cash_acc is not None:
+                db.session.add(CashTransaction(
+                    date=date_obj,
+                    transaction_type='investment_buy' if buy else 'investment_sell',
+                    from_account_id=cash_acc.id if buy else None,
+                    to_account_id=None if buy else cash_acc.id,
+                    amount=transaction_price * quantity
+                ))
+                if buy:
+                    forbid_overdraft(db.session, cash_acc.id)
+            db.session.add(new_txn)
+            ensure_position(current_user.id, investment_id, new_txn.quote_currency)
+            log_activity("Transaction Recorded", f"Transaction for investment ID {investment_id} recorded.",
+                         commit=False)
+        try:
+            commit_with_retry(record)
+        except InsufficientFunds:
+            flash('Insufficient funds!', 'danger')
+            return redirect(url_for('investments.transaction'))
         flash('Transaction recorded successfully!', 'success')
         return redirect(url_for('investments.dashboard'))
-    return render_template('transaction.html', investments=investments, cash_accounts=cash_accounts)
+    return render_template('transaction.html', investments=investments, cash_accounts=cash_accounts,
+                           price_feeds=discover_feeds())
+
+BATCH_FORM_FIELDS = ('date', 'symbol', 'transaction_type', 'transaction_price', 'quantity', 'quote_currency',
+                     'cash_account_id', 'broker_note', 'asset_class', 'description')
+
+@investments_bp.route('/transaction/batch', methods=['GET', 'POST'])
+@login_required
+def transaction_batch():
+    from trade_batch import validate_trades, record_trades
+    cash_accounts = CashAccount.query.filter_by(user_id=current_user.id).all()
+    if request.method == 'POST':
+        if request.is_json:
+            payload = request.get_json(silent=True) or {}
+            raw_trades = payload.get('trades') if isinstance(payload, dict) else None
+            if not isinstance(raw_trades, list):
+                return jsonify({'errors': [{'row': None, 'error': 'Expected {"trades": [...]}'}]}), 400
+        else:
+            columns = {name: request.form.getlist(name) for name in BATCH_FORM_FIELDS}
+            raw_trades = [{name: values[i] if i < len(values) else '' for name, values in columns.items()}
+                          for i in range(len(columns['symbol']))]
+            # Rows left blank in the form are ignored
+            raw_trades = [t for t in raw_trades if t['symbol'].strip() or t['quantity'].strip()]
+        trades, errors = validate_trades(raw_trades, current_user.id)
+        if not errors and not trades:
+            errors = [{'row': None, 'error': 'No trades given'}]
+        if errors:
+            if request.is_json:
+                return jsonify({'errors': errors}), 400
+            for error in errors:
+                flash(f"Row {error['row']}: {error['error']}" if error['row'] else error['error'], 'danger')
+            return render_template('transaction_batch.html', cash_accounts=cash_accounts,
+                                   rows=raw_trades, investments=get_investments())
+        try:
+            rows = record_trades(trades, current_user.id)
+        except InsufficientFunds as exc:
+            if request.is_json:
+                return jsonify({'errors': [{'row': None, 'error': str(exc)}]}), 400
+            flash('Insufficient funds!', 'danger')
+            return render_template('transaction_batch.html', cash_accounts=cash_accounts,
+                                   rows=raw_trades, investments=get_investments())
+        if request.is_json:
+            return jsonify({'recorded': len(rows), 'transaction_ids': [t.id for t in rows]})
+        flash(f'{len(rows)} transactions recorded successfully!', 'success')
+        return redirect(url_for('investments.transactions'))
+    return render_template('transaction_batch.html', cash_accounts=cash_accounts, rows=[],
+                           investments=get_investments())
 
 @investments_bp.route('/transactions', methods=['GET'])
 @login_required
@@ -134,7 +237,7 @@ def edit_transaction(transaction_id):
     if txn.user_id != current_user.id:
         flash("Unauthorized access", "danger")
         return redirect(url_for('investments.dashboard'))
-    investments = Investment.query.all()
+    investments = get_investments()
     if request.method == 'POST':
         try:
             txn_date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
@@ -157,6 +260,13 @@ def edit_transaction(transaction_id):
         txn.broker_note = request.form.get('broker_note')
         inv_id = request.form.get('investment_id')
         txn.investment_id = int(inv_id) if inv_id and inv_id != 'None' else None
+        try:
+            txn.lot_id = _lot_id(request.form.get('lot_id'), txn.investment_id) if txn.transaction_type == 'Sell' else None
+        except ValueError:
+            db.session.rollback()
+            flash("Lot must be the ID of one of your buys of this investment", "danger")
+            return redirect(url_for('investments.edit_transaction', transaction_id=transaction_id))
+        ensure_position(current_user.id, txn.investment_id, txn.quote_currency)
         db.session.commit()
         log_activity("Transaction Edited", f"Transaction ID {transaction_id} edited.")
         flash('Transaction updated successfully!', 'success')
@@ -176,6 +286,55 @@ def delete_transaction(transaction_id):
     flash('Transaction deleted successfully!', 'success')
     return redirect(url_for('investments.transactions'))
 
+@investments_bp.route('/investment/<int:investment_id>/actions', methods=['GET', 'POST'])
+@login_required
+def investment_actions(investment_id):
+    from corporate_actions import ACTION_TYPES, record_action
+    investment = Investment.query.get_or_404(investment_id)
+    if request.method == 'POST':
+        # Investments are shared, so an action restates every holder's history.
+        if not current_user.is_admin:
+            abort(403)
+        action_type = request.form.get('action_type')
+        try:
+            effective_date = datetime.strptime(request.form.get('date') or '', '%Y-%m-%d').date()
+        except ValueError:
+            flash("Invalid date format. Please use YYYY-MM-DD.", "danger")
+            return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+        ratio = new_symbol = None
+        if action_type in ('split', 'reverse_split'):
+            try:
+                ratio = float(request.form.get('new_shares')) / float(request.form.get('old_shares'))
+            except (TypeError, ValueError, ZeroDivisionError):
+                flash("Split ratio must be two positive numbers", "danger")
+                return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+            if ratio <= 0 or ratio == 1 or (action_type == 'split') != (ratio > 1):
+                flash("A split must increase the share count and a reverse split reduce it", "danger")
+                return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+        elif action_type == 'symbol_change':
+            new_symbol = (request.form.get('new_symbol') or '').strip().upper()
+            if not new_symbol or len(new_symbol) > 10 or new_symbol == investment.symbol:
+                flash("Enter the new ticker (up to 10 characters)", "danger")
+                return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+            if Investment.query.filter(Investment.symbol == new_symbol, Investment.id != investment.id).first():
+                flash(f"Symbol {new_symbol} is already used by another investment", "danger")
+                return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+        else:
+            flash("Unknown corporate action", "danger")
+            return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+        symbol = investment.symbol
+        record_action(investment, action_type, effective_date, ratio, new_symbol)
+        log_activity("Corporate Action Recorded", f"{action_type} for {symbol} effective {effective_date}.")
+        flash('Corporate action recorded successfully!', 'success')
+        if new_symbol and investment.price_feed:
+            # Feed output is matched by symbol, so prices published under the old ticker are now dropped.
+            flash(f"Feed '{investment.price_feed}' must now publish {new_symbol}; its prices for {symbol} "
+                  f"are ignored.", 'warning')
+        return redirect(url_for('investments.investment_actions', investment_id=investment_id))
+    actions = CorporateAction.query.filter_by(investment_id=investment_id).order_by(CorporateAction.date.desc()).all()
+    return render_template('corporate_actions.html', investment=investment, actions=actions,
+                           action_types=ACTION_TYPES)
+
 @investments_bp.route('/report')
 @login_required
 def report():
@@ -184,9 +343,9 @@ def report():
     si = io.StringIO()
     cw = csv.writer(si)
     cw.writerow(['Date', 'Investment', 'Type', 'Price', 'Quantity', 'Broker Note', 'Quote Currency'])
+    symbols = {inv.id: inv.symbol for inv in get_investments()}
     for t in txns:
-        inv = Investment.query.filter_by(id=t.investment_id).first() if t.investment_id else None
-        symbol = inv.symbol if inv else 'N/A'
+        symbol = symbols.get(t.investment_id, 'N/A')
         cw.writerow([t.date, symbol, t.transaction_type, t.transaction_price, t.quantity, t.broker_note, t.quote_currency])
     output = si.getvalue()
     return Response(output, mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=transactions.csv"})
@@ -194,14 +353,56 @@ def report():
 @investments_bp.route('/risk')
 @login_required
 def risk():
-    investments = Investment.query.all()
+    # The numpy-backed risk engine is loaded on the first risk request, not at worker start.
+    from risk_analytics import portfolio_risk, LOOKBACK_CHOICES
+    try:
+        lookback = int(request.args.get('lookback', 365))
+        confidence = float(request.args.get('confidence', 0.95))
+    except ValueError:
+        lookback = 365
+        confidence = 0.95
+    if lookback not in LOOKBACK_CHOICES:
+        lookback = 365
+    if not 0.5 <= confidence < 1:
+        confidence = 0.95
+    benchmark = request.args.get('benchmark', 'SPY').strip().upper()
+    investments = get_investments()
+    quote_currencies = get_quote_currencies(current_user.id)
     category_totals = {}
+    holdings = {}
     for inv in investments:
         shares, _ = compute_user_investment(inv, current_user.id)
         price = get_price(inv.symbol)
-        asset_value = shares * price
+        rate = convert_currency(1.0, quote_currencies.get(inv.id, 'USD'), 'USD')
+        asset_value = shares * price * rate
         cat = inv.asset_class
         category_totals[cat] = category_totals.get(cat, 0) + asset_value
+        if shares > 0:
+            holdings[inv.symbol] = (shares, asset_value, rate)
     total_investment = sum(category_totals.values())
     risk_data = {cat: round((value / total_investment) * 100, 2) for cat, value in category_totals.items()} if total_investment > 0 else {}
-    return render_template('risk.html', risk_data=risk_data)
+    metrics = portfolio_risk(holdings, benchmark, lookback, confidence)
+    return render_template('risk.html', risk_data=risk_data, metrics=metrics, lookback=lookback,
+                           lookback_choices=LOOKBACK_CHOICES, benchmark=benchmark, confidence=confidence)
+
+@investments_bp.route('/rebalance')
+@login_required
+def rebalance():
+    from lots import METHOD_LABELS
+    return render_template('rebalance.html', lot_method=METHOD_LABELS[get_lot_method(current_user.id)])
+
+@investments_bp.route('/rebalance/simulate', methods=['POST'])
+@login_required
+def rebalance_simulate():
+    from rebalance import load_portfolio, simulate, GROUPINGS
+    payload = request.get_json(silent=True) or {}
+    by = payload.get('by', 'asset_class')
+    scenarios = payload.get('scenarios') or [{}]
+    if by not in GROUPINGS or not isinstance(scenarios, list) or not all(isinstance(s, dict) for s in scenarios):
+        return jsonify({'error': 'Expected {"by": "asset_class" | "symbol", "scenarios": [{group: weight}, ...]}'}), 400
+    try:
+        min_trade = float(payload.get('min_trade', 1.0))
+        extra_symbols = {key for s in scenarios for key in s} if by == 'symbol' else ()
+        return jsonify(simulate(load_portfolio(current_user.id, extra_symbols), scenarios, by=by, min_trade=min_trade))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Weights and min_trade must be numbers'}), 400
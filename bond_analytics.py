@@ -0,0 +1,141 @@
+import calendar
+from datetime import date
+from cache import LRUCache
+
+NEWTON_TOLERANCE = 1e-10
+NEWTON_MAX_ITER = 100
+
+# Results are keyed on every input that affects them, so edits never need explicit invalidation.
+_analytics_cache = LRUCache(maxsize=512)
+
+def add_months(d, months):
+    month_index = d.month - 1 + months
+    year = d.year + month_index // 12
+    month = month_index % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+def coupon_dates(maturity_date, frequency, settlement_date):
+    """
+    Walk back from maturity in coupon steps.
+    Returns (previous_coupon_date, [future coupon dates after settlement, ascending]).
+    """
+    step = 12 // frequency
+    future = []
+    n = 0
+    current = maturity_date
+    while current > settlement_date:
+        future.append(current)
+        n += 1
+        current = add_months(maturity_date, -step * n)
+    future.reverse()
+    return current, future
+
+def cash_flow_schedule(bond, start_date, end_date=None):
+    """
+    Coupon and principal payments for a whole position between start_date (exclusive) and end_date.
+    Returns a list of (date, kind, amount) tuples.
+    """
+    frequency = bond.coupon_frequency or 1
+    _, dates = coupon_dates(bond.maturity_date, frequency, start_date)
+    coupon = bond.face_value * bond.coupon_rate / 100 / frequency * bond.quantity
+    schedule = []
+    for d in dates:
+        if end_date and d > end_date:
+            break
+        if coupon:
+            schedule.append((d, 'coupon', coupon))
+        if d == bond.maturity_date:
+            schedule.append((d, 'principal', bond.face_value * bond.quantity))
+    return schedule
+
+def bond_price(bond):
+    """Clean price per bond: the quoted market price when known, otherwise the cost basis."""
+    return bond.market_price if bond.market_price else bond.cost_basis
+
+def _bond_key(bond):
+    return (bond.id, bond.face_value, bond.coupon_rate, bond.coupon_frequency, bond.maturity_date,
+            bond.quantity, bond_price(bond))
+
+def analyze_bonds(bonds, as_of=None):
+    """
+    Analytics for a list of bonds keyed by bond id, cached on the bonds' inputs and the valuation date.
+    """
+    as_of = as_of or date.today()
+    keys = tuple(_bond_key(b) for b in bonds)
+    return _analytics_cache.get_or_compute((as_of, keys), lambda: _analyze(keys, as_of))
+
+def _analyze(keys, as_of):
+    # numpy is only loaded for pricing, so importing the date helpers stays cheap.
+    import numpy as np
+    results = {}
+    live = []
+    for bond_id, face, coupon_rate, frequency, maturity, quantity, clean in keys:
+        frequency = frequency or 1
+        if maturity <= as_of or not face:
+            results[bond_id] = {
+                'clean_price': face, 'dirty_price': face, 'accrued_interest': 0.0,
+                'ytm': 0.0, 'macaulay_duration': 0.0, 'modified_duration': 0.0, 'convexity': 0.0,
+                'market_value': quantity * face, 'next_coupon': None,
+            }
+            continue
+        previous, future = coupon_dates(maturity, frequency, as_of)
+        coupon = face * coupon_rate / 100 / frequency
+        accrual = (as_of - previous).days / (future[0] - previous).days
+        live.append((bond_id, face, frequency, quantity, clean or 0.0, coupon, accrual, future))
+
+    if live:
+        width = max(len(item[7]) for item in live)
+        n = len(live)
+        times = np.zeros((n, width))
+        flows = np.zeros((n, width))
+        clean = np.empty(n)
+        accrued = np.empty(n)
+        freq = np.empty(n)
+        for i, (_, face, frequency, _, price, coupon, accrual, future) in enumerate(live):
+            periods = len(future)
+            times[i, :periods] = np.arange(periods) + (1 - accrual)
+            flows[i, :periods] = coupon
+            flows[i, periods - 1] += face
+            clean[i] = price
+            accrued[i] = coupon * accrual
+            freq[i] = frequency
+        dirty = clean + accrued
+        rate = solve_periodic_yield(times, flows, dirty)
+        discount = (1 + rate)[:, None] ** -times
+        pv = flows * discount
+        with np.errstate(divide='ignore', invalid='ignore'):
+            macaulay = np.where(dirty > 0, (times * pv).sum(axis=1) / dirty / freq, 0.0)
+            convexity = np.where(dirty > 0, (times * (times + 1) * pv).sum(axis=1)
+                                 / ((1 + rate) ** 2 * dirty * freq ** 2), 0.0)
+        modified = macaulay / (1 + rate)
+        for i, (bond_id, _, _, quantity, _, _, _, future) in enumerate(live):
+            results[bond_id] = {
+                'clean_price': float(clean[i]),
+                'dirty_price': float(dirty[i]),
+                'accrued_interest': float(accrued[i]),
+                'ytm': float(rate[i] * freq[i] * 100),
+                'macaulay_duration': float(macaulay[i]),
+                'modified_duration': float(modified[i]),
+                'convexity': float(convexity[i]),
+                'market_value': float(quantity * dirty[i]),
+                'next_coupon': future[0],
+            }
+    return results
+
+def solve_periodic_yield(times, flows, dirty_prices):
+    """
+    Solve sum(flows * (1 + r) ** -times) = dirty_price for every row at once with Newton's method.
+    """
+    import numpy as np
+    rate = np.full(len(dirty_prices), 0.025)
+    active = dirty_prices > 0
+    for _ in range(NEWTON_MAX_ITER):
+        growth = 1 + rate[:, None]
+        pv = flows * growth ** -times
+        f = pv.sum(axis=1) - dirty_prices
+        df = -(times * pv / growth).sum(axis=1)
+        step = np.where(active & (df != 0), f / np.where(df != 0, df, 1), 0.0)
+        rate = np.maximum(rate - step, -0.99)
+        if np.all(np.abs(step) < NEWTON_TOLERANCE):
+            break
+    return np.where(active, rate, 0.0)
@@ -0,0 +1,186 @@
+from datetime import date, datetime, time
+from sqlalchemy import event, inspect, select, update, insert, delete, func
+from sqlalchemy.orm import Session, object_session
+from config import Config
+from models import db, CashAccount, CashTransaction, CashLedgerEntry, CashCheckpoint
+
+# Which account each cash transaction type moves, and in which direction. Conversions credit
+# the receiving account at the conversion rate; adjustments carry their own sign.
+LEGS = {
+    'deposit': (('to_account_id', 1),),
+    'withdraw': (('from_account_id', -1),),
+    'investment_buy': (('from_account_id', -1),),
+    'investment_sell': (('to_account_id', 1),),
+    'adjustment': (('to_account_id', 1),),
+    'conversion': (('from_account_id', -1), ('to_account_id', 'rate')),
+}
+LEG_ATTRS = ('transaction_type', 'from_account_id', 'to_account_id', 'date', 'amount', 'conversion_rate')
+REPLAY_BATCH = 5000
+
+class InsufficientFunds(Exception):
+    def __init__(self, account_id):
+        super().__init__(f"Insufficient funds in cash account {account_id}")
+        self.account_id = account_id
+
+def legs(txn_type, from_id, to_id, txn_date, amount, rate):
+    """(account_id, date, signed amount) for every account a cash transaction moves."""
+    ids = {'from_account_id': from_id, 'to_account_id': to_id}
+    for attr, sign in LEGS.get(txn_type, ()):
+        if ids[attr] is None or amount is None:
+            continue
+        if sign == 'rate':
+            if rate:
+                yield ids[attr], txn_date, amount * rate
+        else:
+            yield ids[attr], txn_date, sign * amount
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time())
+
+def _old_value(target, attr):
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+def _state(target, old=False):
+    value = _old_value if old else getattr
+    return tuple(value(target, attr) for attr in LEG_ATTRS)
+
+def _append(target, state, sign):
+    pending = object_session(target).info.setdefault('ledger_legs', [])
+    for account_id, txn_date, amount in legs(*state):
+        pending.append({'account_id': account_id, 'cash_transaction_id': target.id,
+                        'date': txn_date, 'amount': sign * amount})
+
+@event.listens_for(CashTransaction, 'after_insert')
+def _cash_inserted(mapper, connection, target):
+    _append(target, _state(target), 1)
+
+@event.listens_for(CashTransaction, 'after_update')
+def _cash_updated(mapper, connection, target):
+    # An edit is recorded as a reversal of the old legs followed by the new ones.
+    if not any(inspect(target).attrs[attr].history.has_changes() for attr in LEG_ATTRS):
+        return
+    _append(target, _state(target, old=True), -1)
+    _append(target, _state(target), 1)
+
+@event.listens_for(CashTransaction, 'after_delete')
+def _cash_deleted(mapper, connection, target):
+    _append(target, _state(target, old=True), -1)
+
+def _checkpoint_if_due(conn, account_id, interval):
+    entries = CashLedgerEntry.__table__
+    checkpoints = CashCheckpoint.__table__
+    last = conn.execute(select(checkpoints.c.seq, checkpoints.c.max_date, checkpoints.c.balance)
+                        .where(checkpoints.c.account_id == account_id)
+                        .order_by(checkpoints.c.seq.desc()).limit(1)).first()
+    count, tail, seq, max_date = conn.execute(
+        select(func.count(), func.sum(entries.c.amount), func.max(entries.c.seq), func.max(entries.c.date))
+        .where(entries.c.account_id == account_id, entries.c.seq > (last.seq if last else 0))).one()
+    if count < interval:
+        return
+    if last is not None:
+        max_date = max(max_date, last.max_date)
+    conn.execute(insert(checkpoints).values(account_id=account_id, seq=seq, max_date=max_date,
+                                            balance=(last.balance if last else 0) + tail))
+
+def forbid_overdraft(session, account_id):
+    """Make the next flush raise InsufficientFunds rather than take the account below zero."""
+    session.info.setdefault('no_overdraft', set()).add(account_id)
+
+@event.listens_for(Session, 'after_flush')
+def _apply_ledger_legs(session, flush_context):
+    pending = session.info.pop('ledger_legs', None)
+    guarded = session.info.pop('no_overdraft', set())
+    if not pending:
+        return
+    conn = session.connection()
+    for leg in pending:
+        leg['date'] = _as_datetime(leg['date'])
+    conn.execute(insert(CashLedgerEntry.__table__), pending)
+    deltas = {}
+    for leg in pending:
+        deltas[leg['account_id']] = deltas.get(leg['account_id'], 0) + leg['amount']
+    accounts = CashAccount.__table__
+    for account_id, delta in deltas.items():
+        # A single UPDATE per account: the database adds the delta, so concurrent writers cannot lose
+        # each other's changes, and a guarded debit only applies while the funds are there.
+        stmt = update(accounts).where(accounts.c.id == account_id).values(balance=accounts.c.balance + delta)
+        if account_id in guarded and delta < 0:
+            stmt = stmt.where(accounts.c.balance + delta >= 0)
+        if conn.execute(stmt).rowcount == 0 and account_id in guarded:
+            raise InsufficientFunds(account_id)
+        _checkpoint_if_due(conn, account_id, Config.CASH_CHECKPOINT_INTERVAL)
+
+def balance_as_of(account_id, as_of=None):
+    """
+    Ledger balance of an account including every entry dated on or before as_of (a date
+    includes the whole day; None means the current balance). Starts from the newest checkpoint
+    whose entries all fall inside the range and sums only the entries appended after it.
+    """
+    entries = CashLedgerEntry.__table__
+    checkpoints = CashCheckpoint.__table__
+    if isinstance(as_of, date) and not isinstance(as_of, datetime):
+        as_of = datetime.combine(as_of, time.max)
+    checkpoint = select(checkpoints.c.seq, checkpoints.c.balance).where(checkpoints.c.account_id == account_id)
+    tail = select(func.coalesce(func.sum(entries.c.amount), 0)).where(entries.c.account_id == account_id)
+    if as_of is not None:
+        checkpoint = checkpoint.where(checkpoints.c.max_date <= as_of)
+        tail = tail.where(entries.c.date <= as_of)
+    start = db.session.execute(checkpoint.order_by(checkpoints.c.seq.desc()).limit(1)).first()
+    if start is not None:
+        tail = tail.where(entries.c.seq > start.seq)
+    return (start.balance if start else 0) + db.session.execute(tail).scalar()
+
+def rebuild_ledger(interval=None):
+    """
+    Replay every CashTransaction in id order into a fresh ledger, checkpoints and account
+    balances. Transactions are streamed and entries written in batches, so memory stays flat.
+    Returns {account_id: (balance before, rebuilt balance)} for accounts whose balance changed.
+    """
+    interval = interval or Config.CASH_CHECKPOINT_INTERVAL
+    conn = db.session.connection()
+    accounts = CashAccount.__table__
+    before = dict(conn.execute(select(accounts.c.id, accounts.c.balance)).all())
+    conn.execute(delete(CashCheckpoint.__table__))
+    conn.execute(delete(CashLedgerEntry.__table__))
+    t = CashTransaction.__table__
+    rows = conn.execute(select(t.c.id, *(t.c[attr] for attr in LEG_ATTRS)).order_by(t.c.id)
+                        .execution_options(yield_per=REPLAY_BATCH))
+    state = {}  # account_id -> [balance, entries, max_date]
+    batch, checkpoints = [], []
+    seq = 0
+    for row in rows:
+        for account_id, txn_date, amount in legs(*row[1:]):
+            seq += 1
+            txn_date = _as_datetime(txn_date)
+            batch.append({'seq': seq, 'account_id': account_id, 'cash_transaction_id': row.id,
+                          'date': txn_date, 'amount': amount})
+            entry = state.setdefault(account_id, [0, 0, txn_date])
+            entry[0] += amount
+            entry[1] += 1
+            entry[2] = max(entry[2], txn_date)
+            if entry[1] % interval == 0:
+                checkpoints.append({'account_id': account_id, 'seq': seq, 'max_date': entry[2], 'balance': entry[0]})
+        if len(batch) >= REPLAY_BATCH:
+            conn.execute(insert(CashLedgerEntry.__table__), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(CashLedgerEntry.__table__), batch)
+    if checkpoints:
+        conn.execute(insert(CashCheckpoint.__table__), checkpoints)
+    changed = {}
+    for account_id, old in before.items():
+        new = state[account_id][0] if account_id in state else 0
+        conn.execute(update(accounts).where(accounts.c.id == account_id).values(balance=new))
+        if abs((old or 0) - new) > 1e-9:
+            changed[account_id] = (old, new)
+    return changed
+
+def adopt_balances(changed):
+    """
+    Record an adjustment for each account whose stored balance the ledger does not explain,
+    so balances set before the ledger existed survive a rebuild.
+    """
+    for account_id, (old, new) in changed.items():
+        db.session.add(CashTransaction(date=datetime.utcnow(), transaction_type='adjustment',
+                                       to_account_id=account_id, amount=(old or 0) - new))
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, case, literal, union_all, func, tuple_
+from models import db, CashTransaction
+from cash_ledger import LEGS, balance_as_of
+
+PAGE_SIZE = 200
+EXPORT_PAGE_SIZE = 5000
+# Each transaction appears once per side it touches the account on; leg orders a self-transfer.
+SIDES = (('from_account_id', 'to_account_id', 0), ('to_account_id', 'from_account_id', 1))
+
+def _side_legs(attr):
+    """(transaction type, sign) for every type that moves the account on the given side."""
+    return [(txn_type, sign) for txn_type, legs in LEGS.items() for leg_attr, sign in legs if leg_attr == attr]
+
+def _side(account_id, attr, other, leg, start, end, after):
+    """Rows where the account is on one side of the transaction, with the signed amount for that side."""
+    t = CashTransaction.__table__
+    legs = _side_legs(attr)
+    signed = case(*((t.c.transaction_type == txn_type,
+                     t.c.amount * func.coalesce(t.c.conversion_rate, 0) if sign == 'rate' else t.c.amount * sign)
+                    for txn_type, sign in legs), else_=0)
+    query = select(t.c.date, t.c.id, literal(leg).label('leg'), t.c.transaction_type,
+                   t.c[other].label('counterparty_id'), t.c.amount, t.c.conversion_rate, signed.label('signed')
+                   ).where(t.c[attr] == account_id, t.c.transaction_type.in_([txn_type for txn_type, _ in legs]))
+    if start is not None:
+        query = query.where(t.c.date >= start)
+    if end is not None:
+        query = query.where(t.c.date < end)
+    if after is not None:
+        key = tuple_(t.c.date, t.c.id)
+        query = query.where(key > (after[0], after[1]) if leg <= after[2] else key >= (after[0], after[1]))
+    return query
+
+def statement_page(account_id, start=None, end=None, after=None, limit=PAGE_SIZE):
+    """
+    One page of an account's statement in (date, id) order: each row carries its signed amount
+    and the running balance, both computed by the database. start/end are datetimes bounding
+    [start, end). after is the cursor of the previous page's last row, which also carries the
+    balance to continue from; the first page opens at the ledger balance just before start.
+    Returns (opening balance, rows, cursor of the last row or None when there are no more).
+    """
+    if after is not None:
+        opening = after[3]
+    elif start is not None:
+        opening = balance_as_of(account_id, start - timedelta(microseconds=1))
+    else:
+        opening = 0.0
+    arms = [_side(account_id, attr, other, leg, start, end, after) for attr, other, leg in SIDES]
+    page = union_all(*arms).order_by('date', 'id', 'leg').limit(limit).subquery()
+    order = (page.c.date, page.c.id, page.c.leg)
+    running = (literal(opening) + func.sum(page.c.signed).over(order_by=order)).label('balance')
+    rows = db.session.execute(select(page, running).order_by(*order)).all()
+    cursor = (rows[-1].date, rows[-1].id, rows[-1].leg, rows[-1].balance) if len(rows) == limit else None
+    return opening, rows, cursor
+
+def iter_statement(account_id, start=None, end=None, page_size=EXPORT_PAGE_SIZE):
+    """Every statement row, fetched a page at a time so exports stream in constant memory."""
+    after = None
+    while True:
+        _, rows, after = statement_page(account_id, start, end, after, page_size)
+        yield from rows
+        if after is None:
+            return
+
+def encode_cursor(cursor):
+    return None if cursor is None else f"{cursor[0].isoformat()}_{cursor[1]}_{cursor[2]}_{cursor[3]!r}"
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError for a malformed token."""
+    if not token:
+        return None
+    when, txn_id, leg, balance = token.split('_')
+    return datetime.fromisoformat(when), int(txn_id), int(leg), float(balance)
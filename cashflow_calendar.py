@@ -0,0 +1,57 @@
+from datetime import date
+from sqlalchemy import func
+from models import db, Bond, Dividend, ProjectedCashFlow
+from bond_analytics import cash_flow_schedule
+
+def refresh_bond_cash_flows(bond):
+    """
+    Replace the projected coupon and principal rows of one bond. Call after the bond is flushed.
+    """
+    remove_bond_cash_flows(bond.id)
+    db.session.add_all(
+        ProjectedCashFlow(user_id=bond.user_id, date=d, kind=kind, bond_id=bond.id, amount=amount)
+        for d, kind, amount in cash_flow_schedule(bond, bond.purchase_date)
+    )
+
+def remove_bond_cash_flows(bond_id):
+    ProjectedCashFlow.query.filter_by(bond_id=bond_id).delete(synchronize_session=False)
+
+def refresh_dividend_cash_flow(dividend):
+    """
+    Dividends recorded with a future date are declared payments and belong in the projection.
+    """
+    remove_dividend_cash_flow(dividend.id)
+    if dividend.date >= date.today():
+        db.session.add(ProjectedCashFlow(user_id=dividend.user_id, date=dividend.date, kind='dividend',
+                                         dividend_id=dividend.id, investment_id=dividend.investment_id,
+                                         amount=dividend.amount))
+
+def remove_dividend_cash_flow(dividend_id):
+    ProjectedCashFlow.query.filter_by(dividend_id=dividend_id).delete(synchronize_session=False)
+
+def rebuild_user_calendar(user_id):
+    ProjectedCashFlow.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    for bond in Bond.query.filter_by(user_id=user_id).all():
+        refresh_bond_cash_flows(bond)
+    for dividend in Dividend.query.filter(Dividend.user_id == user_id, Dividend.date >= date.today()).all():
+        refresh_dividend_cash_flow(dividend)
+
+def monthly_projection(user_id, start_date, end_date):
+    """
+    Expected cash per month between start_date and end_date from one range query on (user_id, date).
+    Returns a list of dicts ordered by month.
+    """
+    month = func.strftime('%Y-%m', ProjectedCashFlow.date)
+    rows = db.session.query(month, ProjectedCashFlow.kind, func.sum(ProjectedCashFlow.amount)).filter(
+        ProjectedCashFlow.user_id == user_id,
+        ProjectedCashFlow.date >= start_date,
+        ProjectedCashFlow.date <= end_date
+    ).group_by(month, ProjectedCashFlow.kind).order_by(month).all()
+    months = {}
+    for label, kind, amount in rows:
+        entry = months.setdefault(label, {'month': label, 'coupon': 0, 'principal': 0, 'dividend': 0})
+        entry[kind] = round(amount, 2)
+    result = list(months.values())
+    for entry in result:
+        entry['total'] = round(entry['coupon'] + entry['principal'] + entry['dividend'], 2)
+    return result
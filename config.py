@@ -1,4 +1,31 @@
+import os
+
 class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///investment_tracker.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Wait up to 15s for another worker's write lock instead of failing at once with "database is locked"
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 15}}
+    DB_BUSY_RETRIES = 5
+    # How long a worker may serve a logged-in user from its cache before re-reading the row
+    USER_CACHE_SECONDS = 60
+    # Compiled templates shared by all workers; unset uses a per-user directory under the system temp dir
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    # Upper bound on points per chart series sent to the browser
+    CHART_MAX_POINTS = 600
     SECRET_KEY = 'your_secret_key'  # Replace with a secure key
+    # Shared price/FX table written by the feed process and read by every worker
+    PRICE_TABLE_PATH = os.environ.get('PRICE_TABLE_PATH', os.path.join('instance', 'price_table.bin'))
+    PRICE_TABLE_CAPACITY = 4096
+    # User-defined feed scripts run by the feed process ('flask run-feeds')
+    FEEDS_DIR = os.environ.get('FEEDS_DIR', 'feeds')
+    FEED_DEFAULT_INTERVAL = 60
+    FEED_TIMEOUT_SECONDS = 20
+    FEED_MEMORY_LIMIT_MB = 512
+    FEED_MAX_WORKERS = 4
+    FEED_MAX_BACKOFF_SECONDS = 900
+    # ActivityLog retention: rows older than the hot window move to gzip JSONL archives
+    ACTIVITY_HOT_DAYS = 90
+    ACTIVITY_ARCHIVE_DIR = os.environ.get('ACTIVITY_ARCHIVE_DIR', os.path.join('instance', 'activity_archive'))
+    ACTIVITY_ARCHIVE_BATCH = 5000
+    # Ledger entries per account between cash balance checkpoints
+    CASH_CHECKPOINT_INTERVAL = 100
@@ -0,0 +1,68 @@
+from bisect import bisect_right
+from datetime import datetime
+from itertools import accumulate
+from operator import mul
+from sqlalchemy import select, func
+from models import db, CorporateAction
+import request_memo
+
+ACTION_TYPES = ('split', 'reverse_split', 'symbol_change')
+SPLIT_TYPES = ('split', 'reverse_split')
+
+def _ordinal(day):
+    return (day.date() if isinstance(day, datetime) else day).toordinal()
+
+class SplitFactors:
+    """
+    Cumulative split adjustment of one investment. days holds each split's effective date (as
+    an ordinal) in order and suffix[i] the product of the ratios of splits i onward, so the
+    factor for a day - how many of today's shares one share held that day has become - is a
+    binary search into the suffix products.
+    """
+    def __init__(self, days, ratios):
+        splits = sorted(zip(days, ratios), key=lambda split: split[0])
+        self.days = [day for day, _ in splits]
+        self.suffix = list(accumulate(reversed([ratio for _, ratio in splits]), mul, initial=1.0))[::-1]
+
+    def factor(self, day):
+        return self.suffix[bisect_right(self.days, _ordinal(day))]
+
+NO_SPLITS = SplitFactors([], [])
+
+def load_split_factors(executor, investment_ids=None):
+    """
+    {investment_id: SplitFactors} for every investment with a split, in one query. executor is
+    a session or connection, so flush listeners can read through their own connection.
+    """
+    t = CorporateAction.__table__
+    query = select(t.c.investment_id, t.c.date, t.c.ratio).where(t.c.action_type.in_(SPLIT_TYPES))
+    if investment_ids is not None:
+        query = query.where(t.c.investment_id.in_(investment_ids))
+    grouped = {}
+    for investment_id, day, ratio in executor.execute(query):
+        days, ratios = grouped.setdefault(investment_id, ([], []))
+        days.append(day.toordinal())
+        ratios.append(ratio)
+    return {investment_id: SplitFactors(days, ratios) for investment_id, (days, ratios) in grouped.items()}
+
+def split_factors(investment_id):
+    """The investment's split adjustment; splits for all investments are read at most once per request."""
+    factors = request_memo.memoize(('split_factors',), lambda: load_split_factors(db.session))
+    return factors.get(investment_id, NO_SPLITS)
+
+def actions_version():
+    """Changes whenever a corporate action is added or removed; keys caches of adjusted prices."""
+    return tuple(db.session.execute(select(func.count(CorporateAction.id), func.max(CorporateAction.id))).one())
+
+def record_action(investment, action_type, effective_date, ratio=None, new_symbol=None):
+    """
+    Add a corporate action for an investment. A split is the single new row; a symbol change
+    also renames the investment, keeping the old ticker on the action. Commits.
+    """
+    action = CorporateAction(investment_id=investment.id, date=effective_date, action_type=action_type, ratio=ratio)
+    if action_type == 'symbol_change':
+        action.old_symbol, action.new_symbol = investment.symbol, new_symbol
+        investment.symbol = new_symbol
+    db.session.add(action)
+    db.session.commit()
+    return action
@@ -0,0 +1,50 @@
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+from models import db, User, Transaction, CashAccount, CashTransaction, Bond, Dividend, DataVersion, CorporateAction
+
+USER_OWNED = (Transaction, CashAccount, Bond, Dividend)
+
+def get_data_version(user_id):
+    version = db.session.execute(select(DataVersion.version).where(DataVersion.user_id == user_id)).scalar()
+    return version or 0
+
+def _touched_users(session):
+    user_ids = set()
+    account_ids = set()
+    investment_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, USER_OWNED):
+            if obj.user_id is not None:
+                user_ids.add(obj.user_id)
+        elif isinstance(obj, CashTransaction):
+            account_ids.update(i for i in (obj.from_account_id, obj.to_account_id) if i)
+        elif isinstance(obj, User) and obj.id is not None:
+            # User settings such as the lot method change how the user's data is valued.
+            user_ids.add(obj.id)
+        elif isinstance(obj, CorporateAction):
+            investment_ids.add(obj.investment_id)
+    for account_id in account_ids:
+        account = session.get(CashAccount, account_id)
+        if account:
+            user_ids.add(account.user_id)
+    if investment_ids:
+        # A corporate action restates the holdings of everyone who has traded the investment.
+        user_ids.update(session.execute(select(Transaction.user_id).where(
+            Transaction.investment_id.in_(investment_ids)).distinct()).scalars())
+    return user_ids
+
+@event.listens_for(Session, 'before_flush')
+def _collect_touched_users(session, flush_context, instances):
+    session.info.setdefault('touched_users', set()).update(_touched_users(session))
+
+@event.listens_for(Session, 'after_flush')
+def _bump_data_versions(session, flush_context):
+    user_ids = session.info.pop('touched_users', set())
+    if not user_ids:
+        return
+    conn = session.connection()
+    table = DataVersion.__table__
+    for user_id in user_ids:
+        result = conn.execute(update(table).where(table.c.user_id == user_id).values(version=table.c.version + 1))
+        if result.rowcount == 0:
+            conn.execute(insert(table).values(user_id=user_id, version=1))
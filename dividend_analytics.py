@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+from sqlalchemy import func, case, cast, Integer
+from models import db, Dividend, Investment
+from cache import LRUCache
+from data_version import get_data_version
+from helpers import compute_user_investment, get_price
+
+# Keyed on (user, data version, ...) so any write to the user's rows retires old entries.
+_dividend_cache = LRUCache(maxsize=512)
+
+def _period_sums(user_id, label_expr, as_of):
+    rows = db.session.query(label_expr, func.sum(Dividend.amount), func.count(Dividend.id)).filter(
+        Dividend.user_id == user_id, Dividend.date <= as_of
+    ).group_by(label_expr).order_by(label_expr).all()
+    return [{'period': label, 'amount': round(total, 2), 'count': count} for label, total, count in rows]
+
+def dividend_summary(user_id, as_of=None):
+    as_of = as_of or date.today()
+    key = ('summary', user_id, get_data_version(user_id), as_of)
+    summary = _dividend_cache.get_or_compute(key, lambda: _compute_summary(user_id, as_of))
+    # Current yield moves with the live price, so it is worked out on every call, outside the cache.
+    per_investment = []
+    for row in summary['per_investment']:
+        market_value = row['shares'] * get_price(row['symbol'])
+        per_investment.append({**row, 'current_yield': round(row['ttm'] / market_value * 100, 2)
+                               if market_value > 0 else None})
+    return {**summary, 'per_investment': per_investment}
+
+def _compute_summary(user_id, as_of):
+    ttm_start = as_of - timedelta(days=365)
+    ttm_amount = func.sum(case((Dividend.date > ttm_start, Dividend.amount), else_=0))
+    rows = db.session.query(
+        Investment, func.sum(Dividend.amount), ttm_amount, func.count(Dividend.id), func.max(Dividend.date)
+    ).join(Dividend, Dividend.investment_id == Investment.id).filter(
+        Dividend.user_id == user_id, Dividend.date <= as_of
+    ).group_by(Investment.id).order_by(Investment.symbol).all()
+
+    per_investment = []
+    for inv, total, ttm, count, last_date in rows:
+        shares, avg_cost = compute_user_investment(inv, user_id)
+        cost_basis = shares * avg_cost
+        per_investment.append({
+            'symbol': inv.symbol,
+            'total': round(total, 2),
+            'ttm': round(ttm, 2),
+            'count': count,
+            'last_date': last_date,
+            'shares': shares,
+            'yield_on_cost': round(ttm / cost_basis * 100, 2) if cost_basis > 0 else None,
+        })
+
+    year = func.strftime('%Y', Dividend.date, type_=db.String)
+    month = func.strftime('%Y-%m', Dividend.date, type_=db.String)
+    quarter = year + '-Q' + cast((cast(func.strftime('%m', Dividend.date), Integer) + 2) // 3, db.String)
+    return {
+        'ttm_total': round(sum(p['ttm'] for p in per_investment), 2),
+        'per_investment': per_investment,
+        'monthly': _period_sums(user_id, month, as_of),
+        'quarterly': _period_sums(user_id, quarter, as_of),
+        'yearly': _period_sums(user_id, year, as_of),
+    }
@@ -0,0 +1,59 @@
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+def lttb(x, y, points):
+    """
+    Indices kept by Largest-Triangle-Three-Buckets: the first and last point, plus from each of
+    points - 2 equal buckets the point forming the largest triangle with the point kept before
+    it and the average of the next bucket. Keeps the visual shape of a line at any length.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def minmax(x, y, points):
+    """
+    Indices of the lowest and highest point in each of points / 2 equal buckets, in order.
+    Cheaper than LTTB and never hides a spike, at the cost of a jaggier line.
+    """
+    n = len(x)
+    if points >= n or points < 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, points // 2 + 1).astype(int)
+    keep = set()
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi > lo:
+            keep.add(lo + int(np.argmin(y[lo:hi])))
+            keep.add(lo + int(np.argmax(y[lo:hi])))
+    keep.update((0, n - 1))
+    return np.array(sorted(keep), dtype=int)
+
+def downsample(x, y, points, method='lttb'):
+    """Indices of at most about `points` samples of the series, chosen by method."""
+    return (minmax if method == 'minmax' else lttb)(x, y, points)
+
+def downsample_series(x, series, points, key, method='lttb'):
+    """
+    Thin several aligned series with the indices chosen on series[key], so every series keeps
+    the same x positions. x is numeric (e.g. day ordinals); series maps name -> list of values.
+    Returns (kept positions as a list, {name: thinned list}).
+    """
+    keep = downsample(x, series[key], points, method)
+    return keep.tolist(), {name: [values[i] for i in keep] for name, values in series.items()}
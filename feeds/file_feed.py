@@ -0,0 +1,14 @@
+"""
+Stub feed that republishes prices from a local JSON file ({"AAPL": 190.5, "FX:USDTHB": 34.2}).
+Useful for development and tests; real feeds follow the same shape: define fetch() returning
+a symbol -> price mapping, and optionally INTERVAL in seconds.
+"""
+import json
+import os
+
+INTERVAL = 5
+PATH = os.environ.get('FILE_FEED_PATH', os.path.join('instance', 'file_feed.json'))
+
+def fetch():
+    with open(PATH, encoding='utf-8') as f:
+        return json.load(f)
@@ -1,12 +1,54 @@
+import time
 from datetime import datetime, date, timedelta
-from models import Investment, CashTransaction, CashAccount, Bond, Dividend, ActivityLog, db, Transaction
+from sqlalchemy import select, func, literal_column
+from sqlalchemy.exc import OperationalError
+from models import Investment, CashTransaction, CashAccount, Bond, Dividend, ActivityLog, db, Transaction, Position, HistoricalPrice, User
+from flask import current_app
 from flask_login import current_user
+import price_table
+import request_memo
+from lots import replay, DEFAULT_METHOD
+from corporate_actions import split_factors, actions_version
 
 def get_price(symbol):
+    # Latest price from the shared feed table when the feed has published one
+    price = price_table.lookup(symbol)
+    if price is not None:
+        return price
     # Returns a dummy price based on the symbol hash (for demo purposes)
     return round(50 + (hash(symbol) % 100) * 0.1, 2)
 
+def get_price_as_of(symbol, as_of):
+    if as_of >= date.today():
+        return get_price(symbol)
+    history = get_history_price(symbol, as_of - timedelta(days=7), as_of)
+    return history[-1]['close'] if history else get_price(symbol)
+
 def get_history_price(symbol, start_date, end_date):
+    # Bars loaded by 'flask backfill-prices' take precedence over the demo series below.
+    # Symbols are not unique, so bars come from one investment: the first with bars in the range.
+    investment_id = db.session.execute(
+        select(func.min(HistoricalPrice.investment_id))
+        .join(Investment, Investment.id == HistoricalPrice.investment_id)
+        .where(Investment.symbol == symbol, HistoricalPrice.date.between(start_date, end_date))).scalar()
+    rows = db.session.query(HistoricalPrice).filter(
+        HistoricalPrice.investment_id == investment_id,
+        HistoricalPrice.date.between(start_date, end_date)
+    ).order_by(HistoricalPrice.date).all() if investment_id is not None else []
+    if rows:
+        # Bars before a split are restated in today's shares
+        splits = split_factors(investment_id)
+        history = []
+        for row in rows:
+            factor = splits.factor(row.date)
+            history.append({
+                'date': row.date.strftime("%Y-%m-%d"),
+                'open': (row.open if row.open is not None else row.close) / factor,
+                'close': row.close / factor,
+                'high': (row.high if row.high is not None else row.close) / factor,
+                'low': (row.low if row.low is not None else row.close) / factor,
+            })
+        return history
     history = []
     current = start_date
     while current <= end_date:
@@ -21,6 +63,17 @@ def get_history_price(symbol, start_date, end_date):
         current += timedelta(days=1)
     return history
 
+def price_history_version():
+    """
+    Changes whenever bars are loaded or a corporate action restates them: backfills only ever
+    append, so the newest HistoricalPrice rowid moves with every load.
+    """
+    table = HistoricalPrice.__table__
+    last_row = db.session.execute(select(func.max(literal_column('rowid'))).select_from(table)).scalar()
+    return (last_row or 0,) + actions_version()
+
+SUPPORTED_CURRENCIES = ['USD', 'THB', 'SGD']
+
 conversion_rates = {
     ('USD', 'THB'): 34.0,
     ('USD', 'SGD'): 1.35,
@@ -33,76 +86,85 @@ conversion_rates = {
 def convert_currency(amount, from_currency, to_currency):
     if from_currency == to_currency:
         return amount
-    rate = conversion_rates.get((from_currency, to_currency))
+    rate = price_table.lookup(price_table.fx_symbol(from_currency, to_currency)) or conversion_rates.get((from_currency, to_currency))
     if rate:
         return amount * rate
     else:
         return amount
 
-def compute_user_investment(investment, user_id):
+def fx_rates(to_currency):
+    """The rate from every supported currency into to_currency; keys caches of converted figures."""
+    return tuple(convert_currency(1.0, currency, to_currency) for currency in SUPPORTED_CURRENCIES)
+
+def convert_amounts(amounts, to_currency):
     """
-    Compute the user's holding for a given investment using FIFO method.
+    Batch conversion: sum (amount, currency) pairs per currency first, then convert each
+    currency bucket once. Returns the total in to_currency.
+    """
+    buckets = {}
+    for amount, currency in amounts:
+        buckets[currency] = buckets.get(currency, 0) + amount
+    return sum(convert_currency(total, currency, to_currency) for currency, total in buckets.items())
+
+def get_reporting_currency(request, session):
+    currency = request.args.get('currency') or session.get('reporting_currency', 'USD')
+    if currency not in SUPPORTED_CURRENCIES:
+        currency = 'USD'
+    session['reporting_currency'] = currency
+    return currency
+
+def _lot_trades(investment, user_id, as_of=None):
+    query = Transaction.query.with_entities(Transaction.transaction_type, Transaction.quantity,
+                                            Transaction.transaction_price, Transaction.id, Transaction.lot_id,
+                                            Transaction.date).filter_by(investment_id=investment.id, user_id=user_id)
+    if as_of:
+        query = query.filter(Transaction.date < as_of + timedelta(days=1))
+    return query.order_by(Transaction.date, Transaction.id).all()
+
+def compute_user_investment(investment, user_id, as_of=None):
+    """
+    Compute the user's holding for a given investment under the user's lot method.
+    When as_of is given only trades up to that date are counted.
     Returns (total_shares, average_cost).
     """
-    txns = Transaction.query.filter_by(investment_id=investment.id, user_id=user_id).order_by(Transaction.date).all()
-    lots = []
-    for t in txns:
-        if t.transaction_type.lower() == 'buy':
-            lots.append({'quantity': t.quantity, 'price': t.transaction_price})
-        elif t.transaction_type.lower() == 'sell':
-            qty_to_sell = t.quantity
-            while qty_to_sell > 0 and lots:
-                lot = lots[0]
-                if lot['quantity'] > qty_to_sell:
-                    lot['quantity'] -= qty_to_sell
-                    qty_to_sell = 0
-                else:
-                    qty_to_sell -= lot['quantity']
-                    lots.pop(0)
-    total_shares = sum(lot['quantity'] for lot in lots)
-    total_cost = sum(lot['quantity'] * lot['price'] for lot in lots)
-    avg_cost = total_cost / total_shares if total_shares > 0 else 0
-    return total_shares, avg_cost
+    book, _ = replay(_lot_trades(investment, user_id, as_of), get_lot_method(user_id), split_factors(investment.id))
+    return book.shares, book.average_cost()
 
 def compute_realized_gain(investment, user_id, start_date, end_date):
     """
-    Compute the realized gain for an investment for a user using FIFO for transactions within the period.
-    """
-    txns = Transaction.query.filter_by(investment_id=investment.id, user_id=user_id).order_by(Transaction.date).all()
-    lots = []
-    realized_gain = 0
-    for t in txns:
-        if t.transaction_type.lower() == 'buy':
-            lots.append({'quantity': t.quantity, 'price': t.transaction_price})
-        elif t.transaction_type.lower() == 'sell':
-            qty_to_sell = t.quantity
-            if start_date <= t.date.date() <= end_date:
-                while qty_to_sell > 0 and lots:
-                    lot = lots[0]
-                    if lot['quantity'] > qty_to_sell:
-                        realized_gain += qty_to_sell * (t.transaction_price - lot['price'])
-                        lot['quantity'] -= qty_to_sell
-                        qty_to_sell = 0
-                    else:
-                        realized_gain += lot['quantity'] * (t.transaction_price - lot['price'])
-                        qty_to_sell -= lot['quantity']
-                        lots.pop(0)
-            else:
-                while qty_to_sell > 0 and lots:
-                    lot = lots[0]
-                    if lot['quantity'] > qty_to_sell:
-                        lot['quantity'] -= qty_to_sell
-                        qty_to_sell = 0
-                    else:
-                        qty_to_sell -= lot['quantity']
-                        lots.pop(0)
-    return realized_gain
-
-def log_activity(action, details=""):
+    Compute the realized gain for an investment for a user, under the user's lot method, on sells within the period.
+    """
+    txns = _lot_trades(investment, user_id)
+    _, gains = replay(txns, get_lot_method(user_id), split_factors(investment.id))
+    return sum(gain for t, gain in zip(txns, gains) if start_date <= t.date.date() <= end_date)
+
+def log_activity(action, details="", commit=True):
+    # commit=False leaves the entry in the caller's transaction
     user_id = current_user.id if current_user.is_authenticated else None
     log = ActivityLog(user_id=user_id, action=action, details=details)
     db.session.add(log)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+
+def commit_with_retry(work, attempts=None):
+    """
+    Run work() and commit it, rerunning both when SQLite reports the database busy. work must
+    only stage changes on db.session, since a failed attempt is rolled back before the retry.
+    """
+    attempts = attempts or current_app.config.get('DB_BUSY_RETRIES', 5)
+    for attempt in range(attempts):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as exc:
+            db.session.rollback()
+            if 'database is locked' not in str(exc) or attempt == attempts - 1:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+        except Exception:
+            db.session.rollback()
+            raise
 
 def get_period_range(period_type, period_value):
     if period_type == 'yearly':
@@ -139,23 +201,8 @@ def get_period_range(period_type, period_value):
     return start_date, end_date
 
 def calculate_cash_balance_as_of(acc, end_date):
-    balance = 0
-    transactions = CashTransaction.query.filter(CashTransaction.date <= end_date).all()
-    for txn in transactions:
-        if txn.transaction_type == 'deposit' and txn.to_account_id == acc.id:
-            balance += txn.amount
-        elif txn.transaction_type == 'withdraw' and txn.from_account_id == acc.id:
-            balance -= txn.amount
-        elif txn.transaction_type == 'investment_buy' and txn.from_account_id == acc.id:
-            balance -= txn.amount
-        elif txn.transaction_type == 'investment_sell' and txn.to_account_id == acc.id:
-            balance += txn.amount
-        elif txn.transaction_type == 'conversion':
-            if txn.from_account_id == acc.id:
-                balance -= txn.amount
-            if txn.to_account_id == acc.id and txn.conversion_rate:
-                balance += txn.amount * txn.conversion_rate
-    return balance
+    from cash_ledger import balance_as_of
+    return balance_as_of(acc.id, end_date)
 
 def get_periods(period_type, request):
     periods = []
@@ -205,7 +252,52 @@ def get_periods(period_type, request):
     return periods
 
 def get_investment_quote_currency(investment, user_id):
-    txns = Transaction.query.filter_by(investment_id=investment.id, user_id=user_id).all()
-    if txns:
-        return txns[0].quote_currency
-    return 'USD'
+    currency = db.session.query(Position.quote_currency).filter_by(investment_id=investment.id, user_id=user_id).scalar()
+    return currency or 'USD'
+
+def get_quote_currencies(user_id):
+    """
+    Quote currency of every position the user holds, keyed by investment id, in one query.
+    Investments without a position default to USD.
+    """
+    def load():
+        rows = db.session.query(Position.investment_id, Position.quote_currency).filter_by(user_id=user_id).all()
+        return {investment_id: currency for investment_id, currency in rows}
+    return request_memo.memoize(('quote_currencies', user_id), load)
+
+def get_lot_method(user_id):
+    """The user's lot-selection method (see lots.METHODS), read at most once per request."""
+    return request_memo.memoize(('lot_method', user_id), lambda: db.session.query(User.lot_method).filter_by(
+        id=user_id).scalar() or DEFAULT_METHOD)
+
+def get_investments():
+    """The shared investments catalog, read at most once per request."""
+    return request_memo.memoize(('investments',), lambda: Investment.query.all())
+
+def get_cash_accounts(user_id):
+    """The user's cash accounts, read at most once per request."""
+    return request_memo.memoize(('cash_accounts', user_id),
+                                lambda: CashAccount.query.filter_by(user_id=user_id).all())
+
+def ensure_position(user_id, investment_id, quote_currency):
+    """
+    Record the quote currency of a position on its first trade; later trades keep the original.
+    """
+    if investment_id is None:
+        return
+    if not Position.query.filter_by(user_id=user_id, investment_id=investment_id).first():
+        db.session.add(Position(user_id=user_id, investment_id=investment_id, quote_currency=quote_currency or 'USD'))
+
+def rebuild_positions():
+    """
+    Backfill positions from each user's earliest trade in every investment.
+    """
+    Position.query.delete()
+    seen = set()
+    txns = db.session.query(Transaction.user_id, Transaction.investment_id, Transaction.quote_currency).filter(
+        Transaction.investment_id.isnot(None)
+    ).order_by(Transaction.date, Transaction.id)
+    for user_id, investment_id, quote_currency in txns:
+        if (user_id, investment_id) not in seen:
+            seen.add((user_id, investment_id))
+            db.session.add(Position(user_id=user_id, investment_id=investment_id, quote_currency=quote_currency))
@@ -0,0 +1,125 @@
+import heapq
+from collections import deque
+
+METHODS = ('fifo', 'lifo', 'hifo', 'average', 'specific')
+METHOD_LABELS = {
+    'fifo': 'First in, first out',
+    'lifo': 'Last in, first out',
+    'hifo': 'Highest cost first',
+    'average': 'Average cost',
+    'specific': 'Specific lot (falls back to FIFO)',
+}
+DEFAULT_METHOD = 'fifo'
+# Remainders below this are float noise from partial sells, not shares still held.
+EPSILON = 1e-9
+
+class LotBook:
+    """
+    Open lots of one position under a lot-selection method. Lots are [quantity, unit cost,
+    lot id, sequence]; FIFO and LIFO take from either end of a deque, HIFO pops a max-heap on
+    cost, and specific identification finds the named lot in a dict, so each sell costs
+    O(log n) at most. Average cost keeps a single pooled lot. Sells beyond the shares held
+    are ignored, as they always have been. Given the investment's split factors, trades are
+    restated in today's shares as they are booked.
+    """
+    def __init__(self, method=DEFAULT_METHOD, splits=None):
+        self.method = method if method in METHODS else DEFAULT_METHOD
+        self.splits = splits
+        self.shares = 0.0
+        self.cost = 0.0
+        self._lots = deque()
+        self._heap = []
+        self._by_id = {}
+        self._seq = 0
+
+    def buy(self, quantity, price, lot_id=None):
+        self.shares += quantity
+        self.cost += quantity * price
+        if self.method == 'average':
+            return
+        lot = [quantity, price, lot_id, self._seq]
+        self._seq += 1
+        if self.method == 'hifo':
+            heapq.heappush(self._heap, (-price, lot[3], lot))
+        else:
+            self._lots.append(lot)
+        if self.method == 'specific' and lot_id is not None:
+            self._by_id[lot_id] = lot
+
+    def sell(self, quantity, price, lot_id=None):
+        """Remove quantity from the lots the method selects; returns the realized gain."""
+        if self.method == 'average':
+            sold = min(quantity, self.shares)
+            unit_cost = self.average_cost()
+            self._reduce(sold, unit_cost)
+            return sold * (price - unit_cost)
+        gain = 0.0
+        remaining = quantity
+        if lot_id is not None and lot_id in self._by_id:
+            gain, remaining = self._take(self._by_id[lot_id], remaining, price)
+        while remaining > EPSILON:
+            lot = self._next_lot()
+            if lot is None:
+                break
+            lot_gain, remaining = self._take(lot, remaining, price)
+            gain += lot_gain
+        return gain
+
+    def apply(self, txn_type, quantity, price, txn_id=None, lot_id=None, on=None):
+        """Book a 'Buy' or 'Sell' trade made on `on`; a buy opens the lot named by its own transaction id."""
+        if self.splits is not None and on is not None:
+            factor = self.splits.factor(on)
+            quantity, price = quantity * factor, price / factor
+        if txn_type.lower() == 'buy':
+            self.buy(quantity, price, txn_id)
+        elif txn_type.lower() == 'sell':
+            return self.sell(quantity, price, lot_id)
+        return 0.0
+
+    def average_cost(self):
+        return self.cost / self.shares if self.shares > 0 else 0
+
+    def open_lots(self):
+        """(quantity, unit cost) of every open lot, in the order the method would sell them."""
+        if self.method == 'average':
+            return [(self.shares, self.average_cost())] if self.shares > 0 else []
+        if self.method == 'hifo':
+            lots = [lot for _, _, lot in sorted(self._heap)]
+        else:
+            lots = list(reversed(self._lots)) if self.method == 'lifo' else list(self._lots)
+        return [(lot[0], lot[1]) for lot in lots if lot[0] > EPSILON]
+
+    def _next_lot(self):
+        # Emptied lots (e.g. closed by a specific sell) are dropped lazily as they surface.
+        if self.method == 'hifo':
+            while self._heap and self._heap[0][2][0] <= EPSILON:
+                heapq.heappop(self._heap)
+            return self._heap[0][2] if self._heap else None
+        end = -1 if self.method == 'lifo' else 0
+        while self._lots and self._lots[end][0] <= EPSILON:
+            self._lots.pop() if end else self._lots.popleft()
+        return self._lots[end] if self._lots else None
+
+    def _take(self, lot, remaining, price):
+        sold = min(lot[0], remaining)
+        lot[0] -= sold
+        if lot[0] <= EPSILON and lot[2] is not None:
+            self._by_id.pop(lot[2], None)
+        self._reduce(sold, lot[1])
+        return sold * (price - lot[1]), remaining - sold
+
+    def _reduce(self, quantity, unit_cost):
+        self.shares -= quantity
+        self.cost -= quantity * unit_cost
+        if self.shares <= EPSILON:
+            self.shares = 0.0
+            self.cost = 0.0
+
+def replay(txns, method=DEFAULT_METHOD, splits=None):
+    """
+    Book (type, quantity, price, id, lot_id, date) trades in date order. Returns the resulting
+    LotBook and the realized gain of each trade (0 for buys), in the same order.
+    """
+    book = LotBook(method, splits)
+    gains = [book.apply(*txn) for txn in txns]
+    return book, gains
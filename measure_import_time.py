@@ -0,0 +1,47 @@
+import argparse
+import subprocess
+import sys
+
+# Each target runs in a fresh interpreter so nothing is already cached in sys.modules.
+TARGETS = {
+    'import app': 'import app',
+    'create_app()': 'from app import create_app; create_app()',
+    'helpers': 'import helpers',
+    'price_table': 'import price_table',
+}
+
+def measure(statement):
+    """
+    Run statement under `python -X importtime` and return (total_us, [(cumulative_us, module)]).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only top-level entries (no extra indentation) add up to the interpreter's total.
+        modules.append((int(cumulative), name.rstrip(), not name[1:].startswith(' ')))
+    total = sum(cumulative for cumulative, _, top_level in modules if top_level)
+    return total, [(cumulative, name.strip()) for cumulative, name, _ in modules]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report cold import time for the app's entry points.")
+    parser.add_argument('targets', nargs='*', help=f"Statements to time (default: {', '.join(TARGETS)})")
+    parser.add_argument('--top', type=int, default=10, help="Slowest modules to list per target")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per target; the fastest is reported")
+    args = parser.parse_args()
+
+    for target in args.targets or list(TARGETS):
+        statement = TARGETS.get(target, target)
+        runs = [measure(statement) for _ in range(args.runs)]
+        total, modules = min(runs, key=lambda run: run[0])
+        print(f"{target}: {total / 1000:.1f} ms")
+        for cumulative, name in sorted(modules, reverse=True)[:args.top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+if __name__ == '__main__':
+    main()
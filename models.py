@@ -9,6 +9,10 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    # Lot-selection method for sells: fifo, lifo, hifo, average or specific (see lots.py)
+    lot_method = db.Column(db.String(10), nullable=False, default='fifo')
+    # Admins maintain shared reference data, such as corporate actions on investments
+    is_admin = db.Column(db.Boolean, nullable=False, default=False)
     
     # Relationships for user-specific portfolio items
     investments_transactions = db.relationship('Transaction', backref='user', lazy=True)
@@ -28,6 +32,8 @@ class Investment(db.Model):
     description = db.Column(db.String(255), nullable=True)
     asset_class = db.Column(db.String(50), nullable=False)
     wallet_address = db.Column(db.String(255), nullable=True)
+    # Name of the feed script in Config.FEEDS_DIR that publishes this symbol's price
+    price_feed = db.Column(db.String(50), nullable=True)
     # No user-specific data – shared globally
     transactions = db.relationship('Transaction', backref='investment', lazy=True)
 
@@ -41,23 +47,31 @@ class Transaction(db.Model):
     quantity = db.Column(db.Float, nullable=False)
     broker_note = db.Column(db.String(255), nullable=True)
     quote_currency = db.Column(db.String(3), nullable=False, default='USD')
+    # On a sell under specific-lot identification, the id of the buy whose lot it closes
+    lot_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
 
 class CashAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     account_name = db.Column(db.String(50), nullable=False)
     currency = db.Column(db.String(3), nullable=False)  # USD, THB, SGD
+    # Projection of the account's ledger entries, maintained by cash_ledger.py; never set it directly.
     balance = db.Column(db.Float, default=0.0)
 
 class CashTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    transaction_type = db.Column(db.String(20), nullable=False)  # deposit, withdraw, conversion, investment_buy, investment_sell
+    transaction_type = db.Column(db.String(20), nullable=False)  # deposit, withdraw, conversion, investment_buy, investment_sell, adjustment
     from_account_id = db.Column(db.Integer, db.ForeignKey('cash_account.id'), nullable=True)
     to_account_id = db.Column(db.Integer, db.ForeignKey('cash_account.id'), nullable=True)
     amount = db.Column(db.Float, nullable=False)
     conversion_rate = db.Column(db.Float, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_cash_transaction_from_date', 'from_account_id', 'date'),
+        db.Index('ix_cash_transaction_to_date', 'to_account_id', 'date'),
+    )
+
 class Bond(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -68,18 +82,8 @@ class Bond(db.Model):
     purchase_date = db.Column(db.Date, nullable=False)
     quantity = db.Column(db.Float, nullable=False, default=0)
     cost_basis = db.Column(db.Float, default=0.0)
-
-    @property
-    def total_value(self):
-        return self.quantity * self.face_value
-
-    @property
-    def yield_to_maturity(self):
-        years_to_maturity = (self.maturity_date - date.today()).days / 365.25
-        if years_to_maturity > 0:
-            annual_coupon = self.face_value * (self.coupon_rate / 100)
-            return (annual_coupon + ((self.face_value - self.cost_basis) / years_to_maturity)) / ((self.face_value + self.cost_basis) / 2) * 100
-        return 0
+    coupon_frequency = db.Column(db.Integer, nullable=False, default=2)  # coupons per year: 1, 2, 4 or 12
+    market_price = db.Column(db.Float, nullable=True)  # latest clean price per bond; cost_basis is used when empty
 
 class Dividend(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -90,8 +94,119 @@ class Dividend(db.Model):
     note = db.Column(db.String(255), nullable=True)
 
 class ActivityLog(db.Model):
+    # Hot window only; older rows are moved to compressed archives by activity_archive.py.
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=True)
     action = db.Column(db.String(255), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     details = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (db.Index('ix_activity_log_user_timestamp', 'user_id', 'timestamp'),)
+
+class ProjectedCashFlow(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # coupon, principal, dividend
+    bond_id = db.Column(db.Integer, db.ForeignKey('bond.id'), nullable=True, index=True)
+    dividend_id = db.Column(db.Integer, db.ForeignKey('dividend.id'), nullable=True, index=True)
+    investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'), nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_projected_cash_flow_user_date', 'user_id', 'date'),)
+
+class DataVersion(db.Model):
+    # Bumped whenever any of the user's portfolio rows change; used to key derived caches.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Position(db.Model):
+    # One row per user holding; stores the quote currency fixed by the position's first trade.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'), nullable=False)
+    quote_currency = db.Column(db.String(3), nullable=False, default='USD')
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'investment_id', name='uq_position_user_investment'),)
+
+class PeriodSnapshot(db.Model):
+    # Frozen statement figures for a completed quarter or year; stale rows are recomputed on next view.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period_type = db.Column(db.String(10), nullable=False)  # yearly, quarterly
+    period_label = db.Column(db.String(20), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='USD')
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    cash = db.Column(db.Float, default=0.0)
+    investments = db.Column(db.Float, default=0.0)
+    bonds = db.Column(db.Float, default=0.0)
+    dividends = db.Column(db.Float, default=0.0)
+    realized_gain = db.Column(db.Float, default=0.0)
+    operating = db.Column(db.Float, default=0.0)
+    investing = db.Column(db.Float, default=0.0)
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'period_type', 'period_label', 'currency', name='uq_period_snapshot'),
+        db.Index('ix_period_snapshot_user_end', 'user_id', 'end_date'),
+    )
+
+class DailyFlow(db.Model):
+    # Per-user, per-day statement totals maintained by the listeners in aggregates.py.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    operating = db.Column(db.Float, nullable=False, default=0.0)
+    investing = db.Column(db.Float, nullable=False, default=0.0)
+    dividends = db.Column(db.Float, nullable=False, default=0.0)
+
+class DailyRealizedGain(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    __table_args__ = (db.Index('ix_daily_realized_gain_user_day', 'user_id', 'day'),)
+
+class HistoricalPrice(db.Model):
+    # Daily OHLCV bars loaded by 'flask backfill-prices'; the key doubles as the (symbol, date) lookup index.
+    investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    open = db.Column(db.Float, nullable=True)
+    high = db.Column(db.Float, nullable=True)
+    low = db.Column(db.Float, nullable=True)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=True)
+
+class CorporateAction(db.Model):
+    # Splits are applied when trades and prices are read (see corporate_actions.py); stored rows
+    # stay as traded. ratio is new shares per old share: 10 for a 10:1 split, 0.1 for 1:10.
+    id = db.Column(db.Integer, primary_key=True)
+    investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)  # effective date: trades and prices from this day are post-action
+    action_type = db.Column(db.String(20), nullable=False)  # split, reverse_split, symbol_change
+    ratio = db.Column(db.Float, nullable=True)
+    old_symbol = db.Column(db.String(10), nullable=True)
+    new_symbol = db.Column(db.String(10), nullable=True)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_corporate_action_investment_date', 'investment_id', 'date'),)
+
+class CashLedgerEntry(db.Model):
+    # Append-only: one signed leg per account touched by a CashTransaction. Edits and deletes
+    # append reversing legs, so the entries replayed in seq order always give the balance.
+    seq = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('cash_account.id'), nullable=False)
+    cash_transaction_id = db.Column(db.Integer, nullable=True, index=True)
+    date = db.Column(db.DateTime, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_cash_ledger_account_seq', 'account_id', 'seq'),)
+
+class CashCheckpoint(db.Model):
+    # Balance of every entry for the account up to seq; max_date is the latest effective date among them.
+    account_id = db.Column(db.Integer, db.ForeignKey('cash_account.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    max_date = db.Column(db.DateTime, nullable=False)
+    balance = db.Column(db.Float, nullable=False)
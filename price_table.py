@@ -0,0 +1,150 @@
+import mmap
+import os
+import time
+from config import Config
+
+MAGIC = b'TEMPRICE'
+LAYOUT_VERSION = 1
+SYMBOL_BYTES = 16
+HEADER_BYTES = 64
+# Header fields: magic[8], layout version u32, capacity u32, symbol count u32, pad u32, sequence u64
+HEADER_FIELDS = [('magic', 'S8'), ('version', '<u4'), ('capacity', '<u4'), ('count', '<u4'),
+                 ('pad', '<u4'), ('seq', '<u8')]
+READ_RETRIES = 100
+ATTACH_RETRY_SECONDS = 5
+
+def fx_symbol(from_currency, to_currency):
+    return f"FX:{from_currency}{to_currency}"
+
+class SharedPriceTable:
+    """
+    Fixed-layout price table in a memory-mapped file shared by every worker process.
+
+    One feed process writes; any number of workers read without locks. Writers bump the
+    sequence counter to an odd value before touching the slots and back to even afterwards,
+    and readers retry whenever they observe an odd or changed sequence (a seqlock).
+    Each slot holds (price, updated_at) and symbols map to slots through a name array that
+    only ever grows, so a reader's cached symbol-id map stays valid until the count changes.
+    """
+    def __init__(self, path, capacity=None, create=False):
+        # numpy is only needed once a table exists; get_price imports this module on every worker.
+        import numpy as np
+        self.path = path
+        if create and not os.path.exists(path):
+            self._initialise(path, capacity or Config.PRICE_TABLE_CAPACITY)
+        self._file = open(path, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self.header = np.ndarray((), dtype=HEADER_FIELDS, buffer=self._mm, offset=0)
+        if bytes(self.header['magic']) != MAGIC or int(self.header['version']) != LAYOUT_VERSION:
+            raise ValueError(f"{path} is not a price table")
+        self.capacity = int(self.header['capacity'])
+        self.names = np.ndarray((self.capacity,), dtype=f'S{SYMBOL_BYTES}', buffer=self._mm, offset=HEADER_BYTES)
+        self.values = np.ndarray((self.capacity, 2), dtype='<f8', buffer=self._mm,
+                                 offset=HEADER_BYTES + self.capacity * SYMBOL_BYTES)
+        self._ids = {}
+        self._known = 0
+        if create and int(self.header['seq']) % 2:
+            # A writer killed mid-batch left the sequence odd; there is only ever one writer, so close it.
+            self.header['seq'] += 1
+
+    @staticmethod
+    def _initialise(path, capacity):
+        import numpy as np
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        size = HEADER_BYTES + capacity * (SYMBOL_BYTES + 16)
+        header = np.zeros((), dtype=HEADER_FIELDS)
+        header['magic'] = MAGIC
+        header['version'] = LAYOUT_VERSION
+        header['capacity'] = capacity
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header.tobytes().ljust(HEADER_BYTES, b'\0'))
+            f.truncate(size)
+        os.replace(tmp_path, path)
+
+    def _refresh_ids(self):
+        count = int(self.header['count'])
+        if count != self._known:
+            for slot in range(self._known, count):
+                self._ids[self.names[slot].decode()] = slot
+            self._known = count
+
+    def slot(self, symbol):
+        self._refresh_ids()
+        return self._ids.get(symbol)
+
+    def read(self, symbol):
+        """
+        Latest (price, updated_at) for symbol, or None when the feed has never written it. If no
+        consistent read turns up within READ_RETRIES (e.g. the writer died mid-batch), the last
+        value seen is returned: each price is a single aligned 8-byte word, so it is never torn.
+        """
+        slot = self.slot(symbol)
+        if slot is None:
+            return None
+        for _ in range(READ_RETRIES):
+            before = int(self.header['seq'])
+            price, updated_at = self.values[slot]
+            if before % 2 == 0 and int(self.header['seq']) == before:
+                break
+        return float(price), float(updated_at)
+
+    def write_many(self, prices, updated_at=None):
+        """Publish a batch of symbol -> price values under a single sequence bump."""
+        updated_at = updated_at or time.time()
+        self._refresh_ids()
+        # Set the parity explicitly rather than toggling it, so one interrupted batch cannot invert it.
+        seq = int(self.header['seq']) | 1
+        self.header['seq'] = seq
+        try:
+            for symbol, price in prices.items():
+                slot = self._ids.get(symbol)
+                if slot is None:
+                    slot = self._known
+                    if slot >= self.capacity:
+                        raise ValueError("Price table is full; recreate it with a larger capacity")
+                    encoded = symbol.encode()
+                    if len(encoded) > SYMBOL_BYTES:
+                        raise ValueError(f"Symbol {symbol} is longer than {SYMBOL_BYTES} bytes")
+                    self.names[slot] = encoded
+                    self.header['count'] = slot + 1
+                    self._refresh_ids()
+                self.values[slot] = (price, updated_at)
+        finally:
+            self.header['seq'] = seq + 1
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+_table = None
+_last_attach = 0.0
+
+def get_table():
+    """
+    This process's read handle on the shared table, or None while no feed has created it yet.
+    """
+    global _table, _last_attach
+    if _table is None and time.time() - _last_attach > ATTACH_RETRY_SECONDS:
+        _last_attach = time.time()
+        if os.path.exists(Config.PRICE_TABLE_PATH):
+            try:
+                _table = SharedPriceTable(Config.PRICE_TABLE_PATH)
+            except (OSError, ValueError):
+                _table = None
+    return _table
+
+def lookup(symbol):
+    table = get_table()
+    entry = table.read(symbol) if table else None
+    return entry[0] if entry and entry[0] > 0 else None
+
+def current_sequence():
+    """
+    Sequence number of the last published batch, or None while no table exists. Odd while a batch is being written.
+    """
+    table = get_table()
+    return int(table.header['seq']) if table else None
+
+def open_writer():
+    return SharedPriceTable(Config.PRICE_TABLE_PATH, create=True)
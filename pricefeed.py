@@ -0,0 +1,227 @@
+import ast
+import math
+import multiprocessing
+import os
+import runpy
+import time
+from multiprocessing.connection import wait
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Windows: no per-process address-space limit
+    resource = None
+
+def discover_feeds(feeds_dir=None):
+    """
+    Registered feeds are the .py files in the feeds directory, keyed by file name without extension.
+    """
+    feeds_dir = feeds_dir or Config.FEEDS_DIR
+    if not os.path.isdir(feeds_dir):
+        return {}
+    return {name[:-3]: os.path.join(feeds_dir, name) for name in sorted(os.listdir(feeds_dir))
+            if name.endswith('.py') and not name.startswith('_')}
+
+def feed_interval(path, default):
+    """
+    A feed's INTERVAL constant, read from its source without executing it in the runner process.
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'INTERVAL' for t in node.targets):
+            try:
+                return max(float(ast.literal_eval(node.value)), 1.0)
+            except (ValueError, TypeError):
+                break
+    return default
+
+def _run_feed(path, memory_limit_mb, conn):
+    """Child-process entry point: run one feed script and send back its prices."""
+    try:
+        if resource is not None and memory_limit_mb:
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        namespace = runpy.run_path(path, run_name='feed')
+        prices = namespace['fetch']()
+        conn.send(('ok', {str(symbol): float(price) for symbol, price in prices.items()}))
+    except BaseException as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+class FeedStats:
+    def __init__(self, name, path, interval):
+        self.name = name
+        self.path = path
+        self.interval = interval
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.consecutive_failures = 0
+        self.last_duration = None
+        self.last_error = None
+        self.last_success = None
+        self.last_symbols = 0
+        self.next_run = 0.0
+
+    def record_success(self, duration, symbols, now):
+        self.runs += 1
+        self.last_duration = duration
+        self.last_success = now
+        self.last_symbols = symbols
+        self.consecutive_failures = 0
+        self.next_run = now + self.interval
+
+    def record_failure(self, duration, error, now, max_backoff):
+        self.runs += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_duration = duration
+        self.last_error = error
+        # Exponential backoff so a broken feed does not burn a worker every cycle.
+        self.next_run = now + min(self.interval * 2 ** self.consecutive_failures, max_backoff)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'consecutive_failures': self.consecutive_failures,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+            'last_symbols': self.last_symbols,
+        }
+
+class FeedRunner:
+    """
+    Runs every due feed script in its own short-lived process, at most max_workers at a time.
+    Each run gets a wall-clock timeout and an address-space limit, so a hanging, leaking or
+    crashing feed is killed without affecting the other feeds or the web workers, which only
+    ever read the shared price table.
+    """
+    def __init__(self, feeds_dir=None, timeout=None, memory_limit_mb=None, max_workers=None,
+                 max_backoff=None, default_interval=None):
+        self.feeds_dir = feeds_dir or Config.FEEDS_DIR
+        self.timeout = timeout or Config.FEED_TIMEOUT_SECONDS
+        self.memory_limit_mb = memory_limit_mb if memory_limit_mb is not None else Config.FEED_MEMORY_LIMIT_MB
+        self.max_workers = max_workers or Config.FEED_MAX_WORKERS
+        self.max_backoff = max_backoff or Config.FEED_MAX_BACKOFF_SECONDS
+        self.default_interval = default_interval or Config.FEED_DEFAULT_INTERVAL
+        self.feeds = {}
+        self.reload()
+
+    def reload(self, now=None):
+        """
+        Pick up added, removed or edited feed scripts, keeping the stats of unchanged ones. A
+        script that cannot be read or parsed would only fail in its worker, so while it is due
+        it is recorded as a failed run instead, and backs off like any other failing feed.
+        """
+        now = now or time.time()
+        found = discover_feeds(self.feeds_dir)
+        for name in set(self.feeds) - set(found):
+            del self.feeds[name]
+        for name, path in found.items():
+            try:
+                interval, error = feed_interval(path, self.default_interval), None
+            except (SyntaxError, ValueError, OSError) as e:
+                interval, error = self.default_interval, f"{type(e).__name__}: {e}"
+            if name in self.feeds:
+                self.feeds[name].interval = interval
+            else:
+                self.feeds[name] = FeedStats(name, path, interval)
+            if error and self.feeds[name].next_run <= now:
+                self.feeds[name].record_failure(0.0, error, now, self.max_backoff)
+
+    def due(self, now):
+        return [feed for feed in self.feeds.values() if feed.next_run <= now]
+
+    def next_due(self):
+        return min((feed.next_run for feed in self.feeds.values()), default=None)
+
+    def run_cycle(self, subscriptions, now=None):
+        """
+        Run every due feed and return the merged prices they published for their subscribers.
+        subscriptions maps symbol -> feed name; FX symbols are accepted from any feed.
+        """
+        now = now or time.time()
+        pending = self.due(now)
+        running = {}
+        prices = {}
+        while pending or running:
+            while pending and len(running) < self.max_workers:
+                feed = pending.pop(0)
+                reader, writer = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_run_feed, name=f'feed-{feed.name}',
+                                                  args=(feed.path, self.memory_limit_mb, writer), daemon=True)
+                process.start()
+                writer.close()
+                running[reader] = (feed, process, time.monotonic())
+            deadline = min(started for _, _, started in running.values()) + self.timeout
+            ready = wait(list(running), timeout=max(deadline - time.monotonic(), 0))
+            for reader in ready:
+                feed, process, started = running.pop(reader)
+                try:
+                    status, payload = reader.recv()
+                except EOFError:
+                    status, payload = 'error', None
+                reader.close()
+                process.join(1)
+                if payload is None:
+                    payload = f"Feed process exited with code {process.exitcode}"
+                self._record(feed, status, payload, time.monotonic() - started, subscriptions, prices)
+            for reader, (feed, process, started) in list(running.items()):
+                if time.monotonic() - started >= self.timeout:
+                    process.kill()
+                    process.join()
+                    reader.close()
+                    del running[reader]
+                    feed.timeouts += 1
+                    feed.record_failure(time.monotonic() - started, f"Timed out after {self.timeout}s",
+                                        time.time(), self.max_backoff)
+        return prices
+
+    def _record(self, feed, status, payload, duration, subscriptions, prices):
+        if status != 'ok':
+            feed.record_failure(duration, payload, time.time(), self.max_backoff)
+            return
+        accepted = {symbol: price for symbol, price in payload.items()
+                    if math.isfinite(price) and price > 0
+                    and (subscriptions.get(symbol) == feed.name or symbol.startswith('FX:'))}
+        prices.update(accepted)
+        feed.record_success(duration, len(accepted), time.time())
+
+    def stats(self):
+        return [feed.as_dict() for feed in self.feeds.values()]
+
+def load_subscriptions():
+    from models import db, Investment
+    rows = Investment.query.with_entities(Investment.symbol, Investment.price_feed).filter(
+        Investment.price_feed.isnot(None)).all()
+    # Release the connection so the long-running loop never holds a read transaction open.
+    db.session.remove()
+    return {symbol: feed for symbol, feed in rows}
+
+def run_feeds(once=False, log=print):
+    """
+    Feed loop: run due feeds, publish their merged output to the shared price table in one
+    batched write per cycle, then sleep until the next feed is due. Needs an app context.
+    """
+    from price_table import open_writer
+    runner = FeedRunner()
+    table = open_writer()
+    while True:
+        runner.reload()
+        prices = runner.run_cycle(load_subscriptions())
+        if prices:
+            table.write_many(prices)
+        log(f"Published {len(prices)} prices from {len(runner.feeds)} feeds.")
+        for stat in runner.stats():
+            if stat['last_error'] and stat['consecutive_failures']:
+                log(f"  {stat['name']}: {stat['consecutive_failures']} consecutive failures, last: {stat['last_error']}")
+        if once:
+            return runner
+        next_due = runner.next_due()
+        time.sleep(max((next_due or time.time() + runner.default_interval) - time.time(), 0.5))
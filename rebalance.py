@@ -0,0 +1,155 @@
+import numpy as np
+from models import Transaction
+from helpers import get_price, convert_currency, get_quote_currencies, get_investments, get_cash_accounts, get_lot_method
+from lots import replay
+from corporate_actions import split_factors
+
+GROUPINGS = ('asset_class', 'symbol')
+MAX_SCENARIOS = 1000
+
+def open_lots(user_id, investment_id):
+    """
+    Lots still held for a position, in the order the user's lot method sells them, as (quantities, unit costs) arrays.
+    """
+    txns = Transaction.query.with_entities(Transaction.transaction_type, Transaction.quantity,
+                                           Transaction.transaction_price, Transaction.id, Transaction.lot_id,
+                                           Transaction.date).filter_by(
+        user_id=user_id, investment_id=investment_id).order_by(Transaction.date, Transaction.id).all()
+    book, _ = replay(txns, get_lot_method(user_id), split_factors(investment_id))
+    lots = book.open_lots()
+    return (np.array([l[0] for l in lots], dtype=float), np.array([l[1] for l in lots], dtype=float))
+
+def load_portfolio(user_id, extra_symbols=()):
+    """
+    Current positions priced in USD, with their open lots, and cash balances per currency.
+    extra_symbols adds zero-share positions so scenarios can buy investments not yet held.
+    """
+    quote_currencies = get_quote_currencies(user_id)
+    extra_symbols = set(extra_symbols)
+    positions = []
+    for inv in sorted(get_investments(), key=lambda inv: inv.symbol):
+        quantities, costs = open_lots(user_id, inv.id)
+        shares = float(quantities.sum())
+        if shares <= 0 and inv.symbol not in extra_symbols:
+            continue
+        currency = quote_currencies.get(inv.id, 'USD')
+        price = get_price(inv.symbol)
+        positions.append({
+            'id': inv.id,
+            'symbol': inv.symbol,
+            'asset_class': inv.asset_class,
+            'currency': currency,
+            'shares': shares,
+            'price': price,
+            'usd_rate': convert_currency(1, currency, 'USD'),
+            'lots': (quantities, costs),
+        })
+    cash = {}
+    for account in get_cash_accounts(user_id):
+        cash[account.currency] = cash.get(account.currency, 0) + account.balance
+    return {'positions': positions, 'cash': cash}
+
+def _scenario_matrix(scenarios, groups, current_weights):
+    """
+    Target weight per group for each scenario. Groups a scenario leaves out keep their current
+    weight, and every row is normalised to sum to one.
+    """
+    index = {g: i for i, g in enumerate(groups)}
+    weights = np.tile(current_weights, (len(scenarios), 1))
+    for row, scenario in enumerate(scenarios):
+        for group, weight in scenario.items():
+            if group in index:
+                weights[row, index[group]] = max(float(weight), 0.0)
+    totals = weights.sum(axis=1, keepdims=True)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+def simulate(portfolio, scenarios, by='asset_class', min_trade=1.0):
+    """
+    Evaluate every target-weight scenario in one batch.
+
+    Each position's target value is its group's target weight times the invested total, split
+    within the group in proportion to current value (evenly for a group not held yet). Trades
+    smaller than min_trade (USD) are dropped, so only the trades needed to move the book are
+    listed. Sells realise gains against lots in the order the user's lot method sells them;
+    interpolating over cumulative lot quantities gives the cost of any sold quantity for all
+    scenarios at once.
+    """
+    positions = portfolio['positions']
+    if not positions or not scenarios:
+        return {'groups': [], 'current_weights': [], 'results': []}
+    scenarios = scenarios[:MAX_SCENARIOS]
+    shares = np.array([p['shares'] for p in positions])
+    prices = np.array([p['price'] for p in positions])
+    rates = np.array([p['usd_rate'] for p in positions])
+    values = shares * prices * rates
+    total = values.sum()
+
+    keys = [p[by] for p in positions]
+    groups = sorted(set(keys))
+    membership = np.zeros((len(positions), len(groups)))
+    membership[np.arange(len(positions)), [groups.index(k) for k in keys]] = 1.0
+    group_values = values @ membership
+    current_weights = group_values / total if total > 0 else np.zeros(len(groups))
+    held = group_values @ membership.T
+    even_split = 1.0 / (membership.sum(axis=0) @ membership.T)
+    within_group = np.divide(values, held, out=even_split, where=held > 0)
+
+    targets = _scenario_matrix(scenarios, groups, current_weights)  # (scenarios, groups)
+    target_values = (targets @ membership.T) * within_group * total  # (scenarios, positions)
+    trade_values = target_values - values
+    trade_values[np.abs(trade_values) < min_trade] = 0.0
+    trade_shares = np.divide(trade_values, prices * rates, out=np.zeros_like(trade_values), where=prices * rates > 0)
+    trade_shares = np.maximum(trade_shares, -shares)
+
+    sold = np.maximum(-trade_shares, 0.0)
+    realized = np.zeros_like(sold)
+    for i, p in enumerate(positions):
+        quantities, costs = p['lots']
+        cum_qty = np.concatenate([[0.0], np.cumsum(quantities)])
+        cum_cost = np.concatenate([[0.0], np.cumsum(quantities * costs)])
+        realized[:, i] = (sold[:, i] * prices[i] - np.interp(sold[:, i], cum_qty, cum_cost)) * rates[i]
+
+    # Sells credit and buys debit the cash held in each position's quote currency.
+    currencies = sorted({p['currency'] for p in positions} | set(portfolio['cash']))
+    currency_of = np.zeros((len(positions), len(currencies)))
+    currency_of[np.arange(len(positions)), [currencies.index(p['currency']) for p in positions]] = 1.0
+    cash_deltas = -(trade_shares * prices) @ currency_of  # native currency amounts
+
+    traded_values = trade_shares * prices * rates
+    new_values = values + traded_values
+    new_group_values = new_values @ membership
+    new_totals = new_group_values.sum(axis=1, keepdims=True)
+    new_weights = np.divide(new_group_values, new_totals, out=np.zeros_like(new_group_values), where=new_totals > 0)
+
+    results = []
+    for s in range(len(targets)):
+        trades = [{
+            'symbol': positions[i]['symbol'],
+            'side': 'Buy' if trade_shares[s, i] > 0 else 'Sell',
+            'shares': round(abs(float(trade_shares[s, i])), 6),
+            'value': round(abs(float(trade_shares[s, i] * prices[i])), 2),
+            'currency': positions[i]['currency'],
+            'realized_gain': round(float(realized[s, i]), 2),
+        } for i in np.flatnonzero(trade_shares[s])]
+        cash = {}
+        for c, currency in enumerate(currencies):
+            balance = portfolio['cash'].get(currency, 0.0)
+            cash[currency] = {
+                'change': round(float(cash_deltas[s, c]), 2),
+                'balance_after': round(balance + float(cash_deltas[s, c]), 2),
+            }
+        results.append({
+            'target_weights': [round(float(w), 4) for w in targets[s]],
+            'resulting_weights': [round(float(w), 4) for w in new_weights[s]],
+            'trades': trades,
+            'turnover': round(float(np.abs(traded_values[s]).sum()), 2),
+            'realized_gain': round(float(realized[s].sum()), 2),
+            'cash': cash,
+            'cash_shortfall': any(v['balance_after'] < 0 for v in cash.values()),
+        })
+    return {
+        'groups': groups,
+        'current_weights': [round(float(w), 4) for w in current_weights],
+        'total_value': round(float(total), 2),
+        'results': results,
+    }
@@ -0,0 +1,35 @@
+from itertools import chain
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import User, Investment, CashAccount, CashTransaction, Position, CorporateAction
+
+# Rows the memoized lookups are read from; flushing any of them invalidates the memo.
+SOURCES = (User, Investment, CashAccount, CashTransaction, Position, CorporateAction)
+
+def memoize(key, compute):
+    """
+    Return compute() once per app context (i.e. per request) for a given key. Outside an app
+    context nothing is cached. Flushing a source row, committing or rolling back clears the
+    memo, so a request never sees reference data older than its own writes.
+    """
+    if not has_app_context():
+        return compute()
+    memo = g.setdefault('_request_memo', {})
+    if key not in memo:
+        memo[key] = compute()
+    return memo[key]
+
+def clear():
+    if has_app_context():
+        g.pop('_request_memo', None)
+
+@event.listens_for(Session, 'after_flush')
+def _clear_after_flush(session, flush_context):
+    if any(isinstance(obj, SOURCES) for obj in chain(session.new, session.dirty, session.deleted)):
+        clear()
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _clear_after_transaction(session):
+    clear()
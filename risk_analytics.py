@@ -0,0 +1,140 @@
+from datetime import date, timedelta
+from statistics import NormalDist
+import numpy as np
+from cache import LRUCache
+from helpers import get_history_price, price_history_version
+
+TRADING_DAYS = 252
+LOOKBACK_CHOICES = [30, 90, 180, 365, 730, 1825]
+
+# Return matrices are shared by every user holding the same universe on the same day.
+_universe_cache = LRUCache(maxsize=128)
+
+def load_price_matrix(symbols, start_date, end_date):
+    """
+    Load closing prices for the symbols and align them on the dates all of them have.
+    Returns (dates, prices) where prices has one column per symbol.
+    """
+    series = []
+    for symbol in symbols:
+        history = get_history_price(symbol, start_date, end_date)
+        series.append({row['date']: row['close'] for row in history})
+    common_dates = sorted(set.intersection(*(set(s) for s in series))) if series else []
+    prices = np.array([[s[d] for s in series] for d in common_dates], dtype=float)
+    return common_dates, prices.reshape(len(common_dates), len(symbols))
+
+def get_universe_stats(symbols, as_of, lookback_days):
+    """
+    Daily returns, covariance and correlation for a symbol set, cached per (symbols, as_of, lookback)
+    until a backfill or a corporate action changes the stored, split-adjusted prices.
+    """
+    key = (tuple(sorted(set(symbols))), as_of, lookback_days, price_history_version())
+    return _universe_cache.get_or_compute(key, lambda: _compute_universe_stats(key[0], as_of, lookback_days))
+
+def _compute_universe_stats(symbols, as_of, lookback_days):
+    dates, prices = load_price_matrix(symbols, as_of - timedelta(days=lookback_days), as_of)
+    if len(dates) > 1:
+        returns = np.diff(prices, axis=0) / prices[:-1]
+    else:
+        returns = np.zeros((0, len(symbols)))
+    if returns.shape[0] > 1:
+        cov = np.atleast_2d(np.cov(returns, rowvar=False))
+    else:
+        cov = np.zeros((len(symbols), len(symbols)))
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.outer(std, std)
+    corr = np.nan_to_num(corr)
+    np.fill_diagonal(corr, 1.0)
+    return {
+        'symbols': list(symbols),
+        'index': {s: i for i, s in enumerate(symbols)},
+        'dates': dates,
+        'prices': prices,
+        'returns': returns,
+        'cov': cov,
+        'corr': corr,
+    }
+
+def max_drawdown(values):
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return 0.0
+    peaks = np.maximum.accumulate(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, values / peaks - 1, 0.0)
+    return float(-drawdowns.min())
+
+def value_at_risk(returns, confidence):
+    """
+    Historical and parametric one-day VaR/CVaR as positive loss fractions.
+    """
+    returns = np.asarray(returns, dtype=float)
+    if returns.size == 0:
+        return {'hist_var': 0.0, 'hist_cvar': 0.0, 'param_var': 0.0, 'param_cvar': 0.0}
+    cutoff = np.percentile(returns, (1 - confidence) * 100)
+    tail = returns[returns <= cutoff]
+    mu = returns.mean()
+    sigma = returns.std(ddof=1) if returns.size > 1 else 0.0
+    z = NormalDist().inv_cdf(1 - confidence)
+    return {
+        'hist_var': float(max(-cutoff, 0.0)),
+        'hist_cvar': float(max(-tail.mean(), 0.0)) if tail.size else 0.0,
+        'param_var': float(max(-(mu + z * sigma), 0.0)),
+        'param_cvar': float(max(sigma * NormalDist().pdf(z) / (1 - confidence) - mu, 0.0)),
+    }
+
+def portfolio_risk(holdings, benchmark, lookback_days, confidence=0.95, as_of=None):
+    """
+    holdings maps symbol -> (shares, value, fx rate), the rate converting the symbol's quote
+    currency into the currency of value. Weights come from the current values and the
+    historical path uses today's share counts, so the result describes the current book.
+    """
+    as_of = as_of or date.today()
+    symbols = sorted(s for s, (shares, value, rate) in holdings.items() if value > 0)
+    if not symbols:
+        return None
+    universe = symbols + ([benchmark] if benchmark and benchmark not in symbols else [])
+    stats = get_universe_stats(universe, as_of, lookback_days)
+    idx = np.array([stats['index'][s] for s in symbols])
+    values = np.array([holdings[s][1] for s in symbols], dtype=float)
+    shares = np.array([holdings[s][0] for s in symbols], dtype=float)
+    rates = np.array([holdings[s][2] for s in symbols], dtype=float)
+    total_value = float(values.sum())
+    weights = values / total_value
+
+    cov = stats['cov'][np.ix_(idx, idx)]
+    asset_vol = np.sqrt(np.diag(cov) * TRADING_DAYS)
+    portfolio_vol = float(np.sqrt(max(weights @ cov @ weights, 0.0) * TRADING_DAYS))
+    returns = stats['returns'][:, idx]
+    portfolio_returns = returns @ weights
+
+    asset_beta = np.zeros(len(symbols))
+    portfolio_beta = 0.0
+    if benchmark:
+        b = stats['index'][benchmark]
+        bench_var = stats['cov'][b, b]
+        if bench_var > 0:
+            asset_beta = stats['cov'][idx, b] / bench_var
+            portfolio_beta = float(weights @ asset_beta)
+
+    var = value_at_risk(portfolio_returns, confidence)
+    # Prices are in each symbol's quote currency; convert before summing across the book.
+    path = stats['prices'][:, idx] @ (shares * rates) if len(stats['dates']) else np.array([])
+    return {
+        'symbols': symbols,
+        'weights': [round(float(w) * 100, 2) for w in weights],
+        'asset_volatility': [round(float(v) * 100, 2) for v in asset_vol],
+        'asset_beta': [round(float(b), 3) for b in asset_beta],
+        'correlation': [[round(float(x), 3) for x in row] for row in stats['corr'][np.ix_(idx, idx)]],
+        'covariance': [[float(x) for x in row] for row in cov],
+        'portfolio_volatility': round(portfolio_vol * 100, 2),
+        'portfolio_beta': round(portfolio_beta, 3),
+        'hist_var': round(var['hist_var'] * total_value, 2),
+        'hist_cvar': round(var['hist_cvar'] * total_value, 2),
+        'param_var': round(var['param_var'] * total_value, 2),
+        'param_cvar': round(var['param_cvar'] * total_value, 2),
+        'max_drawdown': round(max_drawdown(path) * 100, 2),
+        'observations': int(returns.shape[0]),
+        'total_value': round(float(total_value), 2),
+    }
@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, literal
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from models import db
+
+def _add_column_sql(table, column, dialect):
+    """ALTER TABLE ... ADD COLUMN for a model column; existing rows take its scalar default, if it has one."""
+    table_name = dialect.identifier_preparer.format_table(table)
+    sql = f"ALTER TABLE {table_name} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"
+    if column.default is not None and column.default.is_scalar:
+        default = literal(column.default.arg).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        sql += f" DEFAULT {default}"
+    return sql
+
+def upgrade_schema():
+    """
+    Bring a database created by an older version up to the models: create missing tables, add
+    missing columns with ALTER TABLE ... ADD COLUMN and create missing indexes. Existing rows and
+    columns are never changed, so it is safe to run repeatedly. Returns the statements run.
+    """
+    conn = db.session.connection()
+    dialect = conn.dialect
+    existing = inspect(conn)
+    missing_tables = [table for table in db.metadata.sorted_tables if not existing.has_table(table.name)]
+    db.metadata.create_all(conn, tables=missing_tables)
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if table in missing_tables:
+            continue
+        columns = {column['name'] for column in existing.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                statements.append(_add_column_sql(table, column, dialect))
+        indexes = {index['name'] for index in existing.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                statements.append(str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)))
+    for sql in statements:
+        conn.exec_driver_sql(sql)
+    db.session.commit()
+    return [f"CREATE TABLE {table.name}" for table in missing_tables] + statements
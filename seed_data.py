@@ -1,7 +1,10 @@
 from datetime import datetime, date, timedelta
-from app import app, db
-from models import User, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend, ActivityLog
-from helpers import compute_user_investment
+from app import create_app
+from models import db, User, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend, ActivityLog
+from helpers import compute_user_investment, rebuild_positions
+from cashflow_calendar import rebuild_user_calendar
+
+app = create_app()
 
 with app.app_context():
     # Start fresh: drop all tables then create them again
@@ -11,19 +14,25 @@ with app.app_context():
     # ----------------------------------------------------------
     # Create a test user for authentication testing.
     # ----------------------------------------------------------
-    user1 = User(username="testuser")
+    user1 = User(username="testuser", is_admin=True)
     user1.set_password("password")
     db.session.add(user1)
     db.session.commit()  # Commit to obtain user1.id
 
     # ----------------------------------------------------------
-    # Create Cash Accounts in different currencies.
+    # Create Cash Accounts in different currencies. Balances come from the
+    # cash ledger, so each account is opened with a deposit.
     # ----------------------------------------------------------
-    cash1 = CashAccount(account_name="Main Account", currency="USD", balance=10000, user_id=user1.id)
-    cash2 = CashAccount(account_name="Savings Account", currency="THB", balance=50000, user_id=user1.id)
-    cash3 = CashAccount(account_name="Crypto Wallet", currency="SGD", balance=2000, user_id=user1.id)
+    cash1 = CashAccount(account_name="Main Account", currency="USD", user_id=user1.id)
+    cash2 = CashAccount(account_name="Savings Account", currency="THB", user_id=user1.id)
+    cash3 = CashAccount(account_name="Crypto Wallet", currency="SGD", user_id=user1.id)
     db.session.add_all([cash1, cash2, cash3])
     db.session.commit()
+    db.session.add_all([
+        CashTransaction(date=datetime(2022, 1, 1), transaction_type="deposit", to_account_id=acc.id, amount=amount)
+        for acc, amount in ((cash1, 10000), (cash2, 50000), (cash3, 2000))
+    ])
+    db.session.commit()
 
     # ----------------------------------------------------------
     # Create Investments (shared across users)
@@ -225,6 +234,18 @@ with app.app_context():
     db.session.add_all([ct1, ct2, ct3, ct4, ct5, ct6, ct7, ct8])
     db.session.commit()
 
+    # ----------------------------------------------------------
+    # Record each position's quote currency from its first trade.
+    # ----------------------------------------------------------
+    rebuild_positions()
+    db.session.commit()
+
+    # ----------------------------------------------------------
+    # Expand bond coupons and declared dividends into the projected cash-flow calendar.
+    # ----------------------------------------------------------
+    rebuild_user_calendar(user1.id)
+    db.session.commit()
+
     # ----------------------------------------------------------
     # Create an Activity Log entry for auditing.
     # ----------------------------------------------------------
@@ -0,0 +1,153 @@
+from datetime import date, datetime
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import (db, User, Investment, Transaction, CashAccount, CashTransaction, Bond, Dividend, PeriodSnapshot,
+                    CorporateAction)
+from helpers import (
+    calculate_cash_balance_as_of,
+    compute_user_investment,
+    convert_amounts,
+    get_price_as_of,
+    get_cash_accounts,
+    get_investments,
+    get_quote_currencies
+)
+from bond_analytics import analyze_bonds
+from aggregates import period_totals
+
+FIGURES = ('cash', 'investments', 'bonds', 'dividends', 'realized_gain', 'operating', 'investing')
+
+def is_closed(label, end_date):
+    return end_date < date.today() and '(YTD)' not in label
+
+def compute_balance_sheet(user_id, end_date, currency):
+    cash_accounts = get_cash_accounts(user_id)
+    cash = convert_amounts(((calculate_cash_balance_as_of(acc, end_date), acc.currency) for acc in cash_accounts), currency)
+    quote_currencies = get_quote_currencies(user_id)
+    positions = []
+    for inv in get_investments():
+        shares, _ = compute_user_investment(inv, user_id, as_of=end_date)
+        if shares:
+            positions.append((shares * get_price_as_of(inv.symbol, end_date), quote_currencies.get(inv.id, 'USD')))
+    bonds_list = Bond.query.filter(Bond.purchase_date <= end_date, Bond.user_id == user_id).all()
+    bond_values = ((a['market_value'], 'USD') for a in analyze_bonds(bonds_list, as_of=end_date).values())
+    return {
+        'cash': cash,
+        'investments': convert_amounts(positions, currency),
+        'bonds': convert_amounts(bond_values, currency),
+    }
+
+def compute_period(user_id, start_date, end_date, currency, totals=None):
+    figures = compute_balance_sheet(user_id, end_date, currency)
+    figures.update(totals or period_totals(user_id, [('period', start_date, end_date)])[0])
+    return figures
+
+def get_statement_figures(user_id, period_type, periods, currency='USD'):
+    """
+    Figures for each (label, start, end) period. Completed periods are read from their frozen
+    snapshot, computing and storing it the first time or after a back-dated change marked it stale.
+    Only the open period is computed live on every request.
+    """
+    closed_labels = [label for label, s, e in periods if is_closed(label, e)]
+    snapshots = {}
+    if closed_labels:
+        snapshots = {snap.period_label: snap for snap in PeriodSnapshot.query.filter(
+            PeriodSnapshot.user_id == user_id,
+            PeriodSnapshot.period_type == period_type,
+            PeriodSnapshot.currency == currency,
+            PeriodSnapshot.period_label.in_(closed_labels)
+        ).all()}
+    def needs_compute(label, end_date):
+        snap = snapshots.get(label)
+        return not is_closed(label, end_date) or snap is None or snap.stale
+    # Flow totals for every period that is not served from a snapshot, in one round trip.
+    pending = [period for period in periods if needs_compute(period[0], period[2])]
+    totals = dict(zip((label for label, _, _ in pending), period_totals(user_id, pending)))
+    results = []
+    frozen = False
+    for label, start_date, end_date in periods:
+        if not is_closed(label, end_date):
+            results.append(compute_period(user_id, start_date, end_date, currency, totals[label]))
+            continue
+        snap = snapshots.get(label)
+        if snap is None or snap.stale:
+            results.append(close_period(user_id, period_type, label, start_date, end_date, currency, totals[label]))
+            frozen = True
+        else:
+            results.append({name: getattr(snap, name) for name in FIGURES})
+    if frozen:
+        db.session.commit()
+    return results
+
+def close_period(user_id, period_type, label, start_date, end_date, currency, totals=None):
+    """
+    Compute a completed period and store it as its snapshot. Two workers may freeze the same period
+    at once, so the row is upserted on its unique key rather than inserted.
+    """
+    figures = compute_period(user_id, start_date, end_date, currency, totals)
+    values = {name: figures[name] for name in FIGURES}
+    values.update(stale=False, computed_at=datetime.utcnow())
+    table = PeriodSnapshot.__table__
+    db.session.execute(sqlite_insert(table).values(
+        user_id=user_id, period_type=period_type, period_label=label, currency=currency,
+        start_date=start_date, end_date=end_date, **values
+    ).on_conflict_do_update(index_elements=['user_id', 'period_type', 'period_label', 'currency'], set_=values))
+    return {name: figures[name] for name in FIGURES}
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _changed_dates(session):
+    """
+    Earliest affected date per user for rows being written, using both old and new dates
+    so that moving a row out of a closed period also reopens it.
+    """
+    changes = {}
+    def touch(user_id, *values):
+        dates = [_as_date(v) for v in values if v is not None]
+        if user_id is not None and dates:
+            changes[user_id] = min(dates + ([changes[user_id]] if user_id in changes else []))
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            # A new lot method restates realized gains in every period, however old.
+            if obj.id is not None and inspect(obj).attrs.lot_method.history.has_changes():
+                touch(obj.id, date.min)
+            continue
+        if isinstance(obj, CorporateAction):
+            # Splits and ticker changes restate every holder's shares and prices, in every period.
+            for user_id in session.execute(select(Transaction.user_id).where(
+                    Transaction.investment_id == obj.investment_id).distinct()).scalars():
+                touch(user_id, date.min)
+            continue
+        if isinstance(obj, (Transaction, Dividend, CashTransaction)):
+            field = 'date'
+        elif isinstance(obj, Bond):
+            field = 'purchase_date'
+        else:
+            continue
+        history = inspect(obj).attrs[field].history
+        values = [getattr(obj, field)] + list(history.deleted)
+        if isinstance(obj, CashTransaction):
+            for account_id in (obj.from_account_id, obj.to_account_id):
+                account = session.get(CashAccount, account_id) if account_id else None
+                if account:
+                    touch(account.user_id, *values)
+        else:
+            touch(obj.user_id, *values)
+    return changes
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_dates(session, flush_context, instances):
+    pending = session.info.setdefault('snapshot_changes', {})
+    for user_id, changed in _changed_dates(session).items():
+        pending[user_id] = min(changed, pending.get(user_id, changed))
+
+@event.listens_for(Session, 'after_flush')
+def _mark_snapshots_stale(session, flush_context):
+    changes = session.info.pop('snapshot_changes', {})
+    table = PeriodSnapshot.__table__
+    conn = session.connection() if changes else None
+    for user_id, changed in changes.items():
+        if changed < date.today():
+            conn.execute(update(table).where(table.c.user_id == user_id, table.c.end_date >= changed).values(stale=True))
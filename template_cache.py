@@ -0,0 +1,35 @@
+from datetime import date
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from cache import LRUCache
+from data_version import get_data_version
+from helpers import price_history_version
+import price_table
+
+_fragments = LRUCache(maxsize=1024)
+
+class FragmentCacheExtension(Extension):
+    """
+    {% cache 'name', param, ... %}...{% endcache %} renders the block once and then serves it
+    from a per-worker cache. The key always includes the template and line, the user's data
+    version, the price table sequence, the stored price history and today's date, so a fragment
+    is reused only while nothing it could show has changed; the listed params add whatever else
+    the block depends on.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [nodes.Const(parser.name), nodes.Const(lineno), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        if not current_user.is_authenticated:
+            return caller()
+        key = (current_user.id, get_data_version(current_user.id), price_table.current_sequence(),
+               price_history_version(), date.today(), repr(parts))
+        return _fragments.get_or_compute(key, caller)
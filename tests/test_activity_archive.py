@@ -0,0 +1,23 @@
+import os
+from datetime import datetime
+from models import db, ActivityLog
+from activity_archive import archive_activity, query_activity, _partitions, _append
+
+def test_archives_are_split_by_user(app, tmp_path):
+    archive_dir = str(tmp_path)
+    db.session.add_all([ActivityLog(user_id=1, action='Old', timestamp=datetime(2024, 1, 5)),
+                        ActivityLog(user_id=2, action='Old', timestamp=datetime(2024, 1, 6)),
+                        ActivityLog(user_id=1, action='Recent', timestamp=datetime(2024, 6, 1))])
+    db.session.commit()
+    # An archive written before the split by user still sits directly under the archive root.
+    _append(os.path.join(archive_dir, '2023', 'activity-2023-12.jsonl.gz'),
+            [{'id': 99, 'user_id': 1, 'action': 'Legacy', 'timestamp': '2023-12-01T00:00:00', 'details': None}])
+
+    assert archive_activity(now=datetime(2024, 6, 2), hot_days=30, archive_dir=archive_dir) == 2
+
+    assert [os.path.relpath(p, archive_dir) for p in _partitions(archive_dir, None, None, user_id=1)] == [
+        os.path.join('2023', 'activity-2023-12.jsonl.gz'), os.path.join('user-1', '2024', 'activity-2024-01.jsonl.gz')]
+    assert [e['action'] for e in query_activity(user_id=1, archive_dir=archive_dir)] == ['Recent', 'Old', 'Legacy']
+    assert [e['action'] for e in query_activity(user_id=1, archive_dir=archive_dir, include_archive=False)] == [
+        'Recent']
+    assert len(query_activity(archive_dir=archive_dir)) == 4
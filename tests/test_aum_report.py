@@ -0,0 +1,19 @@
+from datetime import date
+import pytest
+from models import db, User, Investment, Transaction
+from helpers import get_price
+from aum_report import report_range
+
+def test_investment_created_after_the_price_map_is_priced_late(app):
+    user = User(username='aum')
+    user.set_password('password')
+    investment = Investment(symbol='LATE', asset_class='Stock')
+    db.session.add_all([user, investment])
+    db.session.flush()
+    db.session.add(Transaction(user_id=user.id, investment_id=investment.id, date=date(2024, 1, 2),
+                               transaction_type='Buy', transaction_price=10, quantity=3))
+    db.session.commit()
+
+    partial = report_range(user.id, user.id, {})
+
+    assert partial['investments'][investment.id][1] == pytest.approx(3 * get_price('LATE'))
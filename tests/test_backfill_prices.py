@@ -0,0 +1,47 @@
+from datetime import date
+from models import db, Investment, HistoricalPrice
+from backfill_prices import backfill_files
+from helpers import price_history_version, get_history_price
+
+def test_rerun_fills_gaps_and_rejects_malformed_rows(app, tmp_path):
+    db.session.add(Investment(symbol='GAP', asset_class='Stock'))
+    db.session.commit()
+    first = tmp_path / 'first.csv'
+    first.write_text("date,close\n2024-01-01,10\n2024-01-05,14\n", encoding='utf-8')
+    full = tmp_path / 'full.csv'
+    full.write_text("date,close\n2024-01-01,10\n2024-01-02,11\nnot-a-date,1\n2024-01-03,1O\n"
+                    "2024-01-04,13\n2024-01-05,14\n", encoding='utf-8')
+
+    assert backfill_files([str(first)], symbol='GAP')['inserted'] == 2
+    stats = backfill_files([str(full)], symbol='GAP')
+
+    assert (stats['inserted'], stats['duplicates'], stats['rejected']) == (2, 2, 2)
+    assert [row.date for row in HistoricalPrice.query.order_by(HistoricalPrice.date)] == [
+        date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 4), date(2024, 1, 5)]
+
+def test_backfill_moves_price_history_version(app, tmp_path):
+    db.session.add(Investment(symbol='VER', asset_class='Stock'))
+    db.session.commit()
+    bars = tmp_path / 'VER.csv'
+    bars.write_text("date,close\n2024-01-01,10\n", encoding='utf-8')
+    before = price_history_version()
+
+    backfill_files([str(bars)])
+    loaded = price_history_version()
+    backfill_files([str(bars)])
+
+    assert loaded != before
+    assert price_history_version() == loaded
+
+def test_history_for_a_shared_ticker_comes_from_one_investment(app):
+    first, second = Investment(symbol='DUP', asset_class='Stock'), Investment(symbol='DUP', asset_class='Stock')
+    db.session.add_all([first, second])
+    db.session.flush()
+    db.session.add_all([HistoricalPrice(investment_id=first.id, date=date(2024, 1, 1), close=10),
+                        HistoricalPrice(investment_id=second.id, date=date(2024, 1, 2), close=500),
+                        HistoricalPrice(investment_id=first.id, date=date(2024, 1, 3), close=11)])
+    db.session.commit()
+
+    history = get_history_price('DUP', date(2024, 1, 1), date(2024, 1, 3))
+
+    assert [(bar['date'], bar['close']) for bar in history] == [('2024-01-01', 10), ('2024-01-03', 11)]
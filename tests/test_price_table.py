@@ -0,0 +1,17 @@
+from price_table import SharedPriceTable
+
+def test_writer_restart_after_interrupted_batch(tmp_path):
+    path = str(tmp_path / 'prices.bin')
+    writer = SharedPriceTable(path, capacity=8, create=True)
+    writer.write_many({'AAA': 10.0}, updated_at=1.0)
+    writer.header['seq'] += 1  # killed mid-batch: the sequence is left odd
+    writer.close()
+
+    reader = SharedPriceTable(path)
+    assert reader.read('AAA') == (10.0, 1.0)
+
+    writer = SharedPriceTable(path, create=True)
+    assert int(writer.header['seq']) % 2 == 0
+    writer.write_many({'AAA': 11.0}, updated_at=2.0)
+    assert int(writer.header['seq']) % 2 == 0
+    assert reader.read('AAA') == (11.0, 2.0)
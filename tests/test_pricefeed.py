@@ -0,0 +1,22 @@
+import time
+from pricefeed import FeedRunner
+
+def test_unparseable_feed_is_a_failure_not_a_crash(tmp_path):
+    (tmp_path / 'good.py').write_text("INTERVAL = 30\n\ndef fetch():\n    return {'AAA': 1.0}\n", encoding='utf-8')
+    (tmp_path / 'broken.py').write_text("INTERVAL = (\n", encoding='utf-8')
+    (tmp_path / 'binary.py').write_bytes(b'INTERVAL = 5\n\xff\xfe\n')
+
+    runner = FeedRunner(feeds_dir=str(tmp_path), default_interval=60, max_backoff=600)
+
+    assert runner.feeds['good'].interval == 30
+    assert runner.feeds['good'].failures == 0
+    for name in ('broken', 'binary'):
+        feed = runner.feeds[name]
+        assert feed.interval == 60
+        assert feed.consecutive_failures == 1
+        assert feed.last_error.startswith(('SyntaxError', 'UnicodeDecodeError'))
+    assert [feed.name for feed in runner.due(time.time())] == ['good']
+
+    # Reloading before the backoff runs out does not pile up further failures.
+    runner.reload()
+    assert runner.feeds['broken'].consecutive_failures == 1
@@ -0,0 +1,21 @@
+from datetime import date, timedelta
+import pytest
+from models import db, Investment, HistoricalPrice
+from risk_analytics import portfolio_risk
+
+def test_drawdown_converts_each_holding_before_summing(app):
+    usd, thb = Investment(symbol='USDX', asset_class='Stock'), Investment(symbol='THBX', asset_class='Stock')
+    db.session.add_all([usd, thb])
+    db.session.flush()
+    as_of = date(2024, 1, 10)
+    for i, usd_close in enumerate([100, 80, 50]):
+        day = as_of - timedelta(days=2 - i)
+        db.session.add_all([HistoricalPrice(investment_id=usd.id, date=day, close=usd_close),
+                            HistoricalPrice(investment_id=thb.id, date=day, close=3400)])
+    db.session.commit()
+
+    # One share of each: 100 + 3400 THB (100 USD) falls to 50 + 100, a 25% drawdown in USD.
+    holdings = {'USDX': (1, 50.0, 1.0), 'THBX': (1, 100.0, 1 / 34)}
+    metrics = portfolio_risk(holdings, None, 30, as_of=as_of)
+
+    assert metrics['max_drawdown'] == pytest.approx(25.0)
@@ -0,0 +1,19 @@
+from sqlalchemy import inspect
+from models import db
+from schema import upgrade_schema
+
+def test_upgrade_adds_missing_tables_columns_and_indexes(app):
+    conn = db.session.connection()
+    for sql in ('DROP TABLE corporate_action', 'ALTER TABLE user DROP COLUMN is_admin',
+                'ALTER TABLE bond DROP COLUMN market_price', 'DROP INDEX ix_cash_transaction_from_date'):
+        conn.exec_driver_sql(sql)
+    db.session.commit()
+
+    assert upgrade_schema() == [
+        'CREATE TABLE corporate_action',
+        'ALTER TABLE user ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT 0',
+        'ALTER TABLE bond ADD COLUMN market_price FLOAT',
+        'CREATE INDEX IF NOT EXISTS ix_cash_transaction_from_date ON cash_transaction (from_account_id, date)',
+    ]
+    assert upgrade_schema() == []
+    assert 'is_admin' in {column['name'] for column in inspect(db.engine).get_columns('user')}
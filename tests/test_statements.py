@@ -0,0 +1,94 @@
+from datetime import date
+import pytest
+from flask import g
+from models import db, User, Investment, Transaction, PeriodSnapshot
+from statements import get_statement_figures, compute_period, close_period
+from aggregates import period_totals
+
+def _trade(user, investment, day, txn_type, price, quantity):
+    return Transaction(user_id=user.id, investment_id=investment.id, date=day, transaction_type=txn_type,
+                       transaction_price=price, quantity=quantity)
+
+def test_lot_method_change_marks_snapshots_stale(app):
+    user = User(username='lots')
+    user.set_password('password')
+    investment = Investment(symbol='LOT', asset_class='Stock')
+    db.session.add_all([user, investment])
+    db.session.flush()
+    db.session.add_all([_trade(user, investment, date(2023, 1, 10), 'Buy', 10, 1),
+                        _trade(user, investment, date(2023, 2, 10), 'Buy', 50, 1),
+                        _trade(user, investment, date(2023, 3, 10), 'Sell', 60, 1)])
+    db.session.commit()
+    periods = [('2023', date(2023, 1, 1), date(2023, 12, 31))]
+
+    assert get_statement_figures(user.id, 'yearly', periods)[0]['realized_gain'] == pytest.approx(50.0)
+    snapshot = PeriodSnapshot.query.filter_by(user_id=user.id, period_label='2023').one()
+    assert not snapshot.stale
+
+    user.lot_method = 'hifo'
+    db.session.commit()
+
+    assert PeriodSnapshot.query.filter_by(user_id=user.id, period_label='2023').one().stale
+    assert compute_period(user.id, date(2023, 1, 1), date(2023, 12, 31), 'USD')['realized_gain'] == pytest.approx(10.0)
+    assert get_statement_figures(user.id, 'yearly', periods)[0]['realized_gain'] == pytest.approx(10.0)
+
+def test_period_totals_sum_each_range(app):
+    user = User(username='ranges')
+    user.set_password('password')
+    investment = Investment(symbol='RNG', asset_class='Stock')
+    db.session.add_all([user, investment])
+    db.session.flush()
+    db.session.add_all([_trade(user, investment, date(2023, 1, 10), 'Buy', 10, 3),
+                        _trade(user, investment, date(2023, 3, 10), 'Sell', 20, 1),
+                        _trade(user, investment, date(2023, 5, 10), 'Sell', 30, 1)])
+    db.session.commit()
+    periods = [('Q1', date(2023, 1, 1), date(2023, 3, 31)), ('Q2', date(2023, 4, 1), date(2023, 6, 30)),
+               ('Q3', date(2023, 7, 1), date(2023, 9, 30)), ('H1', date(2023, 1, 1), date(2023, 6, 30))]
+
+    gains = [totals['realized_gain'] for totals in period_totals(user.id, periods)]
+
+    assert gains == pytest.approx([10.0, 20.0, 0.0, 30.0])
+
+def test_corporate_action_marks_holders_snapshots_stale(app):
+    holder, other = User(username='holder', is_admin=True), User(username='other')
+    for user in (holder, other):
+        user.set_password('password')
+    investment = Investment(symbol='SPL', asset_class='Stock')
+    db.session.add_all([holder, other, investment])
+    db.session.flush()
+    db.session.add_all([_trade(holder, investment, date(2023, 1, 10), 'Buy', 10, 2),
+                        _trade(holder, investment, date(2024, 9, 10), 'Sell', 8, 2)])
+    db.session.commit()
+    periods = [('2023', date(2023, 1, 1), date(2023, 12, 31))]
+    year_2024 = [('2024', date(2024, 1, 1), date(2024, 12, 31))]
+    for user in (holder, other):
+        get_statement_figures(user.id, 'yearly', periods)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(other.id)
+    form = {'action_type': 'split', 'date': '2024-06-01', 'new_shares': '2', 'old_shares': '1'}
+    assert client.post(f'/investment/{investment.id}/actions', data=form).status_code == 403
+    # Requests share the fixture's app context, so drop the user flask-login remembered in g.
+    g.pop('_login_user', None)
+    with client.session_transaction() as session:
+        session['_user_id'] = str(holder.id)
+    assert client.post(f'/investment/{investment.id}/actions', data=form).status_code == 302
+
+    stale = dict(db.session.query(PeriodSnapshot.user_id, PeriodSnapshot.stale))
+    assert stale == {holder.id: True, other.id: False}
+    # Two shares at 10 become four at 5, sold at 8: the split leaves the gain where it was.
+    assert period_totals(holder.id, year_2024)[0]['realized_gain'] == pytest.approx(6.0)
+
+def test_closing_a_period_twice_upserts_one_snapshot(app):
+    user = User(username='race')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+
+    # Two workers freezing the same period both reach close_period; the second must not hit the unique key.
+    for _ in range(2):
+        close_period(user.id, 'yearly', '2023', date(2023, 1, 1), date(2023, 12, 31), 'USD')
+        db.session.commit()
+
+    assert PeriodSnapshot.query.filter_by(user_id=user.id, period_label='2023').count() == 1
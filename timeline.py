@@ -0,0 +1,196 @@
+from datetime import date, datetime
+from itertools import groupby
+import numpy as np
+from sqlalchemy import select
+from models import (db, Transaction, CashAccount, CashTransaction, CashLedgerEntry, Dividend, DailyRealizedGain,
+                    HistoricalPrice)
+from cache import LRUCache
+from data_version import get_data_version
+from helpers import (convert_currency, fx_rates, get_price, get_investments, get_quote_currencies, get_lot_method,
+                     price_history_version)
+from aggregates import CASH_FLOW_SIGNS
+from lots import LotBook
+from corporate_actions import split_factors
+
+GRANULARITIES = ('daily', 'weekly', 'monthly', 'quarterly', 'yearly')
+# Balances are read at the end of each period; flows are totalled over it.
+BALANCES = ('investments', 'cost_basis', 'cash', 'net_worth', 'profit_loss')
+FLOWS = ('operating', 'investing', 'dividends', 'realized_gain')
+
+# One daily series per user and currency, from the first activity to today. Every granularity
+# and date range is cut from it, so switching between them never revalues the portfolio.
+_daily_cache = LRUCache(maxsize=256)
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _index(days, value):
+    return int((np.datetime64(_day(value), 'D') - days[0]).astype(int))
+
+def _daily_closes(investment_id, symbol, days):
+    """
+    Closing price on every day in today's shares, carrying the last bar forward; days before
+    any bar use get_price.
+    """
+    h = HistoricalPrice.__table__
+    rows = db.session.execute(select(h.c.date, h.c.close).where(
+        h.c.investment_id == investment_id, h.c.date >= days[0].item(), h.c.date <= days[-1].item())).all()
+    closes = np.full(len(days), np.nan)
+    if rows:
+        splits = split_factors(investment_id)
+        closes[[_index(days, row.date) for row in rows]] = [row.close / splits.factor(row.date) for row in rows]
+    known = np.where(~np.isnan(closes), np.arange(len(days)), 0)
+    closes = closes[np.maximum.accumulate(known)]
+    return np.where(np.isnan(closes), get_price(symbol), closes)
+
+def _lot_states(trades, method, splits):
+    """(trade day, shares held in today's shares, cost of the open lots) after each trade, under the lot method."""
+    book = LotBook(method, splits)
+    states = []
+    for trade in trades:
+        book.apply(trade.transaction_type, trade.quantity, trade.transaction_price, trade.id, trade.lot_id,
+                   trade.date)
+        states.append((_day(trade.date), book.shares, book.cost))
+    return states
+
+def _compute_daily(user_id, currency):
+    today = date.today()
+    t = Transaction.__table__
+    trades = db.session.execute(select(t.c.investment_id, t.c.date, t.c.transaction_type, t.c.quantity,
+                                       t.c.transaction_price, t.c.id, t.c.lot_id)
+                                .where(t.c.user_id == user_id, t.c.investment_id.isnot(None))
+                                .order_by(t.c.investment_id, t.c.date, t.c.id)).all()
+    accounts = dict(db.session.execute(select(CashAccount.id, CashAccount.currency)
+                                       .where(CashAccount.user_id == user_id)).all())
+    e = CashLedgerEntry.__table__
+    entries = db.session.execute(select(e.c.account_id, e.c.date, e.c.amount)
+                                 .where(e.c.account_id.in_(accounts))).all() if accounts else []
+    # Flows come from their source rows rather than DailyFlow, whose daily totals mix currencies.
+    c = CashTransaction.__table__
+    cash_flows = db.session.execute(
+        select(c.c.transaction_type, c.c.from_account_id, c.c.to_account_id, c.c.date, c.c.amount)
+        .where(c.c.transaction_type.in_(list(CASH_FLOW_SIGNS)),
+               c.c.from_account_id.in_(accounts) | c.c.to_account_id.in_(accounts))).all() if accounts else []
+    d = Dividend.__table__
+    dividends = db.session.execute(select(d.c.investment_id, d.c.date, d.c.amount).where(d.c.user_id == user_id)).all()
+    g = DailyRealizedGain.__table__
+    gains = db.session.execute(select(g.c.investment_id, g.c.day, g.c.amount).where(g.c.user_id == user_id)).all()
+    # Future-dated rows only count once their day arrives.
+    trades = [row for row in trades if _day(row.date) <= today]
+    entries = [row for row in entries if _day(row.date) <= today]
+    cash_flows = [row for row in cash_flows if _day(row.date) <= today]
+    dividends = [row for row in dividends if row.date <= today]
+    gains = [row for row in gains if row.day <= today]
+
+    first = min([_day(row.date) for row in trades + entries + cash_flows + dividends]
+                + [row.day for row in gains] + [today])
+    days = np.arange(np.datetime64(first, 'D'), np.datetime64(today, 'D') + 1)
+    n = len(days)
+    series = {name: np.zeros(n) for name in ('investments', 'cost_basis', 'cash') + FLOWS}
+
+    investments = {inv.id: inv for inv in get_investments()}
+    quote_currencies = get_quote_currencies(user_id)
+    lot_method = get_lot_method(user_id)
+    holdings = []
+    for investment_id, rows in groupby(trades, key=lambda row: row.investment_id):
+        states = _lot_states(rows, lot_method, split_factors(investment_id))
+        # Each day takes the holding left by the last trade on or before it.
+        last = np.searchsorted([_index(days, day) for day, _, _ in states], np.arange(n), side='right') - 1
+        shares = np.where(last >= 0, np.array([s for _, s, _ in states])[last], 0.0)
+        cost = np.where(last >= 0, np.array([c for _, _, c in states])[last], 0.0)
+        rate = convert_currency(1.0, quote_currencies.get(investment_id, 'USD'), currency)
+        symbol = investments[investment_id].symbol
+        series['investments'] += shares * _daily_closes(investment_id, symbol, days) * rate
+        series['cost_basis'] += cost * rate
+        holdings.append((symbol, shares[-1], rate))
+
+    for account_id, rows in groupby(sorted(entries, key=lambda row: row.account_id), key=lambda row: row.account_id):
+        movements = np.zeros(n)
+        rows = list(rows)
+        np.add.at(movements, [_index(days, row.date) for row in rows], [row.amount for row in rows])
+        series['cash'] += np.cumsum(movements) * convert_currency(1.0, accounts[account_id], currency)
+
+    rates = {code: convert_currency(1.0, code, currency) for code in set(accounts.values())}
+    for row in cash_flows:
+        account_attr, operating, investing = CASH_FLOW_SIGNS[row.transaction_type]
+        account_id = getattr(row, account_attr)
+        if account_id in accounts and row.amount is not None:
+            amount = row.amount * rates[accounts[account_id]]
+            series['operating'][_index(days, row.date)] += operating * amount
+            series['investing'][_index(days, row.date)] += investing * amount
+    # Dividends and realized gains are kept in each position's quote currency.
+    for name, rows, day in (('dividends', dividends, 'date'), ('realized_gain', gains, 'day')):
+        if rows:
+            np.add.at(series[name], [_index(days, getattr(row, day)) for row in rows],
+                      [convert_currency(row.amount, quote_currencies.get(row.investment_id, 'USD'), currency)
+                       for row in rows])
+    return {'days': days, 'holdings': holdings, **series}
+
+def daily_series(user_id, currency):
+    """
+    The user's day-by-day portfolio in currency, cached until their data, the stored price
+    history or the exchange rates change. Today's holdings are repriced at the live price on
+    every call; earlier days use closing prices.
+    """
+    key = (user_id, get_data_version(user_id), currency, date.today(), price_history_version(), fx_rates(currency))
+    base = _daily_cache.get_or_compute(key, lambda: _compute_daily(user_id, currency))
+    investments = base['investments'].copy()
+    investments[-1] = sum(shares * get_price(symbol) * rate for symbol, shares, rate in base['holdings'] if shares)
+    return {**base, 'investments': investments,
+            'net_worth': investments + base['cash'],
+            'profit_loss': investments - base['cost_basis']}
+
+def _period_ids(days, granularity):
+    """An integer per day that changes exactly where a new period of the granularity starts."""
+    if granularity == 'daily':
+        return days.astype(int)
+    if granularity == 'weekly':
+        ordinal = days.astype(int)
+        return ordinal - (ordinal + 3) % 7  # Monday of the week; 1970-01-01 was a Thursday
+    if granularity == 'yearly':
+        return days.astype('datetime64[Y]').astype(int)
+    months = days.astype('datetime64[M]').astype(int)
+    return months // 3 if granularity == 'quarterly' else months
+
+def _label(first_day, granularity):
+    if granularity in ('daily', 'weekly'):
+        return first_day.isoformat()
+    if granularity == 'monthly':
+        return first_day.strftime('%Y-%m')
+    if granularity == 'quarterly':
+        return f"{first_day.year}-Q{(first_day.month - 1) // 3 + 1}"
+    return str(first_day.year)
+
+def resample(series, granularity, start=None, end=None):
+    """
+    Cut [start, end] out of a daily series and roll it up to the granularity: balances take
+    each period's last day and flows sum over the period. Periods at either edge are partial
+    when the range starts or ends inside them. Returns 'label', 'start' and 'end' lists and
+    an array per series name.
+    """
+    days = series['days']
+    lo = 0 if start is None else int(np.searchsorted(days, np.datetime64(start, 'D')))
+    hi = len(days) if end is None else int(np.searchsorted(days, np.datetime64(end, 'D'), side='right'))
+    result = {'label': [], 'start': [], 'end': [], **{name: np.zeros(0) for name in BALANCES + FLOWS}}
+    if lo >= hi:
+        return result
+    days = days[lo:hi]
+    ids = _period_ids(days, granularity)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(days)] - 1
+    result['start'] = [day.item() for day in days[starts]]
+    result['end'] = [day.item() for day in days[ends]]
+    result['label'] = [_label(day, granularity) for day in result['start']]
+    for name in BALANCES:
+        result[name] = series[name][lo:hi][ends]
+    for name in FLOWS:
+        result[name] = np.add.reduceat(series[name][lo:hi], starts)
+    return result
+
+def portfolio_timeline(user_id, currency, granularity='monthly', start=None, end=None):
+    """Rows of the user's portfolio per period between start and end (dates, inclusive)."""
+    periods = resample(daily_series(user_id, currency), granularity, start, end)
+    return [{'period': label, 'start': period_start, 'end': period_end, 'day': period_end.toordinal(),
+             **{name: round(float(periods[name][i]), 2) for name in BALANCES + FLOWS}}
+            for i, (label, period_start, period_end) in enumerate(zip(periods['label'], periods['start'],
+                                                                      periods['end']))]
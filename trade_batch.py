@@ -0,0 +1,155 @@
+from datetime import datetime
+from models import db, Investment, Transaction, CashAccount, CashTransaction, Position
+from helpers import log_activity, commit_with_retry, SUPPORTED_CURRENCIES
+from cash_ledger import forbid_overdraft
+
+MAX_TRADES = 5000
+ASSET_CLASSES = ('Stock', 'Fixed Income Bond', 'Crypto', 'Commodities', 'Other')
+
+def _text(trade, name):
+    value = trade.get(name)
+    return str(value).strip() if value is not None else ''
+
+def validate_trades(raw_trades, user_id):
+    """
+    Check every trade before anything is written. Each trade names its investment by symbol;
+    an unknown symbol is created when the trade gives its asset_class. Returns (trades, errors),
+    where errors lists {'row', 'error'} and trades holds the cleaned values when there are none.
+    """
+    if len(raw_trades) > MAX_TRADES:
+        return [], [{'row': None, 'error': f"At most {MAX_TRADES} trades per batch"}]
+    investments = {inv.symbol.upper(): inv for inv in Investment.query.all()}
+    accounts = {acc.id: acc for acc in CashAccount.query.filter_by(user_id=user_id).all()}
+    trades, errors, new_symbols, lot_checks = [], [], {}, []
+    for row, trade in enumerate(raw_trades, start=1):
+        def fail(message):
+            errors.append({'row': row, 'error': message})
+        if not isinstance(trade, dict):
+            fail("Trade must be an object")
+            continue
+        symbol = _text(trade, 'symbol').upper()
+        txn_type = _text(trade, 'transaction_type').capitalize()
+        try:
+            txn_date = datetime.strptime(_text(trade, 'date'), '%Y-%m-%d').date()
+        except ValueError:
+            fail("Invalid date format. Please use YYYY-MM-DD.")
+            continue
+        try:
+            price = float(trade.get('transaction_price'))
+            quantity = float(trade.get('quantity'))
+        except (TypeError, ValueError):
+            fail("Invalid numeric value in transaction price or quantity")
+            continue
+        if price < 0 or quantity < 0:
+            fail("Transaction price and quantity must be non-negative")
+            continue
+        if txn_type not in ('Buy', 'Sell'):
+            fail("Transaction type must be Buy or Sell")
+            continue
+        quote_currency = _text(trade, 'quote_currency').upper() or None
+        if quote_currency and quote_currency not in SUPPORTED_CURRENCIES:
+            fail(f"Unsupported quote currency {quote_currency}")
+            continue
+        account = None
+        if _text(trade, 'cash_account_id'):
+            try:
+                account = accounts.get(int(_text(trade, 'cash_account_id')))
+            except ValueError:
+                pass
+            if account is None:
+                fail("Unknown cash account")
+                continue
+        if not symbol:
+            fail("Symbol is required")
+            continue
+        lot_id = None
+        if txn_type == 'Sell' and _text(trade, 'lot_id'):
+            try:
+                lot_id = int(_text(trade, 'lot_id'))
+            except ValueError:
+                fail("Lot must be a transaction ID")
+                continue
+            lot_checks.append((row, lot_id, symbol))
+        if symbol not in investments and symbol not in new_symbols:
+            asset_class = _text(trade, 'asset_class')
+            if asset_class not in ASSET_CLASSES:
+                fail(f"Unknown symbol {symbol}; give an asset_class to create it")
+                continue
+            new_symbols[symbol] = {'symbol': symbol, 'asset_class': asset_class,
+                                   'description': _text(trade, 'description') or symbol,
+                                   'wallet_address': _text(trade, 'wallet_address') or None,
+                                   'price_feed': _text(trade, 'price_feed') or None}
+        trades.append({
+            'symbol': symbol,
+            'date': txn_date,
+            'transaction_type': txn_type,
+            'transaction_price': price,
+            'quantity': quantity,
+            'quote_currency': quote_currency or (account.currency if account else 'USD'),
+            'broker_note': _text(trade, 'broker_note') or None,
+            'lot_id': lot_id,
+            'cash_account': account,
+            'new_investment': new_symbols.get(symbol),
+        })
+    # Lots must be earlier buys of the same investment; one query checks them all.
+    if lot_checks:
+        buys = dict(db.session.query(Transaction.id, Investment.symbol).join(
+            Investment, Investment.id == Transaction.investment_id).filter(
+            Transaction.id.in_({lot_id for _, lot_id, _ in lot_checks}), Transaction.user_id == user_id,
+            Transaction.transaction_type == 'Buy').all())
+        for row, lot_id, symbol in lot_checks:
+            if buys.get(lot_id, '').upper() != symbol:
+                errors.append({'row': row, 'error': f"Lot {lot_id} is not one of your buys of {symbol}"})
+    return (trades if not errors else []), errors
+
+def record_trades(trades, user_id):
+    """
+    Write validated trades in one database transaction: new investments, the trades, one cash
+    transaction per funded trade, and a position for each newly traded investment. The single
+    flush lets the ledger move each cash account once for the whole batch and the aggregate
+    listeners refresh each touched position once. Accounts the batch debits may not go below
+    zero: InsufficientFunds is raised and nothing is written. Returns the new Transaction rows.
+    """
+    def stage():
+        investments = {inv.symbol.upper(): inv for inv in Investment.query.all()}
+        created = []
+        for trade in trades:
+            spec = trade['new_investment']
+            if spec and spec['symbol'] not in investments:
+                investments[spec['symbol']] = Investment(**spec)
+                created.append(investments[spec['symbol']])
+        db.session.add_all(created)
+        db.session.flush()
+        rows, cash_rows, first_currency = [], [], {}
+        for trade in trades:
+            investment = investments[trade['symbol']]
+            rows.append(Transaction(investment_id=investment.id, user_id=user_id, date=trade['date'],
+                                    transaction_type=trade['transaction_type'],
+                                    transaction_price=trade['transaction_price'], quantity=trade['quantity'],
+                                    broker_note=trade['broker_note'], quote_currency=trade['quote_currency'],
+                                    lot_id=trade['lot_id']))
+            first_currency.setdefault(investment.id, trade['quote_currency'])
+            account = trade['cash_account']
+            if account is not None:
+                buy = trade['transaction_type'] == 'Buy'
+                cash_rows.append(CashTransaction(
+                    date=trade['date'],
+                    transaction_type='investment_buy' if buy else 'investment_sell',
+                    from_account_id=account.id if buy else None,
+                    to_account_id=None if buy else account.id,
+                    amount=trade['transaction_price'] * trade['quantity']
+                ))
+                if buy:
+                    # Checked against the account's net movement, so sells in the batch can fund its buys.
+                    forbid_overdraft(db.session, account.id)
+        held = {investment_id for (investment_id,) in db.session.query(Position.investment_id).filter(
+            Position.user_id == user_id, Position.investment_id.in_(first_currency))}
+        positions = [Position(user_id=user_id, investment_id=investment_id, quote_currency=currency)
+                     for investment_id, currency in first_currency.items() if investment_id not in held]
+        db.session.add_all(rows + cash_rows + positions)
+        for investment in created:
+            log_activity("New Investment Added", f"Investment {investment.symbol} added.", commit=False)
+        log_activity("Batch Trades Recorded", f"{len(rows)} transactions recorded across "
+                     f"{len(first_currency)} investments.", commit=False)
+        return rows
+    return commit_with_retry(stage)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import queue
+import threading
+from models import Bond
+from cache import LRUCache
+from data_version import get_data_version
+from helpers import (compute_user_investment, get_price, get_quote_currencies, convert_amounts, get_investments,
+                     get_cash_accounts)
+import price_table
+
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 32
+
+# Holdings only change with the user's data, so ticks reprice them without touching the ledger.
+_holdings_cache = LRUCache(maxsize=1024)
+
+def load_holdings(user_id):
+    key = (user_id, get_data_version(user_id))
+    return _holdings_cache.get_or_compute(key, lambda: _compute_holdings(user_id))
+
+def _compute_holdings(user_id):
+    from bond_analytics import analyze_bonds
+    quote_currencies = get_quote_currencies(user_id)
+    positions = []
+    for inv in get_investments():
+        shares, avg_cost = compute_user_investment(inv, user_id)
+        positions.append((inv.id, inv.symbol, shares, avg_cost, quote_currencies.get(inv.id, 'USD')))
+    fixed = [(acc.balance, acc.currency) for acc in get_cash_accounts(user_id)]
+    bonds = Bond.query.filter_by(user_id=user_id).all()
+    fixed += [(a['market_value'], 'USD') for a in analyze_bonds(bonds).values()]
+    return {'positions': positions, 'fixed': fixed}
+
+def value_portfolio(user_id, currencies):
+    """
+    Price every position once and total the net worth in each requested reporting currency.
+    """
+    holdings = load_holdings(user_id)
+    positions = {}
+    amounts = list(holdings['fixed'])
+    for inv_id, symbol, shares, avg_cost, quote_currency in holdings['positions']:
+        price = get_price(symbol)
+        positions[inv_id] = {
+            'price': price,
+            'value': round(shares * price, 2),
+            'profit_loss': round((price - avg_cost) * shares, 2),
+        }
+        amounts.append((shares * price, quote_currency))
+    return {currency: {'currency': currency, 'positions': positions,
+                       'net_worth': round(convert_amounts(amounts, currency), 2)}
+            for currency in currencies}
+
+def diff_valuation(previous, current):
+    """Only the positions and total that changed since the previous message."""
+    if previous is None:
+        return current
+    changed = {inv_id: values for inv_id, values in current['positions'].items()
+               if previous['positions'].get(inv_id) != values}
+    if not changed and previous['net_worth'] == current['net_worth']:
+        return None
+    return {'currency': current['currency'], 'positions': changed, 'net_worth': current['net_worth']}
+
+def format_event(payload):
+    return f"event: valuation\ndata: {json.dumps(payload)}\n\n"
+
+class ValuationHub:
+    """
+    Per-process fan-out of live valuations. An asyncio loop on a background thread watches the
+    shared price table's sequence number; on every published batch it values each subscribed
+    user once per reporting currency and hands the same encoded delta to every open tab.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.subscribers = {}
+        self.last_sent = {}
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='valuation-hub', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._watch_prices())
+
+    async def _watch_prices(self):
+        last_seq = price_table.current_sequence()
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            seq = price_table.current_sequence()
+            if seq == last_seq or (seq is not None and seq % 2):
+                continue
+            last_seq = seq
+            with self.lock:
+                users = {}
+                for user_id, currency in self.subscribers:
+                    users.setdefault(user_id, set()).add(currency)
+            await asyncio.gather(*(self.loop.run_in_executor(None, self._publish, user_id, currencies)
+                                   for user_id, currencies in users.items()))
+
+    def _publish(self, user_id, currencies):
+        try:
+            with self.app.app_context():
+                valuations = value_portfolio(user_id, currencies)
+        except Exception:
+            self.app.logger.exception("Valuation tick failed for user %s", user_id)
+            return
+        for currency, valuation in valuations.items():
+            key = (user_id, currency)
+            with self.lock:
+                delta = diff_valuation(self.last_sent.get(key), valuation)
+                self.last_sent[key] = valuation
+                targets = list(self.subscribers.get(key, ()))
+            if delta is None:
+                continue
+            message = format_event(delta)
+            for subscriber in targets:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # A stalled tab gets a fresh full snapshot instead of an unbounded backlog.
+                    _drain(subscriber)
+                    subscriber.put_nowait(format_event(valuation))
+
+    def subscribe(self, user_id, currency, snapshot):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.setdefault((user_id, currency), set()).add(subscriber)
+            self.last_sent.setdefault((user_id, currency), snapshot)
+        return subscriber
+
+    def unsubscribe(self, user_id, currency, subscriber):
+        key = (user_id, currency)
+        with self.lock:
+            tabs = self.subscribers.get(key)
+            if tabs is not None:
+                tabs.discard(subscriber)
+                if not tabs:
+                    del self.subscribers[key]
+                    self.last_sent.pop(key, None)
+
+    def stream(self, user_id, currency):
+        """
+        Response body for one tab: a full snapshot, then deltas as prices tick, with
+        keep-alive comments so proxies do not close an idle connection.
+        """
+        snapshot = value_portfolio(user_id, [currency])[currency]
+        subscriber = self.subscribe(user_id, currency, snapshot)
+        def events():
+            try:
+                yield format_event(snapshot)
+                while True:
+                    try:
+                        yield subscriber.get(timeout=HEARTBEAT_SECONDS)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                self.unsubscribe(user_id, currency, subscriber)
+        return events()
+
+def _drain(subscriber):
+    try:
+        while True:
+            subscriber.get_nowait()
+    except queue.Empty:
+        pass
+
+_hub = None
+_hub_lock = threading.Lock()
+
+def get_hub(app):
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = ValuationHub(app)
+        return _hub